@@ -12,15 +12,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import json
+import os
 import signal
 import sys
+import threading
 from types import FrameType
+from typing import Callable, Dict, Optional, Union
 
-from flask import Flask
+from flask import Flask, jsonify, request, Response, url_for
 
+from integrations import stats
+from integrations.analyses import NORMALIZERS, RUNNERS
+from utils import metrics
+from utils.jobs import JobQueue, JOBS_DB
 from utils.logging import logger
+from utils.read_pool import ReadOnlyPool
+from utils.ttl_cache import TTLCache
+
+STATS_DB = os.environ.get("STATS_DB", "saas_db.sqlite")
+STATS_CACHE_TTL = float(os.environ.get("STATS_CACHE_TTL", "30"))
+STATS_POOL_SIZE = int(os.environ.get("STATS_POOL_SIZE", "8"))  # gunicorn runs 8 threads
 
 app = Flask(__name__)
+_job_queue_lock = threading.Lock()
+_stats_lock = threading.Lock()
 
 
 @app.route("/")
@@ -34,7 +51,99 @@ def hello() -> str:
     return "Hello, World!"
 
 
+def job_queue() -> JobQueue:
+    # Created on first use, so importing the app touches no database
+    with _job_queue_lock:
+        if "JOB_QUEUE" not in app.config:
+            app.config["JOB_QUEUE"] = JobQueue(JOBS_DB, RUNNERS)
+        return app.config["JOB_QUEUE"]
+
+
+@app.route("/analyses", methods=["POST"])
+def create_analysis() -> tuple:
+    """Queue an analysis and return its id right away; the work runs on the
+    job pool, not on this request thread"""
+    body = request.get_json(silent=True) or {}
+    kind = body.get("kind")
+    if kind not in NORMALIZERS:
+        return jsonify(error=f"kind must be one of {sorted(NORMALIZERS)}"), 400
+    try:
+        params = NORMALIZERS[kind](body.get("params") or {})
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    job_id, created = job_queue().submit(kind, params)
+    logger.info("analysis queued", job_id=job_id, kind=kind, deduplicated=not created)
+    location = url_for("get_analysis", job_id=job_id)
+    return jsonify(id=job_id, deduplicated=not created, url=location), 202, {"Location": location}
+
+
+@app.route("/analyses/<job_id>", methods=["GET"])
+def get_analysis(job_id: str) -> tuple:
+    job = job_queue().get(job_id)
+    if job is None:
+        return jsonify(error="analysis not found"), 404
+    return jsonify(job), 200
+
+
+def stats_backend() -> tuple:
+    # The pool and the response cache, created on first use
+    with _stats_lock:
+        if "STATS_POOL" not in app.config:
+            app.config["STATS_POOL"] = ReadOnlyPool(STATS_DB, STATS_POOL_SIZE)
+            app.config["STATS_CACHE"] = TTLCache(STATS_CACHE_TTL)
+        return app.config["STATS_POOL"], app.config["STATS_CACHE"]
+
+
+def _stats_response(kind: str, subject: Union[int, str], query: Callable, **options: Optional[str]) -> Response:
+    """Serve `query(db, subject, start, end, **options)` from the response
+    cache, keyed on the normalized parameters, with an ETag so unchanged data
+    costs clients a 304 and no body"""
+    try:
+        start, end = stats.date_range(request.args.get("start"), request.args.get("end"))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    pool, cache = stats_backend()
+
+    def compute() -> Dict:
+        with pool.connection() as db:
+            result = query(db, subject, start, end, **options)
+        body = json.dumps(result, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        return {"body": body, "etag": hashlib.sha1(body).hexdigest()}
+
+    key = (kind, subject, start, end, *sorted(options.items()))
+    cached = cache.get_or_compute(key, compute)
+    response = app.response_class(cached["body"], mimetype="application/json")
+    response.set_etag(cached["etag"])
+    response.cache_control.max_age = int(STATS_CACHE_TTL)
+    return response.make_conditional(request)
+
+
+@app.route("/stats/users/<username>", methods=["GET"])
+def get_user_stats(username: str) -> Response:
+    # A GitHub login; Discord activity needs the Discord user id as well
+    return _stats_response("user", username, stats.user_stats, discord_user_id=request.args.get("discord"))
+
+
+@app.route("/stats/discord/users/<discord_user_id>", methods=["GET"])
+def get_discord_user_stats(discord_user_id: str) -> Response:
+    return _stats_response("discord user", discord_user_id, stats.discord_user_stats)
+
+
+@app.route("/stats/repos/<owner>/<name>", methods=["GET"])
+def get_repo_stats(owner: str, name: str) -> Response:
+    return _stats_response("repo", f"{owner}/{name}", stats.repo_stats)
+
+
+@app.route("/stats/channels/<int:channel_id>", methods=["GET"])
+def get_channel_stats(channel_id: int) -> Response:
+    return _stats_response("channel", channel_id, stats.channel_stats)
+
 
+@app.route("/metrics", methods=["GET"])
+def get_metrics() -> Response:
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 
 def shutdown_handler(signal_int: int, frame: FrameType) -> None:
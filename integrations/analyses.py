@@ -0,0 +1,171 @@
+"""Analyses that can be requested through the Flask app's job API.
+
+Each kind has a `normalize_*` function that validates request parameters and
+puts them in one canonical form (so equal requests deduplicate), and a runner
+that performs the analysis in a job worker thread, see `utils.jobs`.
+"""
+import asyncio
+from datetime import date, datetime
+from functools import lru_cache
+import re
+import sqlite3
+from typing import Any, Dict, Optional, Tuple, TYPE_CHECKING
+
+from utils.jobs import Progress
+
+if TYPE_CHECKING:
+    from integrations.github_integrations.get import GitHubAnalytics
+
+DB_FILE = 'saas_db.sqlite'
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+REPO_NAME = re.compile(r'^[\w.-]+/[\w.-]+$')
+MAX_ROLLING_DAYS = 90
+
+
+def _date(value: object, name: str, required: bool = False) -> Optional[str]:
+    if value in (None, ''):
+        if required:
+            raise ValueError(f'{name} is required')
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value), fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f'{name} must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS')
+
+
+def _date_range(params: Dict, required: bool = False) -> Dict:
+    start = _date(params.get('start_date'), 'start_date', required)
+    end = _date(params.get('end_date'), 'end_date', required)
+    if start and end and start > end:
+        raise ValueError('start_date is after end_date')
+    return {'start_date': start, 'end_date': end}
+
+
+def normalize_github_repo(params: Dict) -> Dict:
+    repo = str(params.get('repo') or '').strip()
+    if not REPO_NAME.match(repo):
+        raise ValueError('repo must be "owner/name"')
+    return {'repo': repo.lower(), **_date_range(params)}
+
+
+def normalize_github_user(params: Dict) -> Dict:
+    username = str(params.get('username') or '').strip()
+    if not username:
+        raise ValueError('username is required')
+    # GitHub logins are case-insensitive, and so is the analysis' lookup
+    return {'username': username.lower(), **_date_range(params)}
+
+
+def normalize_discord_channel(params: Dict) -> Dict:
+    try:
+        channel_id = int(params.get('channel_id'))
+    except (TypeError, ValueError):
+        raise ValueError('channel_id must be an integer')
+    keywords = sorted({str(k).strip().lower() for k in params.get('keywords') or [] if str(k).strip()})
+    return {'channel_id': channel_id, **_date_range(params, required=True), 'keywords': keywords or None}
+
+
+def normalize_discord_rolling(params: Dict) -> Dict:
+    try:
+        channel_id = int(params.get('channel_id'))
+        days = int(params.get('days') or 14)
+    except (TypeError, ValueError):
+        raise ValueError('channel_id and days must be integers')
+    if not 1 <= days <= MAX_ROLLING_DAYS:
+        raise ValueError(f'days must be between 1 and {MAX_ROLLING_DAYS}')
+    end_day = params.get('end_day')
+    if end_day:
+        try:
+            end_day = date.fromisoformat(str(end_day)).isoformat()
+        except ValueError:
+            raise ValueError('end_day must be YYYY-MM-DD')
+    return {'channel_id': channel_id, 'days': days, 'end_day': end_day or None}
+
+
+def _datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S') if value else None
+
+
+@lru_cache(maxsize=None)
+def _github() -> 'GitHubAnalytics':
+    from integrations.github_integrations.get import GitHubAnalytics
+
+    return GitHubAnalytics()
+
+
+@lru_cache(maxsize=None)
+def _discord_chains() -> Tuple[Any, Tuple[Any, Any]]:
+    from integrations.discord.analysis.llm import build_llm
+    from integrations.discord.analysis.summarize import build_chains
+
+    llm = build_llm()
+    return llm, build_chains(llm)
+
+
+def run_github_repo(params: Dict, progress: Progress) -> Dict:
+    progress(0.1, 'collecting contributions')
+    return _github().analyze_contributions(
+        params['repo'], _datetime(params['start_date']), _datetime(params['end_date'])
+    )
+
+
+def run_github_user(params: Dict, progress: Progress) -> Dict:
+    progress(0.1, 'collecting contributions')
+    run_id = _github().analyze_user_contributions(
+        params['username'], _datetime(params['start_date']), _datetime(params['end_date'])
+    )
+    # The analysis stores one row per repository the user contributed to
+    with sqlite3.connect(DB_FILE) as db:
+        rows = db.execute(
+            """
+            SELECT repo_name, total_commits, lines_added, lines_deleted, date
+            FROM user_contributions WHERE run_id = ?
+            """,
+            (run_id,),
+        ).fetchall()
+    columns = ('repo_name', 'total_commits', 'lines_added', 'lines_deleted', 'date')
+    return {'username': params['username'], 'repositories': [dict(zip(columns, row)) for row in rows]}
+
+
+def run_discord_channel(params: Dict, progress: Progress) -> Dict:
+    from integrations.discord.analysis.runner import analyze_channels
+
+    progress(0.05, 'loading model')
+    llm, (chain, reduce_chain) = _discord_chains()
+    progress(0.1, 'summarizing messages')
+    [result] = asyncio.run(analyze_channels(
+        [params], chain, reduce_chain, DB_FILE, model=getattr(llm, 'model_name', None), outbox=True,
+    ))
+    if result['status'] == 'failed':
+        raise RuntimeError(result['error'])
+    return result
+
+
+def run_discord_rolling(params: Dict, progress: Progress) -> Dict:
+    from integrations.discord.analysis.rolling import rolling_report
+
+    progress(0.05, 'loading model')
+    llm, (chain, reduce_chain) = _discord_chains()
+    progress(0.1, 'summarizing changed days')
+    end_day = date.fromisoformat(params['end_day']) if params['end_day'] else None
+    return asyncio.run(rolling_report(
+        params['channel_id'], chain, reduce_chain, params['days'], end_day, DB_FILE,
+        model=getattr(llm, 'model_name', None),
+    ))
+
+
+NORMALIZERS = {
+    'github_repo': normalize_github_repo,
+    'github_user': normalize_github_user,
+    'discord_channel': normalize_discord_channel,
+    'discord_rolling': normalize_discord_rolling,
+}
+
+RUNNERS = {
+    'github_repo': run_github_repo,
+    'github_user': run_github_user,
+    'discord_channel': run_discord_channel,
+    'discord_rolling': run_discord_rolling,
+}
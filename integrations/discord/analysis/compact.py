@@ -0,0 +1,148 @@
+"""Shrink a Discord message window before it is sent to the model.
+
+Chat is verbose in ways that cost tokens without telling the model anything:
+bursts of short messages from one person, "ok"/"thx"/emoji reactions, bot
+announcements, reposts and pasted stack traces hundreds of lines long.
+`compact_messages` removes or folds those while keeping every message that
+carries content, so a typical window needs two to three times fewer tokens.
+"""
+import os
+import re
+from typing import FrozenSet, Iterable, List, NamedTuple, Optional, Sequence
+import unicodedata
+
+from integrations.discord import snowflake
+
+
+class Message(NamedTuple):
+    """A message as returned by get_messages_in_time_range"""
+    content: str
+    created_at: str
+    name: str
+    # Prompt tokens stored with the message (store.message_tokens), if known
+    tokens: Optional[int] = None
+
+
+GROUP_GAP_SECONDS = 5 * 60
+MAX_CHARS = 1200
+MAX_CODE_LINES = 12
+DUPLICATE_WINDOW = 50  # messages a repost is compared against
+SHINGLE_SIZE = 2  # words per shingle
+DUPLICATE_SIMILARITY = 0.7  # Jaccard similarity from which a message is a repeat
+
+BOT_NAMES = {
+    name.strip().lower()
+    for name in os.environ.get('DISCORD_BOT_NAMES', '').split(',')
+    if name.strip()
+}
+
+LOW_INFORMATION = {
+    'ok', 'okay', 'k', 'kk', 'lol', 'lmao',
+    'haha', 'hahaha', 'thx', 'thanks', 'ty', 'thank you', 'nice', 'cool', 'np',
+    '+1', 'gm', 'gn',
+}
+
+CUSTOM_EMOJI = re.compile(r'<a?:\w+:\d+>')
+CODE_BLOCK = re.compile(r'```(\w*)\n?(.*?)```', re.DOTALL)
+
+
+def _is_noise(content: str) -> bool:
+    """Empty, emoji/punctuation only, or a bare acknowledgement"""
+    text = CUSTOM_EMOJI.sub('', content).strip()
+    if not any(unicodedata.category(c)[0] in 'LN' for c in text):
+        return True
+    return text.lower().rstrip('!. ') in LOW_INFORMATION
+
+
+def _normalize(content: str) -> str:
+    return ' '.join(re.sub(r'[^\w\s]', '', content.lower()).split())
+
+
+def _shingles(key: str, size: int = SHINGLE_SIZE) -> FrozenSet[str]:
+    words = key.split()
+    if len(words) <= size:
+        return frozenset([key])
+    return frozenset(' '.join(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def _is_repeat(shingles: FrozenSet[str], recent: Sequence[FrozenSet[str]], threshold: float) -> bool:
+    # Jaccard similarity of the word shingles: rewordings of a recent
+    # message ("deploy is failing on staging again") count as repeats
+    for other in recent:
+        if len(shingles & other) >= threshold * len(shingles | other):
+            return True
+    return False
+
+
+def _shorten_lines(lines: List[str], max_lines: int) -> List[str]:
+    if len(lines) <= max_lines:
+        return lines
+    head, tail = max_lines // 2, max_lines // 4
+    omitted = len(lines) - head - tail
+    return lines[:head] + [f'[... {omitted} lines omitted ...]'] + lines[-tail:]
+
+
+def shorten_content(content: str, max_chars: int = MAX_CHARS, max_code_lines: int = MAX_CODE_LINES) -> str:
+    """Cut code blocks and pasted logs down to their first and last lines,
+    then the middle of anything still longer than `max_chars`"""
+
+    def code(match: re.Match) -> str:
+        lines = _shorten_lines(match.group(2).rstrip('\n').split('\n'), max_code_lines)
+        return '```{}\n{}\n```'.format(match.group(1), '\n'.join(lines))
+
+    content = CODE_BLOCK.sub(code, content)
+    if '```' not in content:
+        # An unfenced paste (log lines, tracebacks) is shortened the same way
+        content = '\n'.join(_shorten_lines(content.split('\n'), max_code_lines))
+    if len(content) > max_chars:
+        keep = max_chars // 2
+        content = f'{content[:keep]} [... {len(content) - 2 * keep} characters omitted ...] {content[-keep:]}'
+    return content
+
+
+def _as_message(message: Sequence) -> Message:
+    # Plain (content, created_at, name) tuples are accepted too
+    return message if isinstance(message, Message) else Message(*message)
+
+
+def compact_messages(
+    messages: Sequence[Message],
+    bot_names: Optional[Iterable[str]] = None,
+    group_gap_seconds: int = GROUP_GAP_SECONDS,
+    max_chars: int = MAX_CHARS,
+    max_code_lines: int = MAX_CODE_LINES,
+    similarity: float = DUPLICATE_SIMILARITY,
+) -> List[Message]:
+    """Return a shorter, chronologically ordered copy of `messages`"""
+    bots = BOT_NAMES if bot_names is None else {name.lower() for name in bot_names}
+    compacted: List[Message] = []
+    recent: List[FrozenSet[str]] = []
+    last_time = None
+
+    for content, created_at, name, tokens in map(_as_message, messages):
+        content = (content or '').strip()
+        if (name or '').lower() in bots or _is_noise(content):
+            continue
+        shingles = _shingles(_normalize(content))
+        if _is_repeat(shingles, recent, similarity):
+            continue
+        recent = (recent + [shingles])[-DUPLICATE_WINDOW:]
+        shortened = shorten_content(content, max_chars, max_code_lines)
+        if shortened != content:
+            content, tokens = shortened, None  # recounted when chunked
+
+        created = snowflake.parse_timestamp(created_at)
+        if (
+            compacted
+            and compacted[-1].name == name
+            and created and last_time
+            and (created - last_time).total_seconds() <= group_gap_seconds
+        ):
+            # A burst from one author becomes one line, timed by its first message
+            previous = compacted[-1]
+            merged = None if previous.tokens is None or tokens is None else previous.tokens + tokens
+            compacted[-1] = Message(f'{previous.content} | {content}', previous.created_at, name, merged)
+        else:
+            compacted.append(Message(content, created_at, name, tokens))
+        last_time = created or last_time
+    return compacted
@@ -0,0 +1,38 @@
+"""Chat model used by the Discord channel analysis"""
+import os
+
+from utils.llm_cache import get_llm_cache
+from utils.metrics import llm_callbacks
+
+
+def build_llm():
+    # Use Local LLM , if data is sensitive
+    if os.environ.get("USE_LOCAL_LLM") == "True":
+
+        if os.environ.get("OLLAMA_SETUP_DONE") != "True":
+            ## run the private_data.sh and then set the OLLAMA_SETUP_DONE to True
+            raise Exception("Please run the private_data.sh script to set up the local LLM.")
+
+        from utils.local_llm import build_local_llm
+
+        # Preloaded and kept resident; requests beyond the server's
+        # capacity queue locally (OLLAMA_MAX_IN_FLIGHT)
+        return build_local_llm(
+            temperature=0,
+            cache=get_llm_cache(),
+            callbacks=llm_callbacks(),
+            # other params...
+        )
+
+    # Initialize the language model
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model="gpt-4",
+        temperature=0,
+        max_tokens=1000,
+        timeout=None,
+        cache=get_llm_cache(),
+        # Latency and token usage in utils.metrics
+        callbacks=llm_callbacks(),
+    )
@@ -0,0 +1,55 @@
+"""Reading stored Discord messages for analysis"""
+import asyncio
+from datetime import datetime
+from typing import List, Optional
+
+import aiosqlite
+
+from integrations.discord import snowflake
+from integrations.discord.analysis.compact import Message
+from integrations.discord.archive import read_archived_messages
+from integrations.discord.search import keywords_query
+
+DB_FILE = 'saas_db.sqlite'
+
+
+async def get_messages_in_time_range(start_date: str, end_date: str, channel_id: int, keywords: Optional[List[str]] = None, db_file: str = DB_FILE) -> List[Message]:
+    start_timestamp = datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S')
+    end_timestamp = datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S')
+
+    # Messages are keyed by snowflake, so the window is a contiguous id range
+    query = """
+        SELECT m.id, m.content, m.created_at, u.name, m.token_count
+        FROM messages m
+        JOIN users u ON m.user_id = u.id
+        WHERE m.channel_id = ? AND m.id BETWEEN ? AND ?
+    """
+    params = [
+        channel_id,
+        snowflake.from_datetime(start_timestamp),
+        snowflake.from_datetime(end_timestamp, high=True)
+    ]
+
+    # Only keep messages about the given topics, using the full-text index
+    if keywords:
+        query += " AND m.id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)"
+        params.append(keywords_query(keywords))
+
+    query += " ORDER BY m.id"
+
+    # Fetch messages from SQLite database
+    async with aiosqlite.connect(db_file) as db:
+        cursor = await db.cursor()
+        await cursor.execute(query, params)
+        result = await cursor.fetchall()
+
+    # Older messages may have been moved to the monthly archives
+    archived = await asyncio.to_thread(
+        read_archived_messages, channel_id, start_timestamp, end_timestamp, keywords=keywords
+    )
+    if archived:
+        rows = {row[0]: row for row in archived}
+        rows.update({row[0]: row for row in result})
+        result = [rows[key] for key in sorted(rows)]
+
+    return [Message(*row[1:]) for row in result]
@@ -0,0 +1,193 @@
+"""Incremental rolling reports built from per-channel, per-day summaries.
+
+Each (channel, UTC day) is summarized once and checkpointed in
+`channel_day_summaries`. A range report reuses the stored days, summarizes
+only the days that are missing or have changed since their checkpoint, and
+merges the day summaries with the reduce chain. A daily "last 14 days" report
+therefore pays for one new day plus a merge over small JSON summaries.
+
+A checkpoint is stale when the hot database holds a different message count,
+a newer last message or a later edit for that day than when it was written
+(new messages, edits, late backfills). Days whose messages have been
+archived keep their checkpoint.
+
+Run the daily report with `python -m integrations.discord.analysis.rolling
+--channel 1`, or submit a `discord_rolling` job to the Flask app.
+"""
+import argparse
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+import json
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from integrations.discord import snowflake
+from integrations.discord.analysis.messages import DB_FILE, get_messages_in_time_range
+from integrations.discord.analysis.summarize import (
+    CHUNK_TOKENS,
+    MAX_CONCURRENCY,
+    reduce_partials,
+    summarize_messages,
+)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS channel_day_summaries (
+        channel_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        summary TEXT NOT NULL,  -- JSON {summary, insights, actions}
+        message_count INTEGER NOT NULL,
+        last_message_id INTEGER,
+        last_edited_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (channel_id, day)
+    );
+"""
+
+
+async def _init(db: aiosqlite.Connection) -> None:
+    await db.execute(SCHEMA)
+    # Checkpoints from before edits were tracked
+    cursor = await db.execute("PRAGMA table_info(channel_day_summaries)")
+    if 'last_edited_at' not in [row[1] for row in await cursor.fetchall()]:
+        await db.execute("ALTER TABLE channel_day_summaries ADD COLUMN last_edited_at TIMESTAMP")
+
+
+async def _day_state(db: aiosqlite.Connection, channel_id: int, day: date) -> Tuple[int, Optional[int], Optional[str]]:
+    # (count, newest id, latest edit) of the day's hot messages: one range
+    # scan of the (channel_id, id) index
+    cursor = await db.execute(
+        "SELECT COUNT(*), MAX(id), MAX(edited_at) FROM messages WHERE channel_id = ? AND id BETWEEN ? AND ?",
+        (channel_id, *snowflake.day_range(day.isoformat())),
+    )
+    return await cursor.fetchone()
+
+
+async def _stale_days(db_file: str, channel_id: int, days: List[date]) -> Tuple[Dict[date, Dict], Dict[date, Tuple]]:
+    """Return the reusable checkpoints and the (count, last id, last edit)
+    of every day that has to be summarized again"""
+    checkpoints, stale = {}, {}
+    async with aiosqlite.connect(db_file) as db:
+        await _init(db)
+        cursor = await db.execute(
+            """
+            SELECT day, summary, message_count, last_message_id, last_edited_at FROM channel_day_summaries
+            WHERE channel_id = ? AND day BETWEEN ? AND ?
+            """,
+            (channel_id, days[0].isoformat(), days[-1].isoformat()),
+        )
+        stored = {row[0]: row[1:] for row in await cursor.fetchall()}
+
+        # Archived days have no hot rows left, only their aggregates
+        archived = set()
+        try:
+            cursor = await db.execute(
+                """
+                SELECT DISTINCT day FROM channel_user_days
+                WHERE channel_id = ? AND archived AND day BETWEEN ? AND ?
+                """,
+                (channel_id, days[0].isoformat(), days[-1].isoformat()),
+            )
+            archived = {row[0] for row in await cursor.fetchall()}
+        except sqlite3.OperationalError:
+            pass  # no rollup in this database
+
+        for day in days:
+            state = await _day_state(db, channel_id, day)
+            checkpoint = stored.get(day.isoformat())
+            if checkpoint and (state[0] == 0 or state == tuple(checkpoint[1:])):
+                checkpoints[day] = json.loads(checkpoint[0])
+            elif state[0] or day.isoformat() in archived:
+                stale[day] = state
+    return checkpoints, stale
+
+
+async def summarize_day(
+    channel_id: int, day: date, map_chain, reduce_chain, db_file: str = DB_FILE,
+    budget: int = CHUNK_TOKENS, model: Optional[str] = None,
+) -> Dict:
+    # The day's first and last second; the end bound covers all of it
+    start, end = (
+        snowflake.format_timestamp(snowflake.to_datetime(bound)) for bound in snowflake.day_range(day.isoformat())
+    )
+    messages = await get_messages_in_time_range(start, end, channel_id, db_file=db_file)
+    return await summarize_messages(messages, map_chain, reduce_chain, budget, model)
+
+
+async def rolling_report(
+    channel_id: int,
+    map_chain,
+    reduce_chain,
+    days: int = 14,
+    end_day: Optional[date] = None,
+    db_file: str = DB_FILE,
+    budget: int = CHUNK_TOKENS,
+    model: Optional[str] = None,
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> Dict:
+    """Report on the `days` UTC days ending with `end_day` (default today),
+    summarizing only days without a valid checkpoint"""
+    end_day = end_day or datetime.now(timezone.utc).date()
+    window = [end_day - timedelta(days=offset) for offset in reversed(range(days))]
+
+    checkpoints, stale = await _stale_days(db_file, channel_id, window)
+
+    # Summarize the missing days concurrently, bounded like the map step
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def refresh(day: date) -> Dict:
+        async with semaphore:
+            return await summarize_day(channel_id, day, map_chain, reduce_chain, db_file, budget, model)
+
+    fresh = await asyncio.gather(*(refresh(day) for day in stale))
+    if stale:
+        async with aiosqlite.connect(db_file) as db:
+            await db.executemany(
+                """
+                INSERT OR REPLACE INTO channel_day_summaries
+                    (channel_id, day, summary, message_count, last_message_id, last_edited_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (channel_id, day.isoformat(), json.dumps(result), *state)
+                    for (day, state), result in zip(stale.items(), fresh)
+                ],
+            )
+            await db.commit()
+        checkpoints.update(zip(stale, fresh))
+
+    # Day summaries are small, so merging them is a cheap reduce
+    partials = [
+        dict(checkpoints[day], day=day.isoformat())
+        for day in sorted(checkpoints)
+        if checkpoints[day].get("summary") or checkpoints[day].get("actions")
+    ]
+    report = await reduce_partials(partials, reduce_chain, budget, model, max_concurrency)
+    report.pop("day", None)
+    report["days_summarized"] = len(stale)
+    report["days_reused"] = len(checkpoints) - len(stale)
+    return report
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    from integrations.discord.analysis.llm import build_llm
+    from integrations.discord.analysis.summarize import build_chains
+
+    parser = argparse.ArgumentParser(description="Rolling report of a Discord channel")
+    parser.add_argument("--channel", type=int, required=True, help="channel row id")
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--end-day", type=date.fromisoformat, default=None, help="YYYY-MM-DD (default today, UTC)")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+
+    load_dotenv()
+    llm = build_llm()
+    map_chain, reduce_chain = build_chains(llm)
+    report = asyncio.run(rolling_report(
+        args.channel, map_chain, reduce_chain, args.days, args.end_day, args.db,
+        model=getattr(llm, "model_name", None),
+    ))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
@@ -0,0 +1,191 @@
+"""Concurrent analysis of many Discord channels and time windows.
+
+Every job's messages are fetched concurrently (each read uses its own SQLite
+connection), and all LLM calls of all jobs share one semaphore, so the model
+sees at most `max_concurrency` requests in flight no matter how many channels
+are analyzed. Results are written to `channel_analyses` as each job finishes;
+a failing job is recorded as failed without affecting the others.
+
+With `outbox=True`, each job's actions are queued in the Jira outbox in the
+same transaction as its result and delivered by the outbox worker (see
+`integrations.jira.outbox`).
+
+Run with `python -m integrations.discord.analysis.runner --all-channels
+--start "2025-01-20 00:00:00" --end "2025-02-02 23:59:59"`.
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+
+import aiosqlite
+
+from integrations.discord.analysis.messages import DB_FILE, get_messages_in_time_range
+from integrations.discord.analysis.summarize import MAX_CONCURRENCY, summarize_messages
+from integrations.jira.outbox import enqueue_actions, init_outbox
+from utils import tracing
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS channel_analyses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id INTEGER NOT NULL,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL,
+        keywords TEXT,
+        status TEXT NOT NULL,  -- done | failed
+        message_count INTEGER,
+        summary TEXT,
+        insights TEXT,
+        actions TEXT,  -- JSON list
+        error TEXT,
+        duration_ms INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_channel_analyses_channel
+    ON channel_analyses (channel_id, start_date);
+"""
+
+
+class LimitedChain:
+    """A chain whose calls each hold a slot of `semaphore` while they run.
+    Implements the async parts of the LangChain Runnable interface that the
+    summarizer uses."""
+
+    def __init__(self, chain, semaphore: asyncio.Semaphore) -> None:
+        self.chain = chain
+        self.semaphore = semaphore
+
+    async def ainvoke(self, input: Dict, config=None, **kwargs: object) -> str:
+        async with self.semaphore:
+            return await self.chain.ainvoke(input, config, **kwargs)
+
+    async def abatch(self, inputs: List[Dict], config=None, **kwargs: object) -> List[str]:
+        # The semaphore bounds concurrency, so start every call at once
+        return list(await asyncio.gather(*(self.ainvoke(i, config, **kwargs) for i in inputs)))
+
+
+def limit_concurrency(chain, semaphore: asyncio.Semaphore) -> LimitedChain:
+    """Wrap a chain so every call first takes a slot from `semaphore`"""
+    return LimitedChain(chain, semaphore)
+
+
+async def list_channel_ids(db_file: str = DB_FILE) -> List[int]:
+    async with aiosqlite.connect(db_file) as db:
+        cursor = await db.execute("SELECT id FROM channels ORDER BY id")
+        return [row[0] for row in await cursor.fetchall()]
+
+
+@tracing.traced("sqlite.save_analysis")
+async def _save(db: aiosqlite.Connection, lock: asyncio.Lock, job: Dict, row: Dict, outbox: bool = False) -> None:
+    async with lock:
+        cursor = await db.execute(
+            """
+            INSERT INTO channel_analyses
+                (channel_id, start_date, end_date, keywords, status, message_count,
+                 summary, insights, actions, error, duration_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                job["channel_id"], job["start_date"], job["end_date"],
+                json.dumps(job.get("keywords")) if job.get("keywords") else None,
+                row["status"], row.get("message_count"),
+                row.get("summary"), row.get("insights"),
+                json.dumps(row["actions"]) if "actions" in row else None,
+                row.get("error"), row["duration_ms"],
+            ),
+        )
+        if outbox and row.get("actions"):
+            # Committed together: a stored analysis always has its actions queued
+            row["queued"] = await enqueue_actions(db, row["actions"], job["channel_id"], cursor.lastrowid)
+        await db.commit()
+
+
+async def analyze_channels(
+    jobs: List[Dict],
+    map_chain,
+    reduce_chain,
+    db_file: str = DB_FILE,
+    max_concurrency: int = MAX_CONCURRENCY,
+    model: Optional[str] = None,
+    outbox: bool = False,
+) -> List[Dict]:
+    """Analyze every job ({channel_id, start_date, end_date, keywords?}) and
+    return one result per job, in order. With `outbox`, results also list
+    the number of newly queued actions under "queued"."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    map_chain = limit_concurrency(map_chain, semaphore)
+    reduce_chain = limit_concurrency(reduce_chain, semaphore)
+
+    async with aiosqlite.connect(db_file) as db:
+        await db.execute(SCHEMA)
+        await db.execute(INDEX)
+        await init_outbox(db)
+        await db.commit()
+        lock = asyncio.Lock()
+
+        @tracing.traced("discord.analyze_channel")
+        async def run(job: Dict) -> Dict:
+            started = time.perf_counter()
+            try:
+                with tracing.span("sqlite.read_messages"):
+                    messages = await get_messages_in_time_range(
+                        job["start_date"], job["end_date"], job["channel_id"],
+                        keywords=job.get("keywords"), db_file=db_file,
+                    )
+                # The semaphore already bounds concurrency; let abatch fan out
+                if not messages:
+                    output = {"summary": "", "insights": "", "actions": []}
+                else:
+                    output = await summarize_messages(
+                        messages, map_chain, reduce_chain, model=model, max_concurrency=max_concurrency
+                    )
+                row = dict(output, status="done", message_count=len(messages))
+            except Exception as e:
+                row = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+            row["duration_ms"] = int((time.perf_counter() - started) * 1000)
+            tracing.current_span().set(
+                channel_id=job["channel_id"], status=row["status"], messages=row.get("message_count") or 0
+            )
+            await _save(db, lock, job, row, outbox)
+            return dict(job, **row)
+
+        return await asyncio.gather(*(run(job) for job in jobs))
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    from integrations.discord.analysis.llm import build_llm
+    from integrations.discord.analysis.summarize import build_chains
+
+    parser = argparse.ArgumentParser(description="Analyze Discord channels concurrently")
+    parser.add_argument("--channels", type=int, nargs="*", default=[])
+    parser.add_argument("--all-channels", action="store_true")
+    parser.add_argument("--start", required=True, help="YYYY-MM-DD HH:MM:SS")
+    parser.add_argument("--end", required=True, help="YYYY-MM-DD HH:MM:SS")
+    parser.add_argument("--keywords", nargs="*")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    load_dotenv()
+    llm = build_llm()
+    chain, reduce_chain = build_chains(llm)
+
+    async def main() -> None:
+        channels = await list_channel_ids(args.db) if args.all_channels else args.channels
+        jobs = [
+            {"channel_id": channel, "start_date": args.start, "end_date": args.end, "keywords": args.keywords}
+            for channel in channels
+        ]
+        results = await analyze_channels(
+            jobs, chain, reduce_chain, args.db, args.concurrency, getattr(llm, "model_name", None)
+        )
+        for result in results:
+            print(f"channel {result['channel_id']}: {result['status']} in {result['duration_ms']} ms")
+
+    asyncio.run(main())
@@ -0,0 +1,270 @@
+"""Token-budgeted map-reduce summarization of Discord channel messages.
+
+Messages are split into conversations at quiet gaps, conversations are packed
+into chunks that fit a token budget, every chunk is summarized concurrently
+(`chain.abatch`), and the partial results are merged by a reduce prompt. The
+reduce step is itself batched when the partials do not fit one prompt, so a
+busy window adds parallel work rather than sequential calls.
+"""
+from datetime import timedelta
+import json
+import re
+from typing import Dict, List, Optional, Sequence
+
+from integrations.discord import snowflake
+from integrations.discord.analysis.compact import compact_messages, Message
+from utils.tokens import count_tokens
+
+CHUNK_TOKENS = 5000  # message tokens per map prompt; gpt-4 has 8k context
+CONVERSATION_GAP = timedelta(minutes=30)
+MAX_CONCURRENCY = 8
+
+MAP_TEMPLATE = """
+system: You are a helpful assistant that summarizes conversations and extracts useful information.
+human:
+You have the following messages from a Discord channel:
+
+{messages}
+
+Your task:
+1. Summarize the conversation.
+2. Extract key insights such as sentiment, trends, and observations.
+3. Detect actionable tasks. For each task, include:
+   - **Task Summary**
+   - **Detailed Description**
+   - **Priority** (High, Medium, Low)
+   - **Due Date** (if applicable)
+
+Respond in JSON format:
+{{
+  "summary": "...",
+  "insights": "...",
+  "actions": [
+    {{
+      "summary": "...",
+      "description": "...",
+      "priority": "...",
+      "due_date": "..."
+    }}
+  ]
+}}
+"""
+
+REDUCE_TEMPLATE = """
+system: You are a helpful assistant that merges partial analyses of one Discord channel into a single report.
+human:
+The messages of a Discord channel were analyzed in consecutive parts, oldest first.
+These are the partial results, one JSON object per part:
+
+{partials}
+
+Your task:
+1. Write one summary of the whole conversation.
+2. Combine the insights, keeping trends that span several parts.
+3. Merge the actionable tasks: remove duplicates, keep the most complete
+   description and the highest priority of duplicated tasks, and drop tasks a
+   later part reports as done.
+
+Respond in JSON format:
+{{
+  "summary": "...",
+  "insights": "...",
+  "actions": [
+    {{
+      "summary": "...",
+      "description": "...",
+      "priority": "...",
+      "due_date": "..."
+    }}
+  ]
+}}
+"""
+
+
+def build_chains(llm):
+    """Return the (map, reduce) chains for `llm`"""
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+
+    map_chain = ChatPromptTemplate.from_template(MAP_TEMPLATE) | llm | StrOutputParser()
+    reduce_chain = ChatPromptTemplate.from_template(REDUCE_TEMPLATE) | llm | StrOutputParser()
+    return map_chain, reduce_chain
+
+
+def format_message(message: Message) -> str:
+    content, created_at, name = message[:3]
+    return f"[{created_at}] {name}: {content}"
+
+
+def format_conversation(conversation: Sequence[Message]) -> List[str]:
+    """Render a conversation with one absolute timestamp on its first line
+    and minutes since the previous message after that (omitted under a
+    minute), instead of a full timestamp on every line"""
+    lines, previous = [], None
+    for content, created_at, name, *_ in conversation:
+        created = snowflake.parse_timestamp(created_at)
+        if previous is None or created is None:
+            stamp = f"[{created:%Y-%m-%d %H:%M}] " if created else f"[{created_at}] "
+        else:
+            minutes = int((created - previous).total_seconds() // 60)
+            stamp = f"[+{minutes}m] " if minutes else ""
+        lines.append(f"{stamp}{name}: {content}")
+        previous = created or previous
+    return lines
+
+
+def split_conversations(messages: Sequence[Message], gap: timedelta = CONVERSATION_GAP) -> List[List[Message]]:
+    """Group chronologically ordered messages into conversations separated
+    by at least `gap` of silence"""
+    conversations = []
+    previous = None
+    for message in messages:
+        created = snowflake.parse_timestamp(message[1])
+        if not conversations or (previous and created and created - previous >= gap):
+            conversations.append([])
+        conversations[-1].append(message)
+        previous = created or previous
+    return conversations
+
+
+def _line_tokens(message: Message, line: str, model: Optional[str]) -> int:
+    # The count stored with the message already covers a full timestamp and
+    # the author; only messages without one are tokenized here
+    tokens = message[3] if len(message) > 3 else None
+    return tokens if tokens is not None else count_tokens(line, model) + 1
+
+
+def chunk_messages(
+    messages: Sequence[Message], budget: int = CHUNK_TOKENS, model: Optional[str] = None
+) -> List[str]:
+    """Pack formatted messages into chunks of at most `budget` tokens,
+    breaking between conversations where possible and between messages
+    only when one conversation is larger than the budget. Messages are
+    sized by their stored token counts when they carry one."""
+    chunks, current, used = [], [], 0
+
+    def flush() -> None:
+        nonlocal current, used
+        if current:
+            chunks.append("\n".join(current))
+        current, used = [], 0
+
+    for conversation in split_conversations(messages):
+        lines = format_conversation(conversation)
+        sizes = [_line_tokens(message, line, model) for message, line in zip(conversation, lines)]
+        if used + sum(sizes) <= budget:
+            current += lines
+            used += sum(sizes)
+            continue
+
+        flush()
+        for message, line, size in zip(conversation, lines, sizes):
+            if used + size > budget:
+                flush()
+            if not current:
+                # A chunk never starts with a relative timestamp
+                line = format_conversation([message])[0]
+                size = _line_tokens(message, line, model)
+            current.append(line)
+            used += size
+    flush()
+    return chunks
+
+
+def parse_analysis(text: str) -> Dict:
+    """Parse a model response into {summary, insights, actions}, tolerating
+    code fences and chatter around the JSON object"""
+    cleaned = re.sub(r"^```(?:json)?|```$", "", text.strip(), flags=re.MULTILINE).strip()
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    try:
+        data = json.loads(cleaned[start:end + 1])
+    except ValueError:
+        return {"summary": text.strip(), "insights": "", "actions": []}
+    data.setdefault("summary", "")
+    data.setdefault("insights", "")
+    data["actions"] = [a for a in data.get("actions") or [] if isinstance(a, dict)]
+    return data
+
+
+def _group_partials(partials: List[Dict], budget: int, model: Optional[str]) -> List[str]:
+    groups, current, used = [], [], 0
+    for partial in partials:
+        rendered = json.dumps(partial, ensure_ascii=False)
+        size = count_tokens(rendered, model)
+        if current and used + size > budget:
+            groups.append("\n".join(current))
+            current, used = [], 0
+        current.append(rendered)
+        used += size
+    if current:
+        groups.append("\n".join(current))
+    return groups
+
+
+async def reduce_partials(
+    partials: List[Dict],
+    reduce_chain,
+    budget: int = CHUNK_TOKENS,
+    model: Optional[str] = None,
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> Dict:
+    """Merge partial {summary, insights, actions} results into one, level by
+    level, batching each level's reduce prompts"""
+    config = {"max_concurrency": max_concurrency}
+    while len(partials) > 1:
+        groups = _group_partials(partials, budget, model)
+        if len(groups) == len(partials):
+            # Every partial fills a prompt on its own; pair them up anyway
+            groups = [
+                "\n".join(json.dumps(p, ensure_ascii=False) for p in partials[i:i + 2])
+                for i in range(0, len(partials), 2)
+            ]
+        outputs = await reduce_chain.abatch([{"partials": group} for group in groups], config=config)
+        partials = [parse_analysis(output) for output in outputs]
+    return partials[0] if partials else {"summary": "", "insights": "", "actions": []}
+
+
+def compaction_stats(before: Sequence[Message], after: Sequence[Message], model: Optional[str] = None) -> Dict:
+    """Prompt tokens of a window before compaction (one absolute timestamp
+    per message) and after it (as `chunk_messages` renders it)"""
+    tokens_before = sum(_line_tokens(m, format_message(m), model) for m in before)
+    tokens_after = sum(
+        _line_tokens(message, line, model)
+        for conversation in split_conversations(after)
+        for message, line in zip(conversation, format_conversation(conversation))
+    )
+    return {
+        "messages_before": len(before),
+        "messages_after": len(after),
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+    }
+
+
+async def summarize_messages(
+    messages: Sequence[Message],
+    map_chain,
+    reduce_chain,
+    budget: int = CHUNK_TOKENS,
+    model: Optional[str] = None,
+    max_concurrency: int = MAX_CONCURRENCY,
+    compact: bool = True,
+) -> Dict:
+    """Summarize a message window of any size and return the parsed
+    {summary, insights, actions} result, plus the token counts before and
+    after compaction when `compact` is set"""
+    stats = None
+    if compact:
+        compacted = compact_messages(messages)
+        stats = compaction_stats(messages, compacted, model)
+        messages = compacted
+    chunks = chunk_messages(messages, budget, model) or [""]
+    config = {"max_concurrency": max_concurrency}
+
+    outputs = await map_chain.abatch([{"messages": chunk} for chunk in chunks], config=config)
+    partials = [parse_analysis(output) for output in outputs]
+
+    result = await reduce_partials(partials, reduce_chain, budget, model, max_concurrency)
+    if stats:
+        result["compaction"] = stats
+    return result
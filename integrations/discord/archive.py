@@ -0,0 +1,314 @@
+"""Hot/cold tiering for stored Discord messages.
+
+Messages older than the retention period are moved out of the hot database
+into one SQLite file per month (`<archive dir>/messages-YYYY-MM.sqlite`). Each
+archive holds one zlib-compressed JSON block per channel and day, so a time
+window only decompresses the days it touches. The day aggregates stay in the
+hot database: every archived day's rows of the `channel_user_days` rollup
+(see `integrations.discord.store`) are rebuilt from its whole block plus any
+hot messages left that day, and flagged `archived`.
+
+Archives are only written by `archive_old_messages`; readers open them
+read-only.
+
+Environment:
+    DISCORD_ARCHIVE_DIR     where archive files live (default `archive`)
+    DISCORD_RETENTION_DAYS  age after which messages are archived (default 90)
+
+Run the job with `python -m integrations.discord.archive`.
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+import zlib
+
+from integrations.discord import snowflake
+from integrations.discord.store import message_tokens
+
+ARCHIVE_DIR = os.environ.get("DISCORD_ARCHIVE_DIR", "archive")
+RETENTION_DAYS = int(os.environ.get("DISCORD_RETENTION_DAYS", "90"))
+
+ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS message_blocks (
+        channel_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        first_id INTEGER NOT NULL,
+        last_id INTEGER NOT NULL,
+        message_count INTEGER NOT NULL,
+        payload BLOB NOT NULL,  -- zlib(JSON list of messages)
+        PRIMARY KEY (channel_id, day)
+    );
+"""
+
+
+def archive_path(month: str, archive_dir: str = ARCHIVE_DIR) -> str:
+    return os.path.join(archive_dir, f"messages-{month}.sqlite")
+
+
+def _encode(rows: List[Dict]) -> bytes:
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def _decode(payload: bytes) -> List[Dict]:
+    return json.loads(zlib.decompress(payload))
+
+
+def _months_between(start: datetime, end: datetime) -> Iterable[str]:
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield f"{year:04d}-{month:02d}"
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _month_range(month: str) -> Tuple[int, int]:
+    # Lowest and highest snowflake of a YYYY-MM month
+    year, number = int(month[:4]), int(month[5:])
+    start = datetime(year, number, 1, tzinfo=timezone.utc)
+    end = datetime(year + number // 12, number % 12 + 1, 1, tzinfo=timezone.utc)
+    return snowflake.from_datetime(start), snowflake.from_datetime(end) - 1
+
+
+def _fetch_old_messages(hot: sqlite3.Connection, low_id: int, high_id: int) -> List[Dict]:
+    rows = hot.execute(
+        """
+        SELECT m.id, m.channel_id, m.user_id, u.name, m.content, m.created_at, m.edited_at,
+            m.token_count
+        FROM messages m
+        LEFT JOIN users u ON m.user_id = u.id
+        WHERE m.id BETWEEN ? AND ?
+        ORDER BY m.channel_id, m.id
+        """,
+        (low_id, high_id),
+    ).fetchall()
+
+    attachments = defaultdict(list)
+    for message_id, filename, url, content_type in hot.execute(
+        """
+        SELECT message_id, filename, url, content_type FROM attachments
+        WHERE message_id BETWEEN ? AND ?
+        """,
+        (low_id, high_id),
+    ):
+        attachments[message_id].append(
+            {"filename": filename, "url": url, "content_type": content_type}
+        )
+
+    keys = ("id", "channel_id", "user_id", "name", "content", "created_at", "edited_at", "token_count")
+    messages = []
+    for row in rows:
+        message = dict(zip(keys, row))
+        if message["id"] in attachments:
+            message["attachments"] = attachments[message["id"]]
+        messages.append(message)
+    return messages
+
+
+def _write_block(archive: sqlite3.Connection, channel_id: int, day: str, rows: List[Dict]) -> List[Dict]:
+    # A day can be archived in more than one run (late backfills, a cutoff
+    # in the middle of a day), so merge with what is already there
+    existing = archive.execute(
+        "SELECT payload FROM message_blocks WHERE channel_id = ? AND day = ?",
+        (channel_id, day),
+    ).fetchone()
+    merged = {row["id"]: row for row in (_decode(existing[0]) if existing else [])}
+    merged.update({row["id"]: row for row in rows})
+    block = [merged[key] for key in sorted(merged)]
+
+    archive.execute(
+        """
+        INSERT OR REPLACE INTO message_blocks
+            (channel_id, day, first_id, last_id, message_count, payload)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (channel_id, day, block[0]["id"], block[-1]["id"], len(block), _encode(block)),
+    )
+    return block
+
+
+def _rebuild_day(hot: sqlite3.Connection, channel_id: int, day: str, block: List[Dict]) -> None:
+    # The archived block plus whatever is still hot that day
+    totals = defaultdict(lambda: [0, 0, 0, 0])  # [messages, tokens, characters, last id]
+    for row in block:
+        tokens = row.get("token_count")
+        total = totals[row["user_id"]]
+        total[0] += 1
+        total[1] += message_tokens(row["content"]) if tokens is None else tokens
+        total[2] += len(row["content"])
+        total[3] = max(total[3], row["id"])
+
+    hot.execute("DELETE FROM channel_user_days WHERE channel_id = ? AND day = ?", (channel_id, day))
+    hot.executemany(
+        """
+        INSERT INTO channel_user_days
+            (channel_id, day, user_id, messages, tokens, characters, last_message_id, archived)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+        """,
+        [(channel_id, day, user_id, *total) for user_id, total in totals.items()],
+    )
+    hot.execute(
+        """
+        INSERT INTO channel_user_days
+            (channel_id, day, user_id, messages, tokens, characters, last_message_id, archived)
+        SELECT channel_id, ?, user_id, COUNT(*), COALESCE(SUM(token_count), 0),
+            SUM(length(content)), MAX(id), 1
+        FROM messages
+        WHERE channel_id = ? AND id BETWEEN ? AND ?
+        GROUP BY user_id
+        ON CONFLICT(channel_id, day, user_id) DO UPDATE SET
+            messages = messages + excluded.messages,
+            tokens = tokens + excluded.tokens,
+            characters = characters + excluded.characters,
+            last_message_id = MAX(last_message_id, excluded.last_message_id)
+        """,
+        (day, channel_id, *snowflake.day_range(day)),
+    )
+
+
+def _read_block(archive_dir: str, channel_id: int, day: str) -> List[Dict]:
+    path = archive_path(day[:7], archive_dir)
+    if not os.path.exists(path):
+        return []
+    archive = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = archive.execute(
+            "SELECT payload FROM message_blocks WHERE channel_id = ? AND day = ?",
+            (channel_id, day),
+        ).fetchone()
+    finally:
+        archive.close()
+    return _decode(row[0]) if row else []
+
+
+def _migrate_day_stats(hot: sqlite3.Connection, archive_dir: str) -> None:
+    # Archives written while the aggregates lived in their own
+    # channel_day_stats table: move them into the rollup
+    if not hot.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'channel_day_stats'"
+    ).fetchone():
+        return
+    with hot:
+        days = hot.execute("SELECT channel_id, day FROM channel_day_stats WHERE archived").fetchall()
+        for channel_id, day in days:
+            _rebuild_day(hot, channel_id, day, _read_block(archive_dir, channel_id, day))
+        hot.execute("DROP TABLE channel_day_stats")
+
+
+def _archive_month(hot: sqlite3.Connection, month: str, low_id: int, high_id: int, archive_dir: str) -> int:
+    messages = _fetch_old_messages(hot, low_id, high_id)
+    if not messages:
+        return 0
+
+    blocks = defaultdict(list)
+    for message in messages:
+        blocks[(message["channel_id"], message["created_at"][:10])].append(message)
+
+    archive = sqlite3.connect(archive_path(month, archive_dir))
+    try:
+        archive.execute(ARCHIVE_SCHEMA)
+        # Each day's block, merged with what an earlier run archived
+        blocks = {key: _write_block(archive, *key, rows) for key, rows in blocks.items()}
+        archive.commit()
+    finally:
+        archive.close()
+
+    with hot:
+        # Only delete what was archived, not rows that arrived meanwhile
+        archived_ids = [(message["id"],) for message in messages]
+        hot.executemany("DELETE FROM attachments WHERE message_id = ?", archived_ids)
+        hot.executemany("DELETE FROM messages WHERE id = ?", archived_ids)
+        for (channel_id, day), block in blocks.items():
+            _rebuild_day(hot, channel_id, day, block)
+    return len(messages)
+
+
+def archive_old_messages(
+    db_file: str = "saas_db.sqlite",
+    older_than_days: int = RETENTION_DAYS,
+    archive_dir: str = ARCHIVE_DIR,
+    vacuum: bool = False,
+) -> int:
+    """Move messages older than `older_than_days` into monthly archives and
+    return how many were moved. The backlog is moved one month at a time, and
+    a month's messages are only deleted from the hot database once its
+    archive file has been committed."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    cutoff_id = snowflake.from_datetime(cutoff)
+
+    hot = sqlite3.connect(db_file)
+    try:
+        _migrate_day_stats(hot, archive_dir)
+        oldest = hot.execute("SELECT MIN(id) FROM messages WHERE id < ?", (cutoff_id,)).fetchone()[0]
+        if oldest is None:
+            return 0
+
+        os.makedirs(archive_dir, exist_ok=True)
+        moved = 0
+        for month in _months_between(snowflake.to_datetime(oldest), cutoff):
+            low_id, high_id = _month_range(month)
+            moved += _archive_month(hot, month, low_id, min(high_id, cutoff_id - 1), archive_dir)
+        if vacuum:
+            hot.execute("VACUUM")
+        return moved
+    finally:
+        hot.close()
+
+
+def read_archived_messages(
+    channel_id: int,
+    start: datetime,
+    end: datetime,
+    archive_dir: str = ARCHIVE_DIR,
+    keywords: Optional[List[str]] = None,
+) -> List[Tuple[int, str, str, str, Optional[int]]]:
+    """Return (id, content, created_at, name, token_count) for archived
+    messages of a channel in [start, end], oldest first; token_count is None
+    for messages archived before it was stored. Archives have no full-text index,
+    so `keywords` is a case-insensitive substring match."""
+    start_id = snowflake.from_datetime(start)
+    end_id = snowflake.from_datetime(end, high=True)
+    needles = [k.lower() for k in keywords or []]
+
+    result = []
+    for month in _months_between(start, end):
+        path = archive_path(month, archive_dir)
+        if not os.path.exists(path):
+            continue
+        archive = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            blocks = archive.execute(
+                """
+                SELECT payload FROM message_blocks
+                WHERE channel_id = ? AND last_id >= ? AND first_id <= ?
+                ORDER BY first_id
+                """,
+                (channel_id, start_id, end_id),
+            ).fetchall()
+        finally:
+            archive.close()
+
+        for (payload,) in blocks:
+            for row in _decode(payload):
+                if not start_id <= row["id"] <= end_id:
+                    continue
+                if needles and not any(n in row["content"].lower() for n in needles):
+                    continue
+                result.append((
+                    row["id"], row["content"], row["created_at"], row["name"], row.get("token_count")
+                ))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old Discord messages")
+    parser.add_argument("--db", default="saas_db.sqlite")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--vacuum", action="store_true")
+    args = parser.parse_args()
+
+    moved = archive_old_messages(args.db, args.days, args.archive_dir, args.vacuum)
+    print(f"Archived {moved} messages older than {args.days} days")
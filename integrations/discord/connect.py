@@ -1,38 +1,14 @@
 import discord,os
-from discord.ext import commands
-from pprint import pprint 
-from dotenv import load_dotenv
-
 import logging
-import logging.handlers
-import psycopg2
-from psycopg2.extras import execute_values
-
-logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
-logging.getLogger('discord.http').setLevel(logging.INFO)
-
-handler = logging.handlers.RotatingFileHandler(
-    filename='discord.log',
-    encoding='utf-8',
-    maxBytes=32 * 1024 * 1024,  # 32 MiB
-    backupCount=5,  # Rotate through 5 files
-)
-dt_fmt = '%Y-%m-%d %H:%M:%S'
-formatter = logging.Formatter('[{asctime}] [{levelname:<8}] {name}: {message}', dt_fmt, style='{')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-
-
-load_dotenv()
-DISCORD_API_KEY = os.environ.get('DISCORD_API_KEY')
 
+from integrations.discord.log import setup_logging
 
+log = logging.getLogger('discord.connect')
 
 
 class MyClient(discord.Client):
     async def on_ready(self):
-        print(f'Logged on as {self.user}!')
+        log.info('Logged on as %s', self.user)
 
     async def on_message(self, message):
         if message.author == self.user:
@@ -41,22 +17,32 @@ class MyClient(discord.Client):
         if message.content == 'ping':
             await message.channel.send('pong')
 
-        print(f'Message from {message.author}: {message.content}')
-        pprint(message)
+        log.debug('Message %s from %s', message.id, message.author)
+
+
+def main():
+    from dotenv import load_dotenv
+
+    # Records are written to discord.log off the event loop
+    setup_logging()
 
+    load_dotenv()
+    DISCORD_API_KEY = os.environ.get('DISCORD_API_KEY')
 
+    intents = discord.Intents.default()
+    intents.message_content = True
+    client = MyClient(intents=intents)
 
+    # bot = commands.Bot(command_prefix='>', intents=intents)
 
-intents = discord.Intents.default()
-intents.message_content = True
-client = MyClient(intents=intents)
+    # @bot.command()
+    # async def ping(ctx):
+    #     await ctx.send('pong')
 
-# bot = commands.Bot(command_prefix='>', intents=intents)
+    # bot.run(DISCORD_API_KEY)
 
-# @bot.command()
-# async def ping(ctx):
-#     await ctx.send('pong')
+    client.run(DISCORD_API_KEY, log_handler=None)
 
-# bot.run(DISCORD_API_KEY)
 
-client.run(DISCORD_API_KEY)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Logging for the Discord bots that stays off the event loop.
+
+Records are put on an in-memory queue by a `QueueHandler`; a `QueueListener`
+thread does the formatting and file I/O, so a slow disk cannot stall the
+gateway heartbeat. High-volume loggers can be sampled before they are even
+enqueued, and the level can be changed while the bot is running.
+
+Environment:
+    DISCORD_LOG_LEVEL   level for the `discord` logger (default DEBUG)
+    DISCORD_LOG_SAMPLE  comma separated `logger=N` pairs; only 1 in N records
+                        below WARNING from that logger (or its children) is
+                        kept, e.g. `discord.gateway=100,discord.state=10`
+"""
+import atexit
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import signal
+from types import FrameType
+from typing import Dict, Optional, Union
+
+LOGGER_NAME = 'discord'
+DT_FMT = '%Y-%m-%d %H:%M:%S'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_configured_level = logging.DEBUG
+
+
+class SamplingFilter(logging.Filter):
+    """Keep 1 in N records below WARNING for the configured loggers"""
+
+    def __init__(self, rates: Dict[str, int]) -> None:
+        super().__init__()
+        self.rates = {name: rate for name, rate in rates.items() if rate > 1}
+        self.counters = {name: itertools.count() for name in self.rates}
+
+    def _rule(self, name: str) -> Optional[str]:
+        # Most specific configured logger wins
+        while name:
+            if name in self.rates:
+                return name
+            name = name.rpartition('.')[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rule = self._rule(record.name)
+        if rule is None:
+            return True
+        return next(self.counters[rule]) % self.rates[rule] == 0
+
+
+def parse_sample_rates(spec: str) -> Dict[str, int]:
+    """`logger=N` pairs; malformed ones are skipped with a warning rather
+    than keeping the bot from starting"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, rate = item.partition('=')
+        try:
+            rates[name.strip()] = int(rate)
+        except ValueError:
+            logging.getLogger(__name__).warning('Ignoring malformed log sample rate %r', item)
+    return rates
+
+
+def _level(name: str) -> Optional[int]:
+    # getLevelName maps unknown names to the string 'Level <name>'
+    level = logging.getLevelName(name.upper())
+    return level if isinstance(level, int) else None
+
+
+def set_log_level(level: Union[int, str], name: str = LOGGER_NAME) -> None:
+    """Change a logger's level at runtime, e.g. set_log_level('INFO')"""
+    logging.getLogger(name).setLevel(level)
+
+
+def _toggle_debug(signum: int, frame: Optional[FrameType]) -> None:
+    logger = logging.getLogger(LOGGER_NAME)
+    if logger.level != logging.DEBUG:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(_configured_level if _configured_level != logging.DEBUG else logging.INFO)
+    logger.warning('Log level set to %s', logging.getLevelName(logger.level))
+
+
+def setup_logging(filename: str = 'discord.log') -> logging.Logger:
+    """Route the `discord` logger through a queue to a rotating file.
+    Safe to call more than once; only the first call configures anything."""
+    global _listener, _configured_level
+
+    logger = logging.getLogger(LOGGER_NAME)
+    if _listener is not None:
+        return logger
+
+    level_name = os.environ.get('DISCORD_LOG_LEVEL', 'DEBUG')
+    _configured_level = _level(level_name) or logging.DEBUG
+    logger.setLevel(_configured_level)
+    logging.getLogger('discord.http').setLevel(logging.INFO)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        filename=filename,
+        encoding='utf-8',
+        maxBytes=32 * 1024 * 1024,  # 32 MiB
+        backupCount=5,  # Rotate through 5 files
+    )
+    formatter = logging.Formatter('[{asctime}] [{levelname:<8}] {name}: {message}', DT_FMT, style='{')
+    file_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(os.environ.get('DISCORD_LOG_SAMPLE', ''))))
+    logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    if _level(level_name) is None:
+        logger.warning('Unknown DISCORD_LOG_LEVEL %r; using DEBUG', level_name)
+
+    # `kill -USR1 <pid>` flips between DEBUG and the configured level
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, _toggle_debug)
+
+    return logger
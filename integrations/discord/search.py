@@ -0,0 +1,103 @@
+"""Full-text search over stored Discord messages.
+
+`messages_fts` is an external-content FTS5 index over `messages.content`;
+triggers keep it in step with every insert, upsert and delete, so the ingest
+path does not need to know it exists.
+https://www.sqlite.org/fts5.html#external_content_tables
+"""
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+import aiosqlite
+
+from integrations.discord import snowflake
+
+SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content,
+        content='messages',
+        content_rowid='id',
+        tokenize='porter unicode61'
+    );
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END;
+    """,
+]
+
+
+async def init_search_index(db: aiosqlite.Connection) -> None:
+    """Create the index and triggers, populating the index from existing rows
+    the first time it is created."""
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+    exists = await cursor.fetchone() is not None
+    for query in SCHEMA:
+        await db.execute(query)
+    if not exists:
+        await db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    await db.commit()
+
+
+def keywords_query(keywords: Iterable[str]) -> str:
+    """Build an FTS5 query matching any of the keywords. Each keyword is quoted,
+    so user input cannot inject FTS5 operators."""
+    terms = ['"{}"'.format(k.replace('"', '""')) for k in keywords if k.strip()]
+    return " OR ".join(terms)
+
+
+def window_filter(
+    start: Optional[datetime], end: Optional[datetime], column: str = "m.id"
+) -> Tuple[str, list]:
+    """SQL fragment (and its params) restricting `column` to a time window"""
+    clauses, params = [], []
+    if start:
+        clauses.append(f"{column} >= ?")
+        params.append(snowflake.from_datetime(start))
+    if end:
+        clauses.append(f"{column} <= ?")
+        params.append(snowflake.from_datetime(end, high=True))
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+async def search_messages(
+    db_file: str,
+    query: str,
+    channel_id: Optional[int] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: int = 50,
+) -> List[Tuple]:
+    """Return (id, content, created_at, name, rank) for messages matching an
+    FTS5 `query`, best match first. Lower rank means a better bm25 score."""
+    sql = """
+        SELECT m.id, m.content, m.created_at, u.name, messages_fts.rank
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        JOIN users u ON m.user_id = u.id
+        WHERE messages_fts MATCH ?
+    """
+    params: list = [query]
+    if channel_id is not None:
+        sql += " AND m.channel_id = ?"
+        params.append(channel_id)
+    window, window_params = window_filter(start_date, end_date)
+    sql += window + " ORDER BY messages_fts.rank LIMIT ?"
+    params += window_params + [limit]
+
+    async with aiosqlite.connect(db_file) as db:
+        cursor = await db.execute(sql, params)
+        return await cursor.fetchall()
@@ -0,0 +1,275 @@
+"""Sharded Discord ingestion spread over several worker processes.
+
+Each worker process runs a `discord.AutoShardedClient` for a subset of the
+shards, so gateway parsing and event decoding scale across cores. Workers do
+no database work: they flatten every message into a plain dict and put it on
+a multiprocessing queue. The parent process is the only SQLite writer and
+stores messages in batches through `MessageStore`, one transaction per batch.
+
+Workers also send per-shard stats (messages per second, delivery lag since
+the message was created, gateway latency) which the writer logs.
+
+The writer also watches the workers: one that dies (a gateway auth failure,
+an unhandled exception) is restarted with the same shards, and a worker that
+keeps dying stops the whole process with an error instead of leaving its
+shards silent.
+
+Run with `python -m integrations.discord.shards --processes 4`.
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import discord
+from dotenv import load_dotenv
+
+from integrations.discord.log import setup_logging
+from integrations.discord.store import MessageStore, message_record
+from utils import metrics, transport
+
+log = logging.getLogger('discord.shards')
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5  # seconds a partial batch may wait before it is written
+STATS_INTERVAL = 30  # seconds between per-shard reports
+WATCH_INTERVAL = 5.0  # seconds between checks that the workers are alive
+MAX_RESTARTS = 3  # restarts of one worker within RESTART_WINDOW before giving up
+RESTART_WINDOW = 600.0  # seconds
+
+
+def recommended_shard_count(token: str) -> int:
+    """Ask Discord how many shards this bot should use"""
+    response = transport.get(
+        'https://discord.com/api/v10/gateway/bot',
+        headers={'Authorization': f'Bot {token}'},
+    )
+    response.raise_for_status()
+    return response.json()['shards']
+
+
+def split_shards(shard_count: int, processes: int) -> List[List[int]]:
+    """Deal shard ids out round-robin, one list per worker process"""
+    processes = max(1, min(processes, shard_count))
+    return [list(range(index, shard_count, processes)) for index in range(processes)]
+
+
+class ShardWorker(discord.AutoShardedClient):
+    """Runs a subset of shards and forwards messages to the writer queue"""
+
+    def __init__(self, out_queue, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.out_queue = out_queue
+        self.counts = defaultdict(int)
+        self.lag_total_ms = defaultdict(float)
+        self.lag_max_ms = defaultdict(float)
+
+    async def setup_hook(self):
+        self.loop.create_task(self.report_stats())
+
+    async def on_message(self, message):
+        if message.author == self.user:
+            return
+
+        shard_id = message.guild.shard_id if message.guild else 0
+        lag_ms = (discord.utils.utcnow() - message.created_at).total_seconds() * 1000
+        self.counts[shard_id] += 1
+        self.lag_total_ms[shard_id] += lag_ms
+        self.lag_max_ms[shard_id] = max(self.lag_max_ms[shard_id], lag_ms)
+
+        # Unbounded queue: put() never blocks, pickling happens on the
+        # queue's feeder thread
+        self.out_queue.put(('message', message_record(message)))
+
+    async def report_stats(self):
+        await self.wait_until_ready()
+        while not self.is_closed():
+            await asyncio.sleep(STATS_INTERVAL)
+            latencies = dict(self.latencies)
+            for shard_id in self.shard_ids or []:
+                count = self.counts.pop(shard_id, 0)
+                lag_total = self.lag_total_ms.pop(shard_id, 0.0)
+                self.out_queue.put(('stats', {
+                    'shard_id': shard_id,
+                    'messages': count,
+                    'per_second': count / STATS_INTERVAL,
+                    'avg_lag_ms': lag_total / count if count else 0.0,
+                    'max_lag_ms': self.lag_max_ms.pop(shard_id, 0.0),
+                    'gateway_latency_ms': latencies.get(shard_id, float('nan')) * 1000,
+                }))
+
+
+def run_worker(token: str, shard_ids: List[int], shard_count: int, out_queue, index: int) -> None:
+    """Entry point of a worker process"""
+    # One log file per process; rotating handlers cannot share a file
+    setup_logging(f'discord.worker-{index}.log')
+
+    intents = discord.Intents.default()
+    intents.message_content = True
+    client = ShardWorker(out_queue, intents=intents, shard_ids=shard_ids, shard_count=shard_count)
+    client.run(token, log_handler=None)
+
+
+class WorkerFailed(RuntimeError):
+    pass
+
+
+class ShardSupervisor:
+    """Restarts worker processes that died; `spawn(index)` returns a new,
+    not yet started process for the index-th group of shards"""
+
+    def __init__(self, spawn: Callable[[int], multiprocessing.Process], count: int,
+                 max_restarts: int = MAX_RESTARTS, window: float = RESTART_WINDOW) -> None:
+        self.spawn = spawn
+        self.max_restarts = max_restarts
+        self.window = window
+        self.workers = [spawn(index) for index in range(count)]
+        self.restarts: Dict[int, List[float]] = defaultdict(list)
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    def check(self) -> None:
+        """Restart dead workers; raise WorkerFailed for one that keeps dying"""
+        now = time.monotonic()
+        for index, worker in enumerate(self.workers):
+            if worker.is_alive():
+                continue
+            recent = [t for t in self.restarts[index] if now - t < self.window]
+            if len(recent) >= self.max_restarts:
+                raise WorkerFailed(
+                    f'worker {index} exited with code {worker.exitcode} after {len(recent)} restarts'
+                )
+            log.error('Worker %d exited with code %s; restarting it', index, worker.exitcode)
+            self.restarts[index] = recent + [now]
+            self.workers[index] = self.spawn(index)
+            self.workers[index].start()
+
+    def stop(self) -> None:
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+
+
+def _next_batch(in_queue, batch_size: int, flush_interval: float, wait: Optional[float] = None) -> list:
+    # Block for the first item (at most `wait` seconds), then take whatever
+    # arrives before the flush deadline, up to batch_size
+    try:
+        batch = [in_queue.get(timeout=wait)]
+    except queue.Empty:
+        return []
+    deadline = time.monotonic() + flush_interval
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(in_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+async def run_writer(db_file: str, in_queue, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                     watch: Optional[Callable[[], None]] = None, watch_interval: float = WATCH_INTERVAL) -> None:
+    """Serialise all writes from the workers into batched transactions.
+    Returns once a `None` sentinel is read from the queue. `watch` is called
+    at least every `watch_interval` seconds; an exception it raises stops
+    the writer."""
+    store = MessageStore(db_file)
+    await store.connect()
+    loop = asyncio.get_running_loop()
+    wait = watch_interval if watch else None
+    try:
+        while True:
+            if watch:
+                watch()
+            batch = await loop.run_in_executor(None, _next_batch, in_queue, batch_size, flush_interval, wait)
+            records = []
+            stop = False
+            for item in batch:
+                if item is None:
+                    stop = True
+                    continue
+                kind, payload = item
+                if kind == 'message':
+                    # Counted here: the worker processes have registries of their own
+                    metrics.DISCORD_EVENTS.labels(event='message').inc()
+                    records.append(payload)
+                elif kind == 'stats':
+                    log.info(
+                        'shard %(shard_id)s: %(per_second).1f msg/s, lag avg %(avg_lag_ms).0f ms '
+                        'max %(max_lag_ms).0f ms, gateway %(gateway_latency_ms).0f ms',
+                        payload,
+                    )
+
+            if records:
+                started = time.perf_counter()
+                await store.write_messages(records)
+                log.debug('Wrote %d messages in %.1f ms', len(records), (time.perf_counter() - started) * 1000)
+            if stop:
+                break
+    finally:
+        await store.close()
+
+
+def run_sharded(token: str, db_file: str = 'saas_db.sqlite', processes: Optional[int] = None, shard_count: Optional[int] = None) -> None:
+    processes = processes or os.cpu_count() or 1
+    shard_count = shard_count or recommended_shard_count(token)
+    log.info('Starting %d shards across %d processes', shard_count, min(processes, shard_count))
+
+    context = multiprocessing.get_context('spawn')
+    message_queue = context.Queue()
+    groups = split_shards(shard_count, processes)
+
+    def spawn(index: int) -> multiprocessing.Process:
+        return context.Process(
+            target=run_worker,
+            args=(token, groups[index], shard_count, message_queue, index),
+            daemon=True,
+        )
+
+    supervisor = ShardSupervisor(spawn, len(groups))
+    supervisor.start()
+
+    writer = asyncio.new_event_loop()
+    task = writer.create_task(run_writer(db_file, message_queue, watch=supervisor.check))
+    try:
+        writer.run_until_complete(task)
+    except KeyboardInterrupt:
+        # Stop the workers, then let the writer drain what they already sent
+        supervisor.stop()
+        message_queue.put(None)
+        if not task.done():
+            writer.run_until_complete(task)
+    except WorkerFailed:
+        # What was already received has been written; exit non-zero
+        supervisor.stop()
+        raise
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sharded Discord ingestion')
+    parser.add_argument('--db', default='saas_db.sqlite')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--shards', type=int, default=None, help='total shards (default: Discord recommendation)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    setup_logging()
+    metrics.start_from_env()
+    try:
+        run_sharded(os.environ['DISCORD_API_KEY'], args.db, args.processes, args.shards)
+    except WorkerFailed as e:
+        log.error('Stopping: %s', e)
+        sys.exit(1)
@@ -0,0 +1,71 @@
+"""Helpers for Discord snowflake IDs.
+
+A snowflake keeps its creation time (milliseconds since the Discord epoch) in
+the upper 42 bits, so ordering by snowflake is ordering by creation time and a
+time window maps onto a contiguous ID range.
+https://discord.com/developers/docs/reference#snowflakes
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+DISCORD_EPOCH_MS = 1420070400000
+TIMESTAMP_SHIFT = 22
+LOW_BITS_MASK = (1 << TIMESTAMP_SHIFT) - 1
+
+# Stored timestamps use the same layout as SQLite's CURRENT_TIMESTAMP (UTC)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Naive datetimes in this project are UTC, like the values SQLite stores
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def to_datetime(snowflake: int) -> datetime:
+    """Return the (UTC) creation time encoded in a snowflake"""
+    ms = (snowflake >> TIMESTAMP_SHIFT) + DISCORD_EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def from_datetime(value: datetime, high: bool = False) -> int:
+    """Return the lowest snowflake that could have been created at `value`,
+    or, if `high` is set, the highest one created within the same second.
+    Use the pair as inclusive bounds for a time-range scan: like the stored
+    timestamps, an end bound such as 12:39:32 covers the whole second."""
+    if high:
+        return from_datetime(value.replace(microsecond=0) + timedelta(seconds=1)) - 1
+    ms = int(_as_utc(value).timestamp() * 1000) - DISCORD_EPOCH_MS
+    return max(ms, 0) << TIMESTAMP_SHIFT
+
+
+def day_range(day: str) -> Tuple[int, int]:
+    """Inclusive snowflake bounds of a UTC day given as YYYY-MM-DD"""
+    start = datetime.strptime(day, '%Y-%m-%d')
+    return from_datetime(start), from_datetime(start + timedelta(days=1)) - 1
+
+
+def format_timestamp(value: datetime) -> str:
+    """Format a datetime the way the `messages` table stores it"""
+    return _as_utc(value).strftime(TIMESTAMP_FORMAT)
+
+
+def parse_timestamp(value: object) -> Optional[datetime]:
+    """Parse a stored timestamp (naive, UTC); None if it is not one"""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(str(value)[:19], TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+
+def legacy_snowflake_sql(id_column: str, timestamp_column: str) -> str:
+    """SQL expression that derives a synthetic snowflake for rows stored before
+    the Discord message id was recorded: the stored timestamp becomes the time
+    bits and the old autoincrement id fills the low bits to keep rows unique."""
+    return (
+        f"(((CAST(strftime('%s', {timestamp_column}) AS INTEGER) * 1000 - {DISCORD_EPOCH_MS})"
+        f" << {TIMESTAMP_SHIFT}) | ({id_column} & {LOW_BITS_MASK}))"
+    )
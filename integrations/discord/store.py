@@ -0,0 +1,471 @@
+"""SQLite storage for ingested Discord messages.
+
+`MessageStore` owns the database connection and writes messages in batches:
+one transaction per batch, with server/channel/user ids cached in memory so a
+busy channel does not pay three lookups per message. Both `SaaSBot` and the
+sharded ingestion writer store messages through it.
+
+Messages are passed around as plain dicts (see `message_record`) so they can
+cross process boundaries.
+
+Every message is tokenized once, when it is stored: `token_count` holds its
+prompt size, and analysis sizes its prompt chunks from it instead of
+re-tokenizing the text on every run.
+
+`channel_user_days` rolls messages, tokens and characters up per channel,
+UTC day and author. It is the one set of day aggregates: the stats API and
+the rolling reports read it, and it outlives the messages themselves once
+`integrations.discord.archive` has moved a day out (`archived`). Writes keep
+it current incrementally: a new message adds one message and its size to its
+row, an edit adds the change in size.
+"""
+from collections import defaultdict
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiosqlite
+
+from integrations.discord import snowflake
+from integrations.discord.search import init_search_index
+from utils import metrics
+from utils.tokens import count_tokens
+
+# Timestamp, author name and line break around the content in a prompt
+PROMPT_OVERHEAD_TOKENS = 8
+
+
+def message_tokens(content: str) -> int:
+    return count_tokens(content or '') + PROMPT_OVERHEAD_TOKENS
+
+
+def message_record(message) -> Dict:
+    """Flatten a discord.Message into a picklable dict for MessageStore"""
+    return {
+        'message_id': message.id,
+        'guild_id': message.guild.id if message.guild else None,
+        'channel_id': message.channel.id,
+        'channel_name': getattr(message.channel, 'name', None),
+        'author_id': message.author.id,
+        'author_name': message.author.name,
+        'content': message.content,
+        # Counted here so shard worker processes do the tokenizing
+        'token_count': message_tokens(message.content),
+        'created_at': snowflake.format_timestamp(message.created_at),
+        'edited_at': snowflake.format_timestamp(message.edited_at) if message.edited_at else None,
+        'attachments': [
+            {
+                'attachment_id': str(attachment.id),
+                'filename': attachment.filename,
+                'url': attachment.url,
+                'content_type': attachment.content_type,
+                'size': attachment.size,
+                'height': attachment.height,
+                'width': attachment.width,
+                'description': attachment.description,
+                'ephemeral': attachment.ephemeral,
+                'duration': attachment.duration,
+            }
+            for attachment in message.attachments
+        ],
+    }
+
+
+class MessageStore:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.db = None
+        self.server_ids = {}
+        self.channel_ids = {}
+        self.user_ids = {}
+
+    async def connect(self):
+        self.db = await aiosqlite.connect(self.db_file)
+        self.cursor = await self.db.cursor()
+
+        # Ensure the tables exist
+        await self.init_database()
+
+    async def init_database(self):
+        queries = [
+            """
+            CREATE TABLE IF NOT EXISTS servers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS channels (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                server_id INTEGER REFERENCES servers(id),
+                discord_channel_id TEXT NOT NULL,
+                name TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                discord_user_id TEXT NOT NULL UNIQUE,
+                name TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,  -- Discord message snowflake
+                channel_id INTEGER REFERENCES channels(id),
+                user_id INTEGER REFERENCES users(id),
+                content TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL,  -- when the message was sent
+                edited_at TIMESTAMP,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- when it was stored
+                token_count INTEGER  -- prompt tokens of this message
+            );
+            """,
+            # Snowflakes are time ordered, so a channel's time window is a
+            # contiguous range of this index
+            """
+            CREATE INDEX IF NOT EXISTS idx_messages_channel_id
+            ON messages (channel_id, id);
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id INTEGER NOT NULL, 
+            attachment_id TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            url TEXT NOT NULL,
+            content_type TEXT,
+            size INTEGER,
+            height INTEGER,
+            width INTEGER,
+            description TEXT,
+            ephemeral BOOLEAN,
+            duration FLOAT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (message_id) REFERENCES messages(id)
+            );
+            """,
+            # Replays stored duplicate attachments before attachment_id was
+            # unique; keep the latest copy so the unique index can be built
+            """
+            DELETE FROM attachments WHERE id NOT IN (
+                SELECT MAX(id) FROM attachments GROUP BY attachment_id
+            );
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_attachments_attachment_id
+            ON attachments (attachment_id);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_attachments_message_id
+            ON attachments (message_id);
+            """,
+            # Day token totals now come from channel_user_days
+            """
+            DROP TABLE IF EXISTS channel_day_tokens;
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS channel_user_days (
+                channel_id INTEGER NOT NULL,
+                day TEXT NOT NULL,  -- UTC, YYYY-MM-DD
+                user_id INTEGER NOT NULL,
+                messages INTEGER NOT NULL,
+                tokens INTEGER NOT NULL,
+                characters INTEGER NOT NULL DEFAULT 0,
+                last_message_id INTEGER,
+                archived BOOLEAN NOT NULL DEFAULT 0,  -- moved to the monthly archives
+                PRIMARY KEY (channel_id, day, user_id)
+            );
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_channel_user_days_user
+            ON channel_user_days (user_id, day);
+            """,
+            # Users are no longer looked up by name
+            """
+            DROP INDEX IF EXISTS idx_users_name;
+            """
+        ]
+        await self.migrate_messages()
+        for query in queries:
+            await self.cursor.execute(query)
+        await self.migrate_token_counts()
+        await self.migrate_day_stats()
+        await self.db.commit()
+
+        # Keyword index over message content, kept in sync by triggers
+        await init_search_index(self.db)
+
+    async def migrate_messages(self):
+        # Tables created before messages were keyed by their Discord snowflake
+        # have an autoincrement id and no created_at; rebuild them in place.
+        await self.cursor.execute("PRAGMA table_info(messages)")
+        columns = [row[1] for row in await self.cursor.fetchall()]
+        if not columns or 'created_at' in columns:
+            return
+
+        await self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attachments'")
+        has_attachments = await self.cursor.fetchone() is not None
+
+        legacy_id = snowflake.legacy_snowflake_sql('id', 'timestamp')
+        remap_attachments = f"""
+            UPDATE attachments SET message_id = (
+                SELECT {legacy_id} FROM messages WHERE messages.id = attachments.message_id
+            );
+        """ if has_attachments else ''
+        await self.cursor.executescript(f"""
+            BEGIN;
+            CREATE TABLE messages_new (
+                id INTEGER PRIMARY KEY,
+                channel_id INTEGER REFERENCES channels(id),
+                user_id INTEGER REFERENCES users(id),
+                content TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                edited_at TIMESTAMP,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            INSERT INTO messages_new (id, channel_id, user_id, content, created_at, timestamp)
+                SELECT {legacy_id}, channel_id, user_id, content, timestamp, timestamp
+                FROM messages;
+            {remap_attachments}
+            DROP TABLE messages;
+            ALTER TABLE messages_new RENAME TO messages;
+            COMMIT;
+        """)
+
+    async def migrate_token_counts(self):
+        # Databases from before token counts were stored get the column and
+        # a one-off tokenization of their existing messages
+        await self.cursor.execute("PRAGMA table_info(messages)")
+        columns = [row[1] for row in await self.cursor.fetchall()]
+        if 'token_count' not in columns:
+            await self.cursor.execute("ALTER TABLE messages ADD COLUMN token_count INTEGER")
+
+        await self.cursor.execute("SELECT id, content FROM messages WHERE token_count IS NULL")
+        rows = await self.cursor.fetchall()
+        if not rows:
+            return
+        await self.cursor.executemany(
+            "UPDATE messages SET token_count = ? WHERE id = ?",
+            [(message_tokens(content), message_id) for message_id, content in rows]
+        )
+
+    async def migrate_day_stats(self):
+        # Rollups from before characters and the last message were kept are
+        # rebuilt in full, otherwise only days stored before the rollup existed
+        await self.cursor.execute("PRAGMA table_info(channel_user_days)")
+        columns = [row[1] for row in await self.cursor.fetchall()]
+        missing_only = 'characters' in columns
+        if not missing_only:
+            await self.cursor.execute("ALTER TABLE channel_user_days ADD COLUMN characters INTEGER NOT NULL DEFAULT 0")
+            await self.cursor.execute("ALTER TABLE channel_user_days ADD COLUMN last_message_id INTEGER")
+            await self.cursor.execute("ALTER TABLE channel_user_days ADD COLUMN archived BOOLEAN NOT NULL DEFAULT 0")
+
+        await self.cursor.execute(
+            """
+            SELECT DISTINCT m.channel_id, substr(m.created_at, 1, 10) AS day FROM messages m
+            WHERE NOT ? OR NOT EXISTS (
+                SELECT 1 FROM channel_user_days d
+                WHERE d.channel_id = m.channel_id AND d.day = substr(m.created_at, 1, 10)
+            )
+            """,
+            (missing_only,)
+        )
+        for channel_id, day in await self.cursor.fetchall():
+            await self.update_day_stats(channel_id, day)
+
+    async def update_day_stats(self, channel_id, day: str):
+        """Recompute the per-author rollup of one channel and UTC day from
+        its stored messages"""
+        day_start, day_end = snowflake.day_range(day)
+        await self.cursor.execute(
+            "DELETE FROM channel_user_days WHERE channel_id = ? AND day = ?", (channel_id, day)
+        )
+        await self.cursor.execute(
+            """
+            INSERT INTO channel_user_days (channel_id, day, user_id, messages, tokens, characters, last_message_id)
+            SELECT channel_id, ?, user_id, COUNT(*), COALESCE(SUM(token_count), 0), SUM(length(content)), MAX(id)
+            FROM messages
+            WHERE channel_id = ? AND id BETWEEN ? AND ?
+            GROUP BY user_id
+            """,
+            (day, channel_id, day_start, day_end)
+        )
+
+    async def write_messages(self, records: Iterable[Dict]) -> int:
+        """Store a batch of message records in a single transaction"""
+        count = 0
+        started = time.perf_counter()
+        # What the batch adds to every (channel, day, author) rollup row:
+        # [messages, tokens, characters, last message id]
+        deltas: Dict[Tuple[int, str, int], List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+        try:
+            for record in records:
+                # Identify the server (e.g., by environment or config)
+                server_id = await self.get_server_id(record['guild_id'])
+
+                # Store the channel if it doesn't exist
+                channel_id = await self.get_or_create_channel(server_id, record['channel_id'], record['channel_name'])
+
+                # Store the user if it doesn't exist
+                user_id = await self.get_or_create_user(record['author_id'], record['author_name'])
+
+                # Store the message
+                token_count = record.get('token_count')
+                if token_count is None:
+                    token_count = message_tokens(record['content'])
+                await self.cursor.execute(
+                    "SELECT token_count, length(content) FROM messages WHERE id = ?", (record['message_id'],)
+                )
+                stored = await self.cursor.fetchone()
+                message_id = await self.store_message(
+                    record['message_id'], channel_id, user_id, record['content'],
+                    record['created_at'], record['edited_at'], token_count
+                )
+                # An edit or a replay only changes the size. An edit of a
+                # message that was already archived counts as new until the
+                # next archive run merges it into its day.
+                delta = deltas[(channel_id, record['created_at'][:10], user_id)]
+                old_tokens, old_characters = stored or (0, 0)
+                delta[0] += stored is None
+                delta[1] += token_count - (old_tokens or 0)
+                delta[2] += len(record['content']) - (old_characters or 0)
+                delta[3] = max(delta[3], message_id)
+
+                if record['attachments']:
+                    await self.store_attachments(message_id, record['attachments'])
+                count += 1
+
+            await self.cursor.executemany(
+                """
+                INSERT INTO channel_user_days (channel_id, day, user_id, messages, tokens, characters, last_message_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(channel_id, day, user_id) DO UPDATE SET
+                    messages = messages + excluded.messages,
+                    tokens = tokens + excluded.tokens,
+                    characters = characters + excluded.characters,
+                    last_message_id = MAX(COALESCE(last_message_id, 0), excluded.last_message_id)
+                """,
+                [key + tuple(delta) for key, delta in deltas.items()]
+            )
+
+            # One commit for the whole batch, attachments included
+            await self.db.commit()
+        except Exception:
+            # Ids created in this transaction are gone; forget them too
+            await self.db.rollback()
+            self.server_ids.clear()
+            self.channel_ids.clear()
+            self.user_ids.clear()
+            raise
+        metrics.SQLITE_BATCH_SIZE.labels(store='messages').observe(count)
+        metrics.SQLITE_WRITE_LATENCY.labels(store='messages').observe(time.perf_counter() - started)
+        return count
+
+    async def latest_message_id(self, discord_channel_id) -> Optional[int]:
+        await self.cursor.execute(
+            """
+            SELECT MAX(m.id) FROM messages m
+            JOIN channels c ON m.channel_id = c.id
+            WHERE c.discord_channel_id = ?
+            """,
+            (str(discord_channel_id),)
+        )
+        result = await self.cursor.fetchone()
+        return result[0] if result else None
+
+    async def store_attachments(self, message_id, attachments: List[Dict]):
+        # Store attachment details in the attachments table, all in one batch.
+        # attachment_id is unique, so replays refresh the row instead of
+        # adding another copy.
+        await self.cursor.executemany(
+            """
+            INSERT INTO attachments (message_id, attachment_id, filename, url, content_type, size, height, width, description, ephemeral, duration)
+            VALUES (:message_id, :attachment_id, :filename, :url, :content_type, :size, :height, :width, :description, :ephemeral, :duration)
+            ON CONFLICT(attachment_id) DO UPDATE SET
+                message_id = excluded.message_id,
+                filename = excluded.filename,
+                url = excluded.url,
+                content_type = excluded.content_type,
+                size = excluded.size,
+                height = excluded.height,
+                width = excluded.width,
+                description = excluded.description,
+                ephemeral = excluded.ephemeral,
+                duration = excluded.duration
+            """,
+            [dict(attachment, message_id=message_id) for attachment in attachments]
+        )
+
+    async def get_server_id(self, discord_guild_id):
+        if discord_guild_id in self.server_ids:
+            return self.server_ids[discord_guild_id]
+        # Placeholder logic; in a real app, map Discord guild IDs to servers
+        await self.cursor.execute("SELECT id FROM servers WHERE name = ?", (f"server-{discord_guild_id}",))
+        result = await self.cursor.fetchone()
+        if not result:
+            # Create a new server
+            await self.cursor.execute("INSERT INTO servers (name) VALUES (?)", (f"server-{discord_guild_id}",))
+            server_id = self.cursor.lastrowid
+        else:
+            server_id = result[0]
+        self.server_ids[discord_guild_id] = server_id
+        return server_id
+
+    async def get_or_create_channel(self, server_id, discord_channel_id, name):
+        if discord_channel_id in self.channel_ids:
+            return self.channel_ids[discord_channel_id]
+        await self.cursor.execute("SELECT id FROM channels WHERE discord_channel_id = ?", (str(discord_channel_id),))
+        result = await self.cursor.fetchone()
+        if not result:
+            # Create a new channel
+            await self.cursor.execute(
+                "INSERT INTO channels (server_id, discord_channel_id, name) VALUES (?, ?, ?)",
+                (server_id, str(discord_channel_id), name)
+            )
+            channel_id = self.cursor.lastrowid
+        else:
+            channel_id = result[0]
+        self.channel_ids[discord_channel_id] = channel_id
+        return channel_id
+
+    async def get_or_create_user(self, discord_user_id, name):
+        if discord_user_id in self.user_ids:
+            return self.user_ids[discord_user_id]
+        await self.cursor.execute("SELECT id FROM users WHERE discord_user_id = ?", (str(discord_user_id),))
+        result = await self.cursor.fetchone()
+        if not result:
+            # Create a new user
+            await self.cursor.execute(
+                "INSERT INTO users (discord_user_id, name) VALUES (?, ?)",
+                (str(discord_user_id), name)
+            )
+            user_id = self.cursor.lastrowid
+        else:
+            user_id = result[0]
+        self.user_ids[discord_user_id] = user_id
+        return user_id
+
+    async def store_message(self, discord_message_id, channel_id, user_id, content, created_at, edited_at=None,
+                            token_count=None):
+        # Keyed by the Discord snowflake, so replays update instead of duplicating
+        await self.cursor.execute(
+            """
+            INSERT INTO messages (id, channel_id, user_id, content, created_at, edited_at, token_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                content = excluded.content,
+                edited_at = excluded.edited_at,
+                token_count = excluded.token_count
+            """,
+            (discord_message_id, channel_id, user_id, content, created_at, edited_at, token_count)
+        )
+        return discord_message_id
+
+    async def close(self):
+        if self.db:
+            await self.db.close()
+            self.db = None
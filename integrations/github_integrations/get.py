@@ -1,19 +1,56 @@
-from github import Github, Auth
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Optional
+from functools import cached_property, lru_cache
+from typing import Any, List, Dict, Optional, Tuple
 import os
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.chains import LLMChain
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
-import jwt
 import time
-import requests
 from pprint import pprint
 import sqlite3
+import uuid
+
+from utils import metrics, tracing, transport
+
+# PyGithub, PyJWT and LangChain are imported where they are first used, so
+# importing this module (e.g. from the Flask app) stays cheap
+
+
+@lru_cache(maxsize=None)
+def _transport_connection_classes() -> Tuple[type, type]:
+    """PyGithub connection classes that send through `utils.transport`, so
+    its calls share the pooling, retries, timeouts and metrics of the rest"""
+    from github.Requester import RequestsResponse
+
+    class TransportConnection:
+        protocol = 'https'
+
+        def __init__(self, host: str, port: Optional[int] = None, **kwargs: Any) -> None:
+            # PyGithub's timeout, retry and pool_size are the transport's to decide
+            self.host = host
+            self.port = port
+            self.verify = kwargs.get('verify', True)
+            self._request: Optional[Tuple[str, str, Any, Dict[str, str], bool]] = None
+
+        def request(self, verb: str, url: str, input: Any, headers: Dict[str, str], stream: bool = False) -> None:
+            self._request = (verb, url, input, headers, stream)
+
+        def getresponse(self) -> RequestsResponse:
+            verb, url, input, headers, stream = self._request
+            default_port = 443 if self.protocol == 'https' else 80
+            netloc = self.host if self.port in (None, default_port) else f'{self.host}:{self.port}'
+            response = transport.request(
+                verb, f'{self.protocol}://{netloc}{url}',
+                headers=headers, data=input, allow_redirects=False, stream=stream, verify=self.verify
+            )
+            return RequestsResponse(response)
+
+        def close(self) -> None:
+            # Connections belong to the transport's pools
+            pass
+
+    class TransportHTTPConnection(TransportConnection):
+        protocol = 'http'
+
+    return TransportHTTPConnection, TransportConnection
 
-load_dotenv()
 
 class GitHubAnalytics:
     def __init__(self):
@@ -22,20 +59,44 @@ class GitHubAnalytics:
         self.github_private_key = os.getenv("GITHUB_APP_PRIVATE_KEY")
         self.github_installation_id = os.getenv("GITHUB_INSTALLATION_ID")
         self.github_client_id = os.getenv("GITHUB_CLIENT_ID")
-        
-        # Initialize LangChain
-        self.llm = ChatOpenAI(
+
+    @cached_property
+    def llm(self):
+        # Initialize LangChain on first use
+        from langchain_openai import ChatOpenAI
+
+        from utils.llm_cache import get_llm_cache
+
+        return ChatOpenAI(
             model_name="gpt-3.5-turbo",
             temperature=0,
-            openai_api_key=os.getenv("OPENAI_API_KEY")
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            # Repeat analyses of the same data are served from disk
+            cache=get_llm_cache(),
+            callbacks=metrics.llm_callbacks()
         )
-        
-        # Initialize GitHub client
+
+    @cached_property
+    def github(self):
+        # Initialize GitHub client on first use; this requests an installation token
+        from github import Github
+        from github.Requester import Requester
+
+        Requester.injectConnectionClasses(*_transport_connection_classes())
         auth = self._get_github_app_token()
-        self.github = Github(auth)
+        return Github(auth)
+
+    def _run_prompt(self, template: str, inputs: Dict) -> str:
+        from langchain_core.output_parsers import StrOutputParser
+        from langchain_core.prompts import ChatPromptTemplate
+
+        chain = ChatPromptTemplate.from_template(template) | self.llm | StrOutputParser()
+        return chain.invoke(inputs)
 
     def _get_github_app_token(self):
         """Get GitHub App installation access token"""
+        import jwt
+
         # Generate JWT
         now = int(time.time())
         payload = {
@@ -56,7 +117,7 @@ class GitHubAnalytics:
             "X-GitHub-Api-Version": "2022-11-28"
         }
         
-        response = requests.post(url, headers=headers)
+        response = transport.post(url, headers=headers)
         response_data = response.json()
 
         # pprint(response_data)
@@ -66,6 +127,7 @@ class GitHubAnalytics:
         else:
             raise Exception(f"Failed to obtain access token: {response_data.get('message', 'Unknown error')}")
 
+    @tracing.traced("github.contributors")
     def get_repository_contributors(
         self, 
         repo_name: str, 
@@ -125,8 +187,14 @@ class GitHubAnalytics:
             if contributor_data["total_commits"] > 0:
                 contributors.append(contributor_data)
 
+        tracing.current_span().set(
+            repo=repo_name,
+            contributors=len(contributors),
+            commits=sum(c["total_commits"] for c in contributors),
+        )
         return contributors
 
+    @tracing.traced("github.analyze_contributions")
     def analyze_contributions(
         self, 
         repo_name: str, 
@@ -136,10 +204,11 @@ class GitHubAnalytics:
         """
         Analyze contributions and generate summaries using LangChain
         """
+        tracing.current_span().set(repo=repo_name)
         contributors = self.get_repository_contributors(repo_name, start_date, end_date)
         
         # Create prompt template for contribution analysis
-        prompt = ChatPromptTemplate.from_template("""
+        prompt = """
         Analyze the following GitHub contribution data and provide a detailed summary:
         
         Repository: {repo_name}
@@ -153,10 +222,7 @@ class GitHubAnalytics:
         2. Key contributors and their impact
         3. Notable trends or patterns
         4. Significant commits or changes
-        """)
-        
-        # Create LangChain for analysis
-        chain = LLMChain(llm=self.llm, prompt=prompt)
+        """
         
         # Format time period string
         time_period = f"{start_date.strftime('%Y-%m-%d') if start_date else 'beginning'} to {end_date.strftime('%Y-%m-%d') if end_date else 'present'}"
@@ -169,7 +235,7 @@ class GitHubAnalytics:
         ])
         
         # Generate analysis
-        analysis = chain.run({
+        analysis = self._run_prompt(prompt, {
             "repo_name": repo_name,
             "time_period": time_period,
             "contribution_data": contribution_data
@@ -190,7 +256,7 @@ class GitHubAnalytics:
         """
         Analyze commit messages using LangChain to identify patterns and summarize changes
         """
-        prompt = ChatPromptTemplate.from_template("""
+        prompt = """
         Analyze the following commit messages and provide a summary of the changes:
         
         Commits:
@@ -201,19 +267,18 @@ class GitHubAnalytics:
         2. Key features or improvements
         3. Bug fixes or issues addressed
         4. Overall development direction
-        """)
-        
-        chain = LLMChain(llm=self.llm, prompt=prompt)
+        """
         
         commit_messages = "\n".join([
             f"- {commit['date'].strftime('%Y-%m-%d')}: {commit['message']}"
             for commit in commits
         ])
         
-        return chain.run({
+        return self._run_prompt(prompt, {
             "commit_messages": commit_messages
         })
 
+    @tracing.traced("github.code_patches")
     def get_user_code_patches(self, repo_name: str, username: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[Dict]:
         """
         Get all code patches for a specific user in a repository.
@@ -246,7 +311,7 @@ class GitHubAnalytics:
                 'Authorization': f'Bearer {self._get_github_app_token()}',
                 'Accept': 'application/vnd.github.v3+json'
             }
-            response = requests.get(url, headers=headers)
+            response = transport.get(url, headers=headers)
             
             if response.status_code != 200:
                 raise Exception(f"Failed to fetch commit details: {response.json().get('message', 'Unknown error')}")
@@ -267,13 +332,15 @@ class GitHubAnalytics:
                 "patch": patch.strip()  # Remove any trailing whitespace
             })
 
+        tracing.current_span().set(repo=repo_name, username=username, patches=len(patches))
         return patches
 
+    @tracing.traced("github.analyze_code_patches")
     def analyze_large_code_patches(self, code_patches: List[Dict]) -> str:
         """
         Analyze large code patches using LangChain to identify patterns and summarize changes.
         """
-        prompt = ChatPromptTemplate.from_template(""" 
+        prompt = """ 
         Analyze the following code patches and provide a summary of the changes:
         
         Code Patches:
@@ -284,27 +351,28 @@ class GitHubAnalytics:
         2. Key features or improvements
         3. Bug fixes or issues addressed
         4. Overall development direction
-        """)
-        
-        chain = LLMChain(llm=self.llm, prompt=prompt)
+        """
         
         # Format code patches for analysis
         formatted_patches = "\n".join([f"- {patch['date'].strftime('%Y-%m-%d')}: {patch['message']}\n{patch['patch']}" for patch in code_patches])
         
-        return chain.run({
+        return self._run_prompt(prompt, {
             "code_patches": formatted_patches
         })
 
+    @tracing.traced("github.analyze_user_contributions")
     def analyze_user_contributions(
         self, 
         username: str, 
         start_date: Optional[datetime] = None, 
         end_date: Optional[datetime] = None
-    ) -> None:
+    ) -> str:
         """
         Check if the user has contributions in any accessible repositories,
         retrieve contributions, and save them in a SQLite database.
+        Returns the id of this run, which its rows are stored under.
         """
+        run_id = uuid.uuid4().hex
         # Connect to SQLite database
         conn = sqlite3.connect('saas_db.sqlite')
         cursor = conn.cursor()
@@ -317,9 +385,17 @@ class GitHubAnalytics:
                 total_commits INTEGER,
                 lines_added INTEGER,
                 lines_deleted INTEGER,
-                date TEXT
+                date TEXT,
+                run_id TEXT
             )
         ''')
+        # Tables from before runs had ids
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(user_contributions)")]
+        if 'run_id' not in columns:
+            cursor.execute("ALTER TABLE user_contributions ADD COLUMN run_id TEXT")
+        # Lookups of the stats API (see integrations/stats.py)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_contributions_user ON user_contributions (username, date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_contributions_repo ON user_contributions (repo_name, date)")
 
         # Use the GitHub API to get repositories accessible by the app
         installation_repos_url = f"https://api.github.com/installation/repositories"
@@ -327,43 +403,50 @@ class GitHubAnalytics:
             'Authorization': f'Bearer {self._get_github_app_token()}',
             'Accept': 'application/vnd.github+json'
         }
-        response = requests.get(installation_repos_url, headers=headers)
+        response = transport.get(installation_repos_url, headers=headers)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get repositories: {response.json().get('message', 'Unknown error')}")
 
         repos_data = response.json().get('repositories', [])
+        tracing.current_span().set(username=username, repos=len(repos_data))
 
         print("Repos Data: ", repos_data)
 
         for repo in repos_data:
             repo_name = repo['full_name']  # Use the full name of the repository
-            # Get contributions for the specified user
-            contributions = self.get_repository_contributors(repo_name, start_date, end_date)
-            user_contributions = next((c for c in contributions if c['login'] == username), None)
-
-            if user_contributions:
-                # Get user code patches
-                code_patches = self.get_user_code_patches(repo_name, username, start_date, end_date)
-                # Save contributions to the database
-                cursor.execute(''' 
-                    INSERT INTO user_contributions (repo_name, username, total_commits, lines_added, lines_deleted, date)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (repo_name, username, user_contributions['total_commits'], user_contributions['lines_added'], user_contributions['lines_deleted'], datetime.now().strftime('%Y-%m-%d')))
-
-                # Analyze contributions (you can call the analyze_contributions method if needed)
-                analysis = self.analyze_contributions(repo_name, start_date, end_date)
-                print(f"Analysis for {username} in {repo_name}: {analysis}")
-                
-                # Analyze large code patches
-                if code_patches:
-                    large_code_analysis = self.analyze_large_code_patches(code_patches)
-                    print(f"Large Code Patches Analysis for {username} in {repo_name}: ")
-                    pprint(large_code_analysis)
+            with tracing.span("github.repo", repo=repo_name):
+                # Get contributions for the specified user
+                contributions = self.get_repository_contributors(repo_name, start_date, end_date)
+                user_contributions = next((c for c in contributions if c['login'].lower() == username.lower()), None)
+
+                if user_contributions:
+                    # Get user code patches
+                    # GitHub logins are case-insensitive; store the user's own spelling
+                    login = user_contributions['login']
+                    code_patches = self.get_user_code_patches(repo_name, login, start_date, end_date)
+                    # Save contributions to the database
+                    with tracing.span("sqlite.insert", table="user_contributions"):
+                        cursor.execute(''' 
+                            INSERT INTO user_contributions (repo_name, username, total_commits, lines_added, lines_deleted, date, run_id)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ''', (repo_name, login, user_contributions['total_commits'], user_contributions['lines_added'], user_contributions['lines_deleted'], datetime.now().strftime('%Y-%m-%d'), run_id))
+
+                    # Analyze contributions (you can call the analyze_contributions method if needed)
+                    analysis = self.analyze_contributions(repo_name, start_date, end_date)
+                    print(f"Analysis for {username} in {repo_name}: {analysis}")
+                    
+                    # Analyze large code patches
+                    if code_patches:
+                        large_code_analysis = self.analyze_large_code_patches(code_patches)
+                        print(f"Large Code Patches Analysis for {username} in {repo_name}: ")
+                        pprint(large_code_analysis)
 
         # Commit changes and close the connection
-        conn.commit()
+        with tracing.span("sqlite.commit"):
+            conn.commit()
         conn.close()
+        return run_id
 
 def test_github_analytics():
     # Initialize the analyzer
@@ -398,5 +481,15 @@ def test_github_analytics():
     pprint(f"\n=== Analyzing Contributions for {username} ===")
     analyzer.analyze_user_contributions(username, start_date, end_date)
 
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    try:
+        test_github_analytics()
+    finally:
+        metrics.push_from_env("github_analytics")
+
+
 if __name__ == "__main__":
-    test_github_analytics()
+    main()
@@ -0,0 +1,192 @@
+"""Jira Cloud client for creating issues from detected actions.
+
+Requests go through the shared transport (`utils.transport`), so the
+connections to Jira are pooled and reused across calls and clients. Tasks are
+created through `/rest/api/3/issue/bulk`, up to 50 per request, and each
+result is mapped back to its task. Reads are retried with jittered backoff on
+429 and 5xx responses (honouring `Retry-After`) and on connection errors;
+creates only when Jira cannot have acted on them (429, 503).
+"""
+import os
+import threading
+from typing import Dict, Iterator, List, Optional
+
+import requests
+from requests.auth import HTTPBasicAuth
+
+from utils import metrics
+from utils.transport import Transport, get_transport
+
+BULK_LIMIT = 50  # issues per bulk request, Jira's maximum
+MAX_RETRIES = 4
+BACKOFF = 0.5  # seconds, doubled on every retry
+TIMEOUT = (5, 30)  # connect, read
+
+
+def issue_fields(task: Dict, project: str) -> Dict:
+    """Jira fields for an action detected by the analysis"""
+    return {
+        "project": {"key": project},
+        "summary": task["summary"],
+        "description": {
+            "type": "doc",
+            "version": 1,
+            "content": [
+                {
+                    "type": "paragraph",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": task.get("description") or task["summary"]
+                        }
+                    ]
+                }
+            ]
+        },
+        "issuetype": {"name": "Task"},
+        # "priority": {"name": task.get("priority", "Medium")},
+        # "duedate": task.get("due_date", None),
+        **({"labels": task["labels"]} if task.get("labels") else {}),
+    }
+
+
+def _error_message(errors: Dict) -> str:
+    element = errors.get("elementErrors") or errors
+    messages = list(element.get("errorMessages") or [])
+    messages += [f"{field}: {message}" for field, message in (element.get("errors") or {}).items()]
+    return "; ".join(messages) or f"status {errors.get('status')}"
+
+
+class JiraClient:
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        email: Optional[str] = None,
+        api_token: Optional[str] = None,
+        project: Optional[str] = None,
+        max_retries: int = MAX_RETRIES,
+        backoff: float = BACKOFF,
+        timeout=TIMEOUT,
+        transport: Optional[Transport] = None,
+    ):
+        self.base_url = (base_url or os.getenv("JIRA_BASE_URL") or "").rstrip("/")
+        self.project = project or os.getenv("JIRA_PROJECT")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.transport = transport or get_transport()
+        self.auth = HTTPBasicAuth(email or os.getenv("JIRA_API_EMAIL"), api_token or os.getenv("JIRA_API_TOKEN"))
+        self.headers = {"Content-Type": "application/json", "Accept": "application/json"}
+
+    def _post(self, path: str, payload: Dict) -> requests.Response:
+        return self._request("POST", path, json=payload)
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        return self.transport.request(
+            method,
+            f"{self.base_url}{path}",
+            auth=self.auth,
+            headers=self.headers,
+            timeout=self.timeout,
+            max_retries=self.max_retries,
+            backoff=self.backoff,
+            **kwargs,
+        )
+
+    def create_issue(self, task: Dict) -> str:
+        """Create one issue and return its key"""
+        response = self._post("/rest/api/3/issue", {"fields": issue_fields(task, self.project)})
+        metrics.JIRA_ISSUES.labels(status="created" if response.status_code == 201 else "failed").inc()
+        if response.status_code != 201:
+            raise requests.HTTPError(
+                f"Failed to create task: {response.status_code} {response.text}", response=response
+            )
+        return response.json()["key"]
+
+    def find_issue(self, label: str) -> Optional[str]:
+        """Key of an issue carrying `label`, if any"""
+        response = self._request(
+            "GET", "/rest/api/3/search/jql",
+            params={"jql": f'labels = "{label}"', "fields": "key", "maxResults": 1},
+        )
+        response.raise_for_status()
+        issues = response.json().get("issues") or []
+        return issues[0]["key"] if issues else None
+
+    def search_issues(self, jql: str, fields: List[str], page_size: int = 100) -> Iterator[Dict]:
+        """All issues matching `jql`, following the result pages"""
+        token = None
+        while True:
+            params = {"jql": jql, "fields": ",".join(fields), "maxResults": page_size}
+            if token:
+                params["nextPageToken"] = token
+            response = self._request("GET", "/rest/api/3/search/jql", params=params)
+            response.raise_for_status()
+            body = response.json()
+            yield from body.get("issues") or []
+            token = body.get("nextPageToken")
+            if not token:
+                return
+
+    def add_comment(self, key: str, text: str) -> None:
+        response = self._post(
+            f"/rest/api/3/issue/{key}/comment",
+            {"body": {"type": "doc", "version": 1, "content": [
+                {"type": "paragraph", "content": [{"type": "text", "text": text}]}
+            ]}},
+        )
+        response.raise_for_status()
+
+    def create_issues(self, tasks: List[Dict]) -> List[Dict]:
+        """Create issues for `tasks` in bulk requests of up to 50 and return
+        one {task, status: created | failed, key | error} result per task,
+        in order"""
+        results = []
+        for start in range(0, len(tasks), BULK_LIMIT):
+            results += self._create_batch(tasks[start:start + BULK_LIMIT])
+        for result in results:
+            metrics.JIRA_ISSUES.labels(status=result["status"]).inc()
+        return results
+
+    def _create_batch(self, tasks: List[Dict]) -> List[Dict]:
+        try:
+            response = self._post(
+                "/rest/api/3/issue/bulk",
+                {"issueUpdates": [{"fields": issue_fields(task, self.project)} for task in tasks]},
+            )
+            body = response.json() if response.content else {}
+        except (requests.RequestException, ValueError) as e:
+            return [{"task": task, "status": "failed", "error": f"{type(e).__name__}: {e}"} for task in tasks]
+
+        if response.status_code not in (200, 201) and not body.get("errors"):
+            error = f"{response.status_code} {response.text}"
+            return [{"task": task, "status": "failed", "error": error} for task in tasks]
+
+        # Created issues come back in input order, minus the failed elements,
+        # which are identified by their index in the request
+        failed = {e["failedElementNumber"]: _error_message(e) for e in body.get("errors", [])}
+        issues = iter(body.get("issues", []))
+        results = []
+        for index, task in enumerate(tasks):
+            if index in failed:
+                results.append({"task": task, "status": "failed", "error": failed[index]})
+                continue
+            issue = next(issues, None)
+            if issue is None:
+                results.append({"task": task, "status": "failed", "error": "missing from the bulk response"})
+            else:
+                results.append({"task": task, "status": "created", "key": issue["key"]})
+        return results
+
+
+_client: Optional[JiraClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> JiraClient:
+    """Shared client, configured from the environment on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = JiraClient()
+    return _client
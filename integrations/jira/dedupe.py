@@ -0,0 +1,198 @@
+"""Suppressing actions that duplicate an existing Jira issue.
+
+Overlapping analysis windows keep detecting the same task under slightly
+different wording ("Fix server misconfiguration issue", "Fix the server
+misconfiguration"). `DuplicateIndex` keeps a MinHash signature of every
+created or open issue's summary, bucketed by LSH bands, so a candidate
+action is compared only with the few issues that share a band and is
+checked in well under a millisecond. Candidates are confirmed with the exact
+Jaccard similarity of their word sets.
+
+Summaries are a handful of words, so the signature hashes words (stopwords
+dropped, plurals folded) rather than character shingles, and the 80 hash
+functions are slices of one SHAKE-128 digest per word: that keeps a
+signature cheap to compute in pure Python.
+
+The indexed issues live in `jira_issues` in `saas_db.sqlite`; issues created
+by the outbox are added as they are created, and `refresh_open_issues`
+syncs the project's open issues from Jira.
+"""
+import array
+import asyncio
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+import aiosqlite
+
+THRESHOLD = float(os.environ.get('JIRA_DUPLICATE_THRESHOLD', '0.6'))
+BANDS = 20
+ROWS = 4  # signature values per band; similarity ~0.5 collides half the time
+
+STOPWORDS = {'a', 'an', 'and', 'the', 'to', 'of', 'for', 'in', 'on', 'with', 'is', 'be', 'it'}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jira_issues (
+        issue_key TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'open',  -- open | done
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+def tokens(text: str) -> FrozenSet[str]:
+    """Normalized words of a summary, without stopwords and with a trailing
+    plural "s" dropped"""
+    words = re.sub(r'[^\w\s]', ' ', text.lower()).split()
+    return frozenset(w[:-1] if len(w) > 3 and w.endswith('s') else w for w in words if w not in STOPWORDS)
+
+
+def _hashes(token: str, size: int) -> array.array:
+    # `size` independent 32-bit hash values from one extendable-output digest
+    return array.array('I', hashlib.shake_128(token.encode('utf-8')).digest(size * 4))
+
+
+def signature(items: FrozenSet[str], size: int = BANDS * ROWS) -> List[int]:
+    """MinHash signature of a token set: the minimum of each of `size`
+    hash functions over the tokens"""
+    columns = [_hashes(item, size) for item in items]
+    if len(columns) == 1:
+        return list(columns[0])
+    return list(map(min, *columns))
+
+
+class DuplicateIndex:
+    """Near-duplicate lookup over issue summaries, updated incrementally"""
+
+    def __init__(self, threshold: float = THRESHOLD, bands: int = BANDS, rows: int = ROWS) -> None:
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, FrozenSet[str]] = {}
+        self._buckets: Dict[Tuple, set] = {}
+        self._keys: Dict[str, List[Tuple]] = {}
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def _band_keys(self, items: FrozenSet[str]) -> List[Tuple]:
+        sig = signature(items, self.bands * self.rows)
+        return [(band, *sig[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def add(self, issue_key: str, summary: str) -> None:
+        items = tokens(summary)
+        if not items:
+            return
+        band_keys = self._band_keys(items)
+        with self._lock:
+            self._remove(issue_key)
+            self._tokens[issue_key] = items
+            self._keys[issue_key] = band_keys
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, set()).add(issue_key)
+
+    def remove(self, issue_key: str) -> None:
+        with self._lock:
+            self._remove(issue_key)
+
+    def _remove(self, issue_key: str) -> None:
+        # Caller holds the lock
+        for band_key in self._keys.pop(issue_key, []):
+            bucket = self._buckets.get(band_key)
+            if bucket:
+                bucket.discard(issue_key)
+                if not bucket:
+                    del self._buckets[band_key]
+        self._tokens.pop(issue_key, None)
+
+    def _candidates(self, band_keys: List[Tuple]) -> Set[str]:
+        # Caller holds the lock
+        candidates = set()
+        for band_key in band_keys:
+            candidates |= self._buckets.get(band_key, set())
+        return candidates
+
+    def candidates(self, summary: str) -> Set[str]:
+        """Keys of the indexed issues sharing an LSH band with `summary`, the
+        only ones `find` compares it with"""
+        items = tokens(summary)
+        if not items:
+            return set()
+        band_keys = self._band_keys(items)
+        with self._lock:
+            return self._candidates(band_keys)
+
+    def find(self, summary: str) -> Optional[Tuple[str, float]]:
+        """The most similar indexed issue at or above the threshold, as
+        (issue key, exact Jaccard similarity of the word sets)"""
+        items = tokens(summary)
+        if not items:
+            return None
+        band_keys = self._band_keys(items)
+        best = None
+        with self._lock:
+            candidates = self._candidates(band_keys)
+            size = len(items)
+            for issue_key in candidates:
+                other = self._tokens[issue_key]
+                # Sets this different in size cannot reach the threshold
+                if min(size, len(other)) < self.threshold * max(size, len(other)):
+                    continue
+                shared = len(items & other)
+                similarity = shared / (size + len(other) - shared)
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (issue_key, similarity)
+        return best
+
+
+async def init_issues(db: aiosqlite.Connection) -> None:
+    await db.execute(SCHEMA)
+
+
+async def load_index(db: aiosqlite.Connection, threshold: float = THRESHOLD) -> DuplicateIndex:
+    """Index of the stored open issues"""
+    await init_issues(db)
+    index = DuplicateIndex(threshold)
+    cursor = await db.execute("SELECT issue_key, summary FROM jira_issues WHERE status = 'open'")
+    for issue_key, summary in await cursor.fetchall():
+        index.add(issue_key, summary)
+    return index
+
+
+async def remember_issue(db: aiosqlite.Connection, issue_key: str, summary: str, status: str = 'open') -> None:
+    await db.execute(
+        """
+        INSERT INTO jira_issues (issue_key, summary, status) VALUES (?, ?, ?)
+        ON CONFLICT(issue_key) DO UPDATE SET
+            summary = excluded.summary,
+            status = excluded.status,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        (issue_key, summary, status),
+    )
+
+
+async def refresh_open_issues(db_file: str, client=None) -> int:
+    """Sync the project's open issues into `jira_issues`; issues no longer
+    open are marked done. Returns the number of open issues."""
+    if client is None:
+        from integrations.jira.client import get_client
+
+        client = get_client()
+
+    issues = await asyncio.to_thread(
+        lambda: list(client.search_issues(
+            f'project = "{client.project}" AND statusCategory != Done', fields=['summary']
+        ))
+    )
+    async with aiosqlite.connect(db_file) as db:
+        await init_issues(db)
+        await db.execute("UPDATE jira_issues SET status = 'done' WHERE status = 'open'")
+        for issue in issues:
+            await remember_issue(db, issue['key'], issue['fields']['summary'])
+        await db.commit()
+    return len(issues)
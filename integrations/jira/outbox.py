@@ -0,0 +1,325 @@
+"""Durable outbox for Jira issues detected by the analysis.
+
+Actions are written to `jira_outbox` in `saas_db.sqlite` in the same
+transaction as the analysis result (see `enqueue_actions`), so an analysis
+finishes at LLM speed and no action is lost if Jira is slow or down. A
+worker (`drain_outbox`, or `python -m integrations.jira.outbox`) claims due
+rows in batches, creates them with the bulk API, and several batches run
+concurrently.
+
+Every action has an idempotency key derived from its channel and content.
+The same action found again is not queued twice. The key is also set as a
+Jira label, so a retry after a lost response finds the issue instead of
+filing it again. Failed rows are retried with jittered exponential backoff;
+after `max_attempts` they are dead-lettered (status `dead`) for inspection.
+
+Before an action is created it is checked against the index of created and
+open issues (`integrations.jira.dedupe`). A near-duplicate is skipped, or,
+with `duplicates='merge'`, added as a comment to the existing issue; either
+way the row is marked `duplicate` with that issue's key. Actions of one
+batch are checked against each other too: each is indexed provisionally
+while the bulk request that creates it is in flight.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+import aiosqlite
+
+from integrations.jira.dedupe import DuplicateIndex, load_index, remember_issue
+from utils import metrics, tracing
+
+log = logging.getLogger(__name__)
+
+DB_FILE = 'saas_db.sqlite'
+BATCH_SIZE = 50  # one bulk request
+CONCURRENCY = 4
+MAX_ATTEMPTS = 5
+BACKOFF = 30.0  # seconds before the first retry, doubled after every failure
+LEASE = 300.0  # claimed rows of a crashed worker become due again after this
+DUPLICATES = os.environ.get('JIRA_DUPLICATES', 'skip')  # skip | merge | off
+PROVISIONAL = 'outbox-row:'  # index key of an action whose issue is being created
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jira_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        analysis_id INTEGER,  -- channel_analyses row that found the action
+        channel_id INTEGER,
+        task TEXT NOT NULL,  -- JSON action
+        status TEXT NOT NULL DEFAULT 'pending',  -- pending | claimed | created | duplicate | dead
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        issue_key TEXT,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_jira_outbox_due
+    ON jira_outbox (status, next_attempt_at);
+"""
+
+
+async def init_outbox(db: aiosqlite.Connection) -> None:
+    await db.execute(SCHEMA)
+    await db.execute(INDEX)
+
+
+def idempotency_key(channel_id, task: Dict) -> str:
+    normalized = ' '.join(str(task.get('summary', '')).lower().split())
+    description = ' '.join(str(task.get('description', '')).lower().split())
+    return hashlib.sha256(f'{channel_id}\x00{normalized}\x00{description}'.encode('utf-8')).hexdigest()
+
+
+def issue_label(key: str) -> str:
+    return f'outbox-{key[:16]}'
+
+
+async def enqueue_actions(db: aiosqlite.Connection, actions: List[Dict], channel_id=None, analysis_id=None) -> int:
+    """Queue `actions` on `db` without committing, so the caller can commit
+    them together with the analysis result. Returns how many were new."""
+    before = db.total_changes
+    await db.executemany(
+        """
+        INSERT OR IGNORE INTO jira_outbox (idempotency_key, analysis_id, channel_id, task)
+        VALUES (?, ?, ?, ?)
+        """,
+        [
+            (idempotency_key(channel_id, action), analysis_id, channel_id, json.dumps(action))
+            for action in actions
+            if isinstance(action, dict) and action.get('summary')
+        ],
+    )
+    return db.total_changes - before
+
+
+async def _claim(db: aiosqlite.Connection, lock: asyncio.Lock, limit: int) -> List[tuple]:
+    now = time.time()
+    async with lock:
+        cursor = await db.execute(
+            """
+            UPDATE jira_outbox
+            SET status = 'claimed', attempts = attempts + 1, next_attempt_at = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM jira_outbox
+                WHERE status IN ('pending', 'claimed') AND next_attempt_at <= ?
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, idempotency_key, task, attempts
+            """,
+            (now + LEASE, now, limit),
+        )
+        rows = await cursor.fetchall()
+        await db.commit()
+    return sorted(rows)
+
+
+def _provisional(row_id: int) -> str:
+    return f'{PROVISIONAL}{row_id}'
+
+
+def _merge(client, task: Dict, issue_key: str, similarity: float, duplicates: str) -> Dict:
+    # Result for an action that duplicates `issue_key`
+    if duplicates == 'merge':
+        try:
+            client.add_comment(issue_key, f"Reported again: {task['summary']}\n{task.get('description', '')}")
+        except Exception as e:
+            return {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+    return {'status': 'duplicate', 'key': issue_key, 'similarity': similarity}
+
+
+def _deliver(client, rows: List[tuple], index: Optional[DuplicateIndex] = None,
+             duplicates: str = DUPLICATES) -> List[Dict]:
+    # Runs in a worker thread: the Jira client is synchronous
+    results, pending, repeats = {}, [], {}
+    accepted = {}  # provisional index key -> row id, for this batch
+    for row_id, key, task, attempts in rows:
+        task = json.loads(task)
+        if attempts > 1:
+            # An earlier attempt may have created the issue before failing
+            try:
+                existing = client.find_issue(issue_label(key))
+            except Exception as e:
+                results[row_id] = {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+                continue
+            if existing:
+                results[row_id] = {'status': 'created', 'key': existing}
+                continue
+
+        match = index.find(task['summary']) if index is not None else None
+        if match and match[0].startswith(PROVISIONAL):
+            issue_key, similarity = match
+            if issue_key in accepted:
+                # Same as an action accepted earlier in this batch
+                repeats[row_id] = (accepted[issue_key], similarity, task)
+            else:
+                # Being created by a concurrent batch: retry once it is indexed
+                results[row_id] = {'status': 'failed', 'error': f'near-duplicate of {issue_key} in flight'}
+            continue
+        if match:
+            issue_key, similarity = match
+            results[row_id] = _merge(client, task, issue_key, similarity, duplicates)
+            continue
+        pending.append((row_id, dict(task, labels=[issue_label(key)])))
+        if index is not None:
+            # Later actions of the batch are checked against it before it exists
+            accepted[_provisional(row_id)] = row_id
+            index.add(_provisional(row_id), task['summary'])
+
+    if pending:
+        try:
+            created = client.create_issues([task for _, task in pending])
+        except Exception as e:
+            created = [{'status': 'failed', 'error': f'{type(e).__name__}: {e}'}] * len(pending)
+        finally:
+            for provisional in accepted:
+                index.remove(provisional)
+        for (row_id, task), result in zip(pending, created):
+            results[row_id] = result
+            if index is not None and result['status'] == 'created':
+                # Later batches see it right away
+                index.add(result['key'], task['summary'])
+
+    for row_id, (original, similarity, task) in repeats.items():
+        if results[original]['status'] == 'created':
+            results[row_id] = _merge(client, task, results[original]['key'], similarity, duplicates)
+        else:
+            results[row_id] = {'status': 'failed', 'error': 'near-duplicate of an action that was not created'}
+    return [results[row[0]] for row in rows]
+
+
+async def _record(db, lock, rows: List[tuple], results: List[Dict], max_attempts: int, backoff: float) -> Dict:
+    counts = {'created': 0, 'duplicate': 0, 'retry': 0, 'dead': 0}
+    now = time.time()
+    async with lock:
+        for (row_id, _, task, attempts), result in zip(rows, results):
+            if result['status'] in ('created', 'duplicate'):
+                counts[result['status']] += 1
+                await db.execute(
+                    """
+                    UPDATE jira_outbox SET status = ?, issue_key = ?, last_error = NULL,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                    """,
+                    (result['status'], result['key'], row_id),
+                )
+                if result['status'] == 'created':
+                    await remember_issue(db, result['key'], json.loads(task)['summary'])
+                else:
+                    metrics.JIRA_ISSUES.labels(status='duplicate').inc()
+                continue
+            dead = attempts >= max_attempts
+            counts['dead' if dead else 'retry'] += 1
+            # Jitter keeps the retries of a failed batch from arriving together
+            delay = random.uniform(0.5, 1.0) * backoff * 2 ** (attempts - 1)
+            await db.execute(
+                """
+                UPDATE jira_outbox SET status = ?, next_attempt_at = ?, last_error = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                ('dead' if dead else 'pending', now + delay, result.get('error'), row_id),
+            )
+            if dead:
+                metrics.JIRA_ISSUES.labels(status='dead').inc()
+                log.error('Jira outbox item %s dead-lettered: %s', row_id, result.get('error'))
+        await db.commit()
+    return counts
+
+
+async def drain_outbox(
+    db_file: str = DB_FILE,
+    client=None,
+    concurrency: int = CONCURRENCY,
+    batch_size: int = BATCH_SIZE,
+    max_attempts: int = MAX_ATTEMPTS,
+    backoff: float = BACKOFF,
+    duplicates: str = DUPLICATES,
+) -> Dict:
+    """Deliver every item that is due now and return the counts of
+    created, duplicate, retried and dead-lettered items"""
+    if client is None:
+        from integrations.jira.client import get_client
+
+        client = get_client()
+
+    totals = {'created': 0, 'duplicate': 0, 'retry': 0, 'dead': 0}
+    async with aiosqlite.connect(db_file) as db:
+        await init_outbox(db)
+        index = await load_index(db) if duplicates != 'off' else None
+        await db.commit()
+        lock = asyncio.Lock()
+
+        async def worker() -> None:
+            while True:
+                rows = await _claim(db, lock, batch_size)
+                if not rows:
+                    return
+                # A span per batch only: polling an empty outbox is not traced
+                with tracing.span('jira.deliver_batch', rows=len(rows)) as span:
+                    results = await asyncio.to_thread(_deliver, client, rows, index, duplicates)
+                    counts = await _record(db, lock, rows, results, max_attempts, backoff)
+                    span.set(**counts)
+                for name, count in counts.items():
+                    totals[name] += count
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return totals
+
+
+async def run_outbox_worker(db_file: str = DB_FILE, client=None, poll_interval: float = 5.0,
+                            stop: Optional[asyncio.Event] = None, **kwargs) -> None:
+    """Keep draining the outbox until `stop` is set"""
+    stop = stop or asyncio.Event()
+    while not stop.is_set():
+        counts = await drain_outbox(db_file, client, **kwargs)
+        if any(counts.values()):
+            log.info('Jira outbox: %s', counts)
+        try:
+            await asyncio.wait_for(stop.wait(), poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def outbox_status(db_file: str = DB_FILE) -> Dict[str, int]:
+    async with aiosqlite.connect(db_file) as db:
+        await init_outbox(db)
+        cursor = await db.execute("SELECT status, COUNT(*) FROM jira_outbox GROUP BY status")
+        return dict(await cursor.fetchall())
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description='Deliver queued Jira issues')
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--once', action='store_true', help='drain what is due and exit')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--poll-interval', type=float, default=5.0)
+    parser.add_argument('--duplicates', choices=['skip', 'merge', 'off'], default=DUPLICATES)
+    parser.add_argument('--refresh-issues', action='store_true',
+                        help="index the project's open issues from Jira first")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    if args.refresh_issues:
+        from integrations.jira.dedupe import refresh_open_issues
+
+        print(f'{asyncio.run(refresh_open_issues(args.db))} open issues indexed')
+    options = {'concurrency': args.concurrency, 'duplicates': args.duplicates}
+    if args.once:
+        print(asyncio.run(drain_outbox(args.db, **options)))
+        print(asyncio.run(outbox_status(args.db)))
+    else:
+        asyncio.run(run_outbox_worker(args.db, poll_interval=args.poll_interval, **options))
@@ -1,65 +1,41 @@
-import requests,os,json
-from requests.auth import HTTPBasicAuth
+from typing import Dict, List
 
-from dotenv import load_dotenv
+import requests
 
-
-load_dotenv()
-
-
-
-JIRA_BASE_URL = os.getenv("JIRA_BASE_URL")
-API_ENDPOINT = f"{JIRA_BASE_URL}/rest/api/3/issue"
-EMAIL = os.getenv('JIRA_API_EMAIL')
-API_TOKEN = os.getenv("JIRA_API_TOKEN")
-JIRA_PROJECT = os.getenv("JIRA_PROJECT")
+from integrations.jira.client import get_client
 
 
 def create_jira_issue(task):
-    issue_data = {
-        "fields": {
-            "project": {"key": os.getenv("JIRA_PROJECT")},
-            "summary": task["summary"],
-            "description": {
-                "type": "doc",
-                "version": 1,
-                "content": [
-                    {
-                        "type": "paragraph",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": task["description"]
-                            }
-                        ]
-                    }
-                ]
-            },
-            "issuetype": {"name": "Task"},
-            # "priority": {"name": task.get("priority", "Medium")},
-            # "duedate": task.get("due_date", None),
-        }
-    }
+    try:
+        key = get_client().create_issue(task)
+    except requests.HTTPError as e:
+        # Reported, not raised, as before the shared client
+        print(f"❌ {e}")
+        return None
+    print(f"✅ Task created: {key}")
+    return key
+
+
+def create_jira_issues(tasks: List[Dict]) -> List[Dict]:
+    # All tasks in one or a few bulk requests instead of one request each
+    results = get_client().create_issues(tasks)
+    for result in results:
+        if result["status"] == "created":
+            print(f"✅ Task created: {result['key']}")
+        else:
+            print(f"❌ Failed to create task: {result['error']}")
+    return results
 
-    response = requests.post(
-        API_ENDPOINT,
-        data=json.dumps(issue_data),
-        headers={"Content-Type": "application/json"},
-        auth=HTTPBasicAuth(EMAIL, API_TOKEN)
-    )
 
-    if response.status_code == 201:
-        print(f"✅ Task created: {response.json()['key']}")
-    else:
-        print(f"❌ Failed to create task: {response.status_code}")
-        print(response.text)
+if __name__ == "__main__":
+    from dotenv import load_dotenv
 
+    load_dotenv()
 
-if __name__ == "__main__":
     task = {'description': 'pranjalkar99 asked everyone to help fix a server '
                 'misconfiguration issue. This task was eventually completed.',
         'due_date': '2025-01-20 09:53:00',
          'priority': 'High',
         'summary': 'Fix server misconfiguration issue'}
-    
-    create_jira_issue(task)
\ No newline at end of file
+
+    create_jira_issue(task)
@@ -0,0 +1,169 @@
+"""Read queries behind the stats API of the Flask app.
+
+Discord numbers come from the `channel_user_days` rollup (one row per
+channel, UTC day and author, see `integrations.discord.store`) and GitHub
+numbers from `user_contributions` (one row per repository, user and analysis
+run, of which only the latest in the range counts, as each run stores totals),
+both read through their (…, day) indexes, so a date range never scans
+`messages`. Discord users are identified by their Discord user id and GitHub
+users by their login; the two are reported separately. Every function takes a read-only connection and returns plain
+JSON-serializable dicts.
+"""
+from datetime import date, timedelta
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 366
+TOP_USERS = 10
+
+
+def date_range(start: Optional[str], end: Optional[str], today: Optional[date] = None) -> Tuple[str, str]:
+    """Validated (start, end) days, YYYY-MM-DD and inclusive; the last 30
+    days by default"""
+    try:
+        end_day = date.fromisoformat(end) if end else (today or date.today())
+        start_day = date.fromisoformat(start) if start else end_day - timedelta(days=DEFAULT_DAYS - 1)
+    except ValueError:
+        raise ValueError('start and end must be YYYY-MM-DD')
+    if start_day > end_day:
+        raise ValueError('start is after end')
+    if (end_day - start_day).days >= MAX_DAYS:
+        raise ValueError(f'at most {MAX_DAYS} days at a time')
+    return start_day.isoformat(), end_day.isoformat()
+
+
+def _rows(db: sqlite3.Connection, query: str, params: tuple) -> List[sqlite3.Row]:
+    try:
+        return db.execute(query, params).fetchall()
+    except sqlite3.OperationalError as e:
+        # Nothing was ever stored in it
+        if 'no such table' in str(e):
+            return []
+        raise
+
+
+def channel_stats(db: sqlite3.Connection, channel_id: int, start: str, end: str) -> Dict:
+    days = _rows(
+        db,
+        """
+        SELECT day, SUM(messages) AS messages, SUM(tokens) AS tokens, COUNT(*) AS active_users
+        FROM channel_user_days
+        WHERE channel_id = ? AND day BETWEEN ? AND ?
+        GROUP BY day ORDER BY day
+        """,
+        (channel_id, start, end),
+    )
+    users = _rows(
+        db,
+        """
+        SELECT u.name, SUM(d.messages) AS messages, SUM(d.tokens) AS tokens
+        FROM channel_user_days d JOIN users u ON u.id = d.user_id
+        WHERE d.channel_id = ? AND d.day BETWEEN ? AND ?
+        GROUP BY d.user_id ORDER BY messages DESC, u.name LIMIT ?
+        """,
+        (channel_id, start, end, TOP_USERS),
+    )
+    active = _rows(
+        db,
+        """
+        SELECT COUNT(DISTINCT user_id) FROM channel_user_days
+        WHERE channel_id = ? AND day BETWEEN ? AND ?
+        """,
+        (channel_id, start, end),
+    )
+    return {
+        'channel_id': channel_id,
+        'start': start,
+        'end': end,
+        'messages': sum(row['messages'] for row in days),
+        'tokens': sum(row['tokens'] for row in days),
+        'active_users': active[0][0] if active else 0,
+        'days': [dict(row) for row in days],
+        'top_users': [dict(row) for row in users],
+    }
+
+
+def _contribution_totals(rows: List[sqlite3.Row]) -> Dict:
+    return {
+        'total_commits': sum(row['total_commits'] or 0 for row in rows),
+        'lines_added': sum(row['lines_added'] or 0 for row in rows),
+        'lines_deleted': sum(row['lines_deleted'] or 0 for row in rows),
+    }
+
+
+def repo_stats(db: sqlite3.Connection, repo: str, start: str, end: str) -> Dict:
+    rows = _rows(
+        db,
+        """
+        SELECT username, total_commits, lines_added, lines_deleted
+        FROM user_contributions
+        WHERE rowid IN (
+            SELECT MAX(rowid) FROM user_contributions
+            WHERE repo_name = ? AND date BETWEEN ? AND ?
+            GROUP BY username
+        )
+        ORDER BY total_commits DESC, username
+        """,
+        (repo, start, end),
+    )
+    return {
+        'repo': repo,
+        'start': start,
+        'end': end,
+        **_contribution_totals(rows),
+        'contributors': [dict(row) for row in rows],
+    }
+
+
+def user_stats(
+    db: sqlite3.Connection, username: str, start: str, end: str, discord_user_id: Optional[str] = None
+) -> Dict:
+    """GitHub contributions of `username`. Nothing links a GitHub login to a
+    Discord account, so Discord activity is only included for an explicitly
+    given Discord user id."""
+    repos = _rows(
+        db,
+        """
+        SELECT repo_name, total_commits, lines_added, lines_deleted
+        FROM user_contributions
+        WHERE rowid IN (
+            SELECT MAX(rowid) FROM user_contributions
+            WHERE username = ? AND date BETWEEN ? AND ?
+            GROUP BY repo_name
+        )
+        ORDER BY total_commits DESC, repo_name
+        """,
+        (username, start, end),
+    )
+    result = {
+        'username': username,
+        'start': start,
+        'end': end,
+        'github': {**_contribution_totals(repos), 'repositories': [dict(row) for row in repos]},
+    }
+    if discord_user_id is not None:
+        result['discord'] = discord_user_stats(db, discord_user_id, start, end)
+    return result
+
+
+def discord_user_stats(db: sqlite3.Connection, discord_user_id: str, start: str, end: str) -> Dict:
+    channels = _rows(
+        db,
+        """
+        SELECT d.channel_id, c.name, SUM(d.messages) AS messages, SUM(d.tokens) AS tokens,
+            COUNT(*) AS active_days
+        FROM users u
+        JOIN channel_user_days d ON d.user_id = u.id AND d.day BETWEEN ? AND ?
+        LEFT JOIN channels c ON c.id = d.channel_id
+        WHERE u.discord_user_id = ?
+        GROUP BY d.channel_id ORDER BY messages DESC
+        """,
+        (start, end, discord_user_id),
+    )
+    return {
+        'discord_user_id': discord_user_id,
+        'messages': sum(row['messages'] for row in channels),
+        'tokens': sum(row['tokens'] for row in channels),
+        'channels': [dict(row) for row in channels],
+    }
@@ -0,0 +1,133 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pathlib
+import sqlite3
+import threading
+import time
+
+import flask
+from flask.testing import FlaskClient
+import pytest
+
+from integrations.analyses import normalize_discord_channel, normalize_discord_rolling
+from utils.jobs import JobQueue, Progress
+
+
+@pytest.fixture
+def release() -> threading.Event:
+    return threading.Event()
+
+
+@pytest.fixture
+def calls() -> list:
+    return []
+
+
+@pytest.fixture
+def queue(app: flask.app.Flask, tmp_path: pathlib.Path, release: threading.Event, calls: list) -> JobQueue:
+    def run(params: dict, progress: Progress) -> dict:
+        calls.append(params)
+        progress(0.5, "summarizing messages")
+        release.wait(5)
+        if params["channel_id"] == 13:
+            raise RuntimeError("model unavailable")
+        return {"summary": f"channel {params['channel_id']}"}
+
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), {"discord_channel": run}, workers=2)
+    app.config["JOB_QUEUE"] = queue
+    yield queue
+    release.set()
+    queue.shutdown()
+    del app.config["JOB_QUEUE"]
+
+
+def _wait_for(client: FlaskClient, url: str, status: str) -> dict:
+    for _ in range(200):
+        job = client.get(url).get_json()
+        if job["status"] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job never reached {status}: {job}")
+
+
+def test_identical_jobs_share_one_execution(
+    client: FlaskClient, queue: JobQueue, release: threading.Event, calls: list
+) -> None:
+    params = {"channel_id": "1", "start_date": "2025-01-20", "end_date": "2025-02-02 12:00:00",
+              "keywords": ["Deploy", "cache"]}
+    first = client.post("/analyses", json={"kind": "discord_channel", "params": params})
+    assert first.status_code == 202
+    job_url = first.headers["Location"]
+
+    running = _wait_for(client, job_url, "running")
+    assert running["progress"] == 0.5 and running["progress_message"] == "summarizing messages"
+
+    # Same parameters, written differently
+    same = dict(params, channel_id=1, start_date="2025-01-20 00:00:00", keywords=["cache", "deploy"])
+    second = client.post("/analyses", json={"kind": "discord_channel", "params": same})
+    assert second.get_json() == dict(first.get_json(), deduplicated=True)
+
+    release.set()
+    done = _wait_for(client, job_url, "done")
+    assert done["result"] == {"summary": "channel 1"}
+    assert done["progress"] == 1.0
+    assert len(calls) == 1
+
+    # A finished job is not reused
+    third = client.post("/analyses", json={"kind": "discord_channel", "params": params})
+    assert third.get_json()["id"] != first.get_json()["id"]
+
+
+def test_failures_and_validation(client: FlaskClient, queue: JobQueue, release: threading.Event) -> None:
+    release.set()
+    failed = client.post("/analyses", json={"kind": "discord_channel", "params": {
+        "channel_id": 13, "start_date": "2025-01-20", "end_date": "2025-01-21"}})
+    job = _wait_for(client, failed.headers["Location"], "failed")
+    assert job["error"] == "RuntimeError: model unavailable"
+
+    assert client.post("/analyses", json={"kind": "slack"}).status_code == 400
+    invalid = client.post("/analyses", json={"kind": "discord_channel", "params": {"channel_id": 1}})
+    assert invalid.status_code == 400
+    assert invalid.get_json() == {"error": "start_date is required"}
+    assert client.get("/analyses/missing").status_code == 404
+
+
+def test_only_abandoned_jobs_are_reclaimed(client: FlaskClient, queue: JobQueue) -> None:
+    response = client.post("/analyses", json={"kind": "discord_channel", "params": {
+        "channel_id": 2, "start_date": "2025-01-20", "end_date": "2025-01-21"}})
+    job_url = response.headers["Location"]
+    _wait_for(client, job_url, "running")
+
+    # Another worker starting on the same database leaves a live job alone
+    JobQueue(queue.db_file, {}, workers=1).shutdown()
+    assert client.get(job_url).get_json()["status"] == "running"
+
+    # A job whose worker stopped heartbeating is failed
+    with sqlite3.connect(queue.db_file) as db:
+        db.execute("UPDATE analysis_jobs SET heartbeat_at = ?", (time.time() - 600,))
+    JobQueue(queue.db_file, {}, workers=1).shutdown()
+    job = client.get(job_url).get_json()
+    assert job["status"] == "failed" and job["error"] == "worker stopped responding"
+
+
+def test_normalized_parameters() -> None:
+    assert normalize_discord_channel(
+        {"channel_id": "7", "start_date": "2025-01-20T09:00:00", "end_date": "2025-01-21", "keywords": []}
+    ) == {"channel_id": 7, "start_date": "2025-01-20 09:00:00", "end_date": "2025-01-21 00:00:00", "keywords": None}
+    with pytest.raises(ValueError):
+        normalize_discord_channel({"channel_id": 7, "start_date": "2025-02-01", "end_date": "2025-01-01"})
+    assert normalize_discord_rolling({"channel_id": "7"}) == {"channel_id": 7, "days": 14, "end_day": None}
+    with pytest.raises(ValueError):
+        normalize_discord_rolling({"channel_id": 7, "days": 365})
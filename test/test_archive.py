@@ -0,0 +1,113 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pathlib
+import sqlite3
+
+from integrations.discord import archive, snowflake
+from integrations.discord.store import message_tokens, MessageStore
+
+
+def _record(when: datetime, content: str) -> dict:
+    return {
+        "message_id": snowflake.from_datetime(when),
+        "guild_id": 10,
+        "channel_id": 20,
+        "channel_name": "general",
+        "author_id": 30,
+        "author_name": "alice",
+        "content": content,
+        "created_at": snowflake.format_timestamp(when),
+        "edited_at": None,
+        "attachments": [],
+    }
+
+
+def _seed(db_file: str, sent: list) -> None:
+    async def write() -> None:
+        store = MessageStore(db_file)
+        await store.connect()
+        await store.write_messages([_record(when, content) for when, content in sent])
+        await store.close()
+
+    asyncio.run(write())
+
+
+def test_archive_round_trip(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "hot.sqlite")
+    archive_dir = str(tmp_path / "archive")
+    now = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+    old = now - timedelta(days=200)
+    _seed(db_file, [
+        (old, "deploy went fine"),
+        (old + timedelta(minutes=1), "thanks"),
+        (now - timedelta(days=1), "recent"),
+    ])
+
+    assert archive.archive_old_messages(db_file, 90, archive_dir) == 2
+    # Running again is a no-op
+    assert archive.archive_old_messages(db_file, 90, archive_dir) == 0
+
+    hot = sqlite3.connect(db_file)
+    assert hot.execute("SELECT content FROM messages").fetchall() == [("recent",)]
+    # The archived day keeps its aggregates, flagged as archived
+    assert hot.execute(
+        "SELECT messages, tokens, characters, archived FROM channel_user_days ORDER BY day"
+    ).fetchall() == [
+        (2, message_tokens("deploy went fine") + message_tokens("thanks"), 22, 1),
+        (1, message_tokens("recent"), 6, 0),
+    ]
+
+    rows = archive.read_archived_messages(1, old - timedelta(days=1), now, archive_dir)
+    assert [(r[1], r[3]) for r in rows] == [("deploy went fine", "alice"), ("thanks", "alice")]
+
+    rows = archive.read_archived_messages(
+        1, old - timedelta(days=1), now, archive_dir, keywords=["DEPLOY"]
+    )
+    assert [r[1] for r in rows] == ["deploy went fine"]
+
+
+def test_late_writes_to_archived_days(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "hot.sqlite")
+    archive_dir = str(tmp_path / "archive")
+    now = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+    old = (now - timedelta(days=160)).replace(hour=12, minute=0, second=0)
+    older = now - timedelta(days=200)
+    # Two months of backlog, archived one month at a time
+    _seed(db_file, [(older, "first"), (old, "deploy went fine"), (old + timedelta(minutes=1), "thanks")])
+    assert archive.archive_old_messages(db_file, 90, archive_dir) == 3
+    assert len(list(pathlib.Path(archive_dir).iterdir())) == 2
+
+    def rollup() -> list:
+        hot = sqlite3.connect(db_file)
+        rows = hot.execute(
+            "SELECT messages, characters, archived FROM channel_user_days WHERE day = ?", (old.date().isoformat(),)
+        ).fetchall()
+        hot.close()
+        return rows
+
+    assert rollup() == [(2, 22, 1)]
+    # A backfill adds to the archived day instead of replacing it
+    _seed(db_file, [(old + timedelta(minutes=2), "late")])
+    assert rollup() == [(3, 26, 1)]
+    # An edit of an archived message counts as new until it is archived too
+    _seed(db_file, [(old, "deploy went fine!")])
+    assert rollup() == [(4, 43, 1)]
+    assert archive.archive_old_messages(db_file, 90, archive_dir) == 2
+    assert rollup() == [(3, 27, 1)]
+    rows = archive.read_archived_messages(1, old - timedelta(days=1), now, archive_dir)
+    assert [r[1] for r in rows] == ["deploy went fine!", "thanks", "late"]
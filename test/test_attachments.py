@@ -0,0 +1,98 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+from datetime import datetime
+import pathlib
+import sqlite3
+
+from integrations.discord import snowflake
+from integrations.discord.store import MessageStore
+
+SENT = datetime(2025, 1, 20, 9, 30)
+
+
+def _attachment(attachment_id: str, url: str) -> dict:
+    return {
+        "attachment_id": attachment_id, "filename": f"{attachment_id}.png", "url": url,
+        "content_type": "image/png", "size": 100, "height": 10, "width": 10,
+        "description": None, "ephemeral": False, "duration": None,
+    }
+
+
+def _record(attachments: list) -> dict:
+    return {
+        "message_id": snowflake.from_datetime(SENT),
+        "guild_id": 10,
+        "channel_id": 20,
+        "channel_name": "general",
+        "author_id": 30,
+        "author_name": "alice",
+        "content": "screenshots",
+        "created_at": snowflake.format_timestamp(SENT),
+        "edited_at": None,
+        "attachments": attachments,
+    }
+
+
+async def _write(db_file: str, *batches: list) -> None:
+    store = MessageStore(db_file)
+    await store.connect()
+    for records in batches:
+        await store.write_messages(records)
+    await store.close()
+
+
+def test_replayed_attachments_are_stored_once(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "attachments.sqlite")
+    first = [_attachment("1", "https://cdn/1?v=1"), _attachment("2", "https://cdn/2?v=1")]
+    # The same message delivered again, with refreshed attachment URLs
+    again = [_attachment("1", "https://cdn/1?v=2"), _attachment("2", "https://cdn/2?v=2")]
+    asyncio.run(_write(db_file, [_record(first)], [_record(again)]))
+
+    rows = sqlite3.connect(db_file).execute(
+        "SELECT attachment_id, message_id, url FROM attachments ORDER BY attachment_id"
+    ).fetchall()
+    message_id = snowflake.from_datetime(SENT)
+    assert rows == [("1", message_id, "https://cdn/1?v=2"), ("2", message_id, "https://cdn/2?v=2")]
+
+
+def test_startup_removes_duplicates_of_older_databases(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "attachments.sqlite")
+    asyncio.run(_write(db_file))
+    db = sqlite3.connect(db_file)
+    # As stored before attachment_id was unique: a replay added copies
+    db.execute("DROP INDEX idx_attachments_attachment_id")
+    for version in (1, 2, 3):
+        db.execute(
+            "INSERT INTO attachments (message_id, attachment_id, filename, url) VALUES (1, ?, 'a.png', ?)",
+            ("7" if version < 3 else "8", f"https://cdn/{version}"),
+        )
+    db.execute(
+        "INSERT INTO attachments (message_id, attachment_id, filename, url) VALUES (1, '7', 'a.png', ?)",
+        ("https://cdn/latest",),
+    )
+    db.commit()
+    db.close()
+
+    asyncio.run(_write(db_file))
+    db = sqlite3.connect(db_file)
+    assert db.execute("SELECT attachment_id, url FROM attachments ORDER BY attachment_id").fetchall() == [
+        ("7", "https://cdn/latest"), ("8", "https://cdn/3"),
+    ]
+    # The unique index is back, so replays cannot add copies again
+    assert db.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'idx_attachments_attachment_id'"
+    ).fetchone() == (1,)
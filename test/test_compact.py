@@ -0,0 +1,79 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from integrations.discord.analysis.compact import compact_messages, Message, shorten_content
+from integrations.discord.analysis.summarize import compaction_stats
+
+LOG = "\n".join(f"2025-01-20 09:00:{i:02d} ERROR worker {i} failed" for i in range(60))
+
+WINDOW = [
+    ("deploy is failing on staging", "2025-01-20 09:00:00", "alice"),
+    ("here is the log", "2025-01-20 09:00:20", "alice"),
+    (LOG, "2025-01-20 09:00:40", "alice"),
+    ("ok", "2025-01-20 09:01:00", "bob"),
+    ("👍 <:party:123456>", "2025-01-20 09:01:10", "carol"),
+    ("Build #42 finished", "2025-01-20 09:02:00", "CI Bot"),
+    ("Deploy is failing on staging!", "2025-01-20 09:03:00", "carol"),
+    ("fixed, it was the config", "2025-01-20 09:20:00", "bob"),
+]
+
+
+def test_compact_messages() -> None:
+    compacted = compact_messages(WINDOW, bot_names=["ci bot"])
+
+    assert [(m.created_at, m.name) for m in compacted] == [
+        ("2025-01-20 09:00:00", "alice"),
+        ("2025-01-20 09:20:00", "bob"),
+    ]
+    burst = compacted[0][0]
+    assert burst.startswith("deploy is failing on staging | here is the log | ")
+    assert "worker 0 failed" in burst and "worker 59 failed" in burst
+    assert "lines omitted" in burst and "worker 30 failed" not in burst
+
+
+def test_stored_token_counts_follow_compaction() -> None:
+    window = [
+        Message("deploy is failing", "2025-01-20 09:00:00", "alice", 10),
+        Message("on staging", "2025-01-20 09:01:00", "alice", 9),
+        Message("x" * 2000, "2025-01-20 09:20:00", "bob", 300),
+    ]
+    burst, shortened = compact_messages(window, bot_names=[])
+    # A burst keeps the sum, shortened content is counted again when chunked
+    assert burst.tokens == 19
+    assert shortened.tokens is None
+
+
+def test_reworded_repeats_are_dropped() -> None:
+    window = [
+        ("the deploy is failing on staging since noon", "2025-01-20 09:00:00", "alice"),
+        ("fixed, it was the config", "2025-01-20 09:20:00", "bob"),
+        ("the deploy is failing on staging since noon again", "2025-01-20 09:40:00", "carol"),
+        ("the deploy works on staging", "2025-01-20 10:00:00", "dave"),
+    ]
+    assert [m.name for m in compact_messages(window, bot_names=[])] == ["alice", "bob", "dave"]
+    # Only exact repeats (after normalization) at similarity 1
+    assert len(compact_messages(window, bot_names=[], similarity=1.0)) == 4
+
+
+def test_shorten_code_block() -> None:
+    block = "```py\n" + "\n".join(f"x = {i}" for i in range(40)) + "\n```"
+    shortened = shorten_content(block, max_code_lines=8)
+    assert shortened.splitlines() == ["```py", "x = 0", "x = 1", "x = 2", "x = 3",
+                                      "[... 34 lines omitted ...]", "x = 38", "x = 39", "```"]
+
+
+def test_compaction_reduces_tokens() -> None:
+    stats = compaction_stats(WINDOW, compact_messages(WINDOW, bot_names=["ci bot"]))
+    assert stats["messages_before"] == 8 and stats["messages_after"] == 2
+    assert stats["tokens_before"] >= 2 * stats["tokens_after"]
@@ -0,0 +1,114 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import pathlib
+import random
+import sqlite3
+
+import aiosqlite
+
+from integrations.jira.dedupe import DuplicateIndex, init_issues, remember_issue
+from integrations.jira.outbox import drain_outbox, enqueue_actions, init_outbox
+
+
+def test_index_finds_reworded_summary() -> None:
+    index = DuplicateIndex(threshold=0.6)
+    index.add("OPS-1", "Fix server misconfiguration issue")
+    index.add("OPS-2", "Write onboarding docs for new contributors")
+
+    key, similarity = index.find("Fix the server misconfiguration")
+    assert key == "OPS-1" and similarity >= 0.6
+    assert index.find("Rotate the expired API keys") is None
+
+    index.remove("OPS-1")
+    assert index.find("Fix the server misconfiguration") is None
+    assert len(index) == 1
+
+
+def test_lookup_compares_few_candidates() -> None:
+    rng = random.Random(0)
+    verbs = ["fix", "add", "update", "remove", "migrate", "document", "rotate", "upgrade", "refactor", "deploy"]
+    nouns = [
+        "server", "database", "cache", "login", "api", "keys", "docs", "pipeline", "build", "queue",
+        "webhook", "dashboard", "billing", "search", "logging", "alerts", "tokens", "schema", "index", "backup",
+    ]
+
+    def summary() -> str:
+        return " ".join([rng.choice(verbs)] + rng.sample(nouns, 3) + ["issue"])
+
+    index = DuplicateIndex()
+    for i in range(1000):
+        index.add(f"OPS-{i}", summary())
+
+    # A lookup only compares the issues sharing a band with the query: on
+    # this overlapping corpus, about 5% of the index
+    queries = [summary() for _ in range(200)]
+    examined = [len(index.candidates(query)) for query in queries]
+    assert sum(examined) / len(queries) < len(index) / 10
+    # and a reworded summary still collides with its issue
+    index.add("OPS-X", "Rotate the expired API keys of the billing webhook")
+    assert "OPS-X" in index.candidates("Rotate expired API keys for billing webhooks")
+
+
+class FakeJira:
+    def __init__(self) -> None:
+        self.created = []
+        self.comments = []
+
+    def find_issue(self, label: str):
+        return None
+
+    def add_comment(self, key: str, text: str) -> None:
+        self.comments.append(key)
+
+    def create_issues(self, tasks: list) -> list:
+        results = []
+        for task in tasks:
+            self.created.append(task["summary"])
+            results.append({"task": task, "status": "created", "key": f"OPS-{len(self.created) + 10}"})
+        return results
+
+
+async def _prepare(db_file: str, actions: list) -> None:
+    async with aiosqlite.connect(db_file) as db:
+        await init_outbox(db)
+        await init_issues(db)
+        await remember_issue(db, "OPS-1", "Fix server misconfiguration issue")
+        await enqueue_actions(db, actions, channel_id=1)
+        await db.commit()
+
+
+def test_outbox_skips_and_merges_duplicates(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "outbox.sqlite")
+    asyncio.run(_prepare(db_file, [
+        {"summary": "Fix the server misconfiguration", "description": "again"},
+        {"summary": "Rotate the expired API keys", "description": "..."},
+        {"summary": "Rotate expired API keys", "description": "found twice in one batch"},
+    ]))
+
+    jira = FakeJira()
+    totals = asyncio.run(drain_outbox(db_file, jira, batch_size=10, concurrency=1, duplicates="merge"))
+
+    assert totals == {"created": 1, "duplicate": 2, "retry": 0, "dead": 0}
+    assert jira.created == ["Rotate the expired API keys"]
+    assert jira.comments == ["OPS-1", "OPS-11"]
+    db = sqlite3.connect(db_file)
+    assert db.execute("SELECT status, issue_key FROM jira_outbox ORDER BY id").fetchall() == [
+        ("duplicate", "OPS-1"), ("created", "OPS-11"), ("duplicate", "OPS-11"),
+    ]
+    # Created issues are remembered for later runs
+    assert db.execute("SELECT summary FROM jira_issues WHERE issue_key = 'OPS-11'").fetchone() == (
+        "Rotate the expired API keys",
+    )
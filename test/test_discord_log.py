@@ -0,0 +1,84 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import atexit
+import logging
+import pathlib
+import signal
+
+import pytest
+
+from integrations.discord import log as discord_log
+
+
+@pytest.fixture
+def discord_logger(monkeypatch: pytest.MonkeyPatch) -> logging.Logger:
+    logger = logging.getLogger(discord_log.LOGGER_NAME)
+    level, handlers = logger.level, list(logger.handlers)
+    previous_signal = signal.getsignal(signal.SIGUSR1)
+    monkeypatch.setattr(discord_log, "_listener", None)
+    yield logger
+    listener = discord_log._listener
+    if listener is not None:
+        atexit.unregister(listener.stop)
+        if listener._thread is not None:
+            listener.stop()
+    logger.handlers = handlers
+    logger.setLevel(level)
+    signal.signal(signal.SIGUSR1, previous_signal)
+
+
+def _record(name: str, level: int = logging.DEBUG) -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, "message", None, None)
+
+
+def test_sampling_per_logger() -> None:
+    sampler = discord_log.SamplingFilter({"discord.gateway": 10, "discord.state": 2, "discord.client": 1})
+    kept = {name: sum(sampler.filter(_record(name)) for _ in range(100))
+            for name in ("discord.gateway.shard", "discord.state", "discord.client", "discord.http")}
+    assert kept == {"discord.gateway.shard": 10, "discord.state": 50, "discord.client": 100, "discord.http": 100}
+    # Warnings are never sampled
+    assert all(sampler.filter(_record("discord.gateway", logging.WARNING)) for _ in range(10))
+
+
+def test_malformed_sample_rates_are_skipped(caplog: pytest.LogCaptureFixture) -> None:
+    rates = discord_log.parse_sample_rates(" discord.gateway=100, discord.state=often,discord.http,")
+    assert rates == {"discord.gateway": 100}
+    assert "discord.state=often" in caplog.text and "'discord.http'" in caplog.text
+
+
+def test_runtime_level_changes(discord_logger: logging.Logger, tmp_path: pathlib.Path,
+                               monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("DISCORD_LOG_LEVEL", "warning")
+    discord_log.setup_logging(str(tmp_path / "discord.log"))
+    assert discord_logger.level == logging.WARNING
+
+    discord_log.set_log_level("INFO")
+    assert discord_logger.level == logging.INFO
+
+    # SIGUSR1 flips between DEBUG and the configured level
+    signal.raise_signal(signal.SIGUSR1)
+    assert discord_logger.level == logging.DEBUG
+    signal.raise_signal(signal.SIGUSR1)
+    assert discord_logger.level == logging.WARNING
+
+
+def test_invalid_level_falls_back_to_debug(discord_logger: logging.Logger, tmp_path: pathlib.Path,
+                                           monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("DISCORD_LOG_LEVEL", "verbose")
+    discord_log.setup_logging(str(tmp_path / "discord.log"))
+    assert discord_logger.level == logging.DEBUG
+    discord_log._listener.stop()
+    assert "Unknown DISCORD_LOG_LEVEL 'verbose'" in (tmp_path / "discord.log").read_text()
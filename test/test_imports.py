@@ -0,0 +1,48 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pathlib
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+MODULES = [
+    "integrations.discord.save",
+    "integrations.discord.connect",
+    "integrations.discord.analysis.run",
+    "integrations.github_integrations.get",
+]
+
+HEAVY = ["github", "jwt", "langchain_core", "langchain_openai", "langchain_ollama", "openai"]
+
+
+def test_imports_are_side_effect_free(tmp_path: pathlib.Path) -> None:
+    # A fresh interpreter without credentials, outside the repo: importing
+    # must not start a bot, call an API, exit or create files
+    code = "; ".join(
+        [f"import {module}" for module in MODULES]
+        + ["import sys", f"print(sorted(m for m in {HEAVY!r} if m in sys.modules))"]
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env={"PYTHONPATH": str(ROOT), "PATH": "", "LLM_CACHE": "off"},
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+    assert list(tmp_path.iterdir()) == []
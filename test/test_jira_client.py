@@ -0,0 +1,90 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+import pytest
+import requests
+
+from integrations.jira import utils
+from integrations.jira.client import JiraClient
+
+
+class StubJira(BaseHTTPRequestHandler):
+    """Bulk issue creation that is rate limited once and rejects tasks
+    whose summary starts with "bad"."""
+
+    calls: list = []
+    next_key = 1
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        StubJira.calls.append((self.path, len(body["issueUpdates"])))
+        if len(StubJira.calls) == 1:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        issues, errors = [], []
+        for index, update in enumerate(body["issueUpdates"]):
+            if update["fields"]["summary"].startswith("bad"):
+                errors.append({"status": 400, "failedElementNumber": index,
+                               "elementErrors": {"errors": {"summary": "rejected"}}})
+            else:
+                issues.append({"id": str(StubJira.next_key), "key": f"OPS-{StubJira.next_key}"})
+                StubJira.next_key += 1
+        data = json.dumps({"issues": issues, "errors": errors}).encode()
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+def test_bulk_create_maps_results_to_tasks() -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubJira)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = JiraClient(f"http://127.0.0.1:{server.server_port}", "bot@example.com", "token", "OPS", backoff=0)
+        tasks = [{"summary": f"{'bad' if i in (3, 70) else 'task'} {i}", "description": "..."} for i in range(120)]
+        results = client.create_issues(tasks)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # 120 tasks: three bulk requests, plus one retry after the 429
+    assert StubJira.calls == [("/rest/api/3/issue/bulk", 50)] * 3 + [("/rest/api/3/issue/bulk", 20)]
+    assert [r["task"] for r in results] == tasks
+    assert [i for i, r in enumerate(results) if r["status"] == "failed"] == [3, 70]
+    assert results[3]["error"] == "summary: rejected"
+    created = [r["key"] for r in results if r["status"] == "created"]
+    assert created == [f"OPS-{n}" for n in range(1, 119)]
+
+
+def test_create_jira_issue_reports_failures(monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture) -> None:
+    class Rejecting:
+        def create_issue(self, task: dict) -> str:
+            raise requests.HTTPError("Failed to create task: 400 summary is required")
+
+    monkeypatch.setattr(utils, "get_client", Rejecting)
+    # Printed and swallowed, not raised
+    assert utils.create_jira_issue({"summary": "", "description": "..."}) is None
+    assert "400 summary is required" in capsys.readouterr().out
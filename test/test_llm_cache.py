@@ -0,0 +1,54 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pathlib
+import time
+
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.outputs import Generation
+
+from utils.llm_cache import SQLiteLLMCache
+
+
+def test_repeat_prompt_is_served_from_cache(tmp_path: pathlib.Path) -> None:
+    cache = SQLiteLLMCache(str(tmp_path / "cache.sqlite"))
+    llm = FakeListChatModel(responses=["first", "second"], cache=cache)
+
+    assert llm.invoke("summarize").content == "first"
+    assert llm.invoke("summarize").content == "first"
+    assert llm.invoke("something else").content == "second"
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 1 / 3, "entries": 2}
+
+    # Entries survive a restart
+    reopened = SQLiteLLMCache(str(tmp_path / "cache.sqlite"))
+    llm = FakeListChatModel(responses=["first", "second"], cache=reopened)
+    llm.i = 1  # a cache miss would answer "second"
+    assert llm.invoke("summarize").content == "first"
+
+
+def test_ttl_and_size_eviction(tmp_path: pathlib.Path) -> None:
+    cache = SQLiteLLMCache(str(tmp_path / "cache.sqlite"), ttl=60, max_entries=2)
+    llm = FakeListChatModel(responses=["a", "b", "c", "d"], cache=cache)
+    for prompt in ("one", "two", "three"):
+        llm.invoke(prompt)
+    # "one" was least recently used and has been evicted
+    assert cache.stats()["entries"] == 2
+    assert llm.invoke("one").content == "d"
+
+    cache.update("prompt", "model", [Generation(text="cached")])
+    assert cache.lookup("prompt", "model")[0].text == "cached"
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.lookup("prompt", "model") is None
@@ -0,0 +1,99 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+from langchain_core.messages import HumanMessage
+
+from utils.local_llm import build_local_llm
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    """Just enough of the Ollama API: model loads and slow streamed chats"""
+
+    requests: list = []
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        StubOllama.requests.append((self.path, body))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        if self.path == "/api/generate":
+            self._write({"model": body["model"], "created_at": "2025-01-20T09:00:00Z",
+                         "response": "", "done": True, "load_duration": 2_000_000_000})
+            return
+
+        with StubOllama.lock:
+            StubOllama.active += 1
+            StubOllama.max_active = max(StubOllama.max_active, StubOllama.active)
+        try:
+            for word in ("all", "good"):
+                time.sleep(0.05)
+                self._write({"model": body["model"], "created_at": "2025-01-20T09:00:00Z",
+                             "message": {"role": "assistant", "content": word + " "}, "done": False})
+            self._write({"model": body["model"], "created_at": "2025-01-20T09:00:00Z",
+                         "message": {"role": "assistant", "content": ""}, "done": True,
+                         "done_reason": "stop", "eval_count": 2, "prompt_eval_count": 5})
+        finally:
+            with StubOllama.lock:
+                StubOllama.active -= 1
+
+    def _write(self, data: dict) -> None:
+        self.wfile.write(json.dumps(data).encode() + b"\n")
+        self.wfile.flush()
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+def test_warmup_keep_alive_and_queueing() -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        llm = build_local_llm(
+            model="llama3.2",
+            base_url=f"http://127.0.0.1:{server.server_port}",
+            keep_alive="30m",
+            max_in_flight=2,
+        )
+        path, body = StubOllama.requests[0]
+        assert path == "/api/generate" and body["keep_alive"] == "30m"
+
+        async def ask_all() -> list:
+            return await asyncio.gather(*(llm.ainvoke([HumanMessage("status?")]) for _ in range(5)))
+
+        answers = asyncio.run(ask_all())
+        assert [a.content.strip() for a in answers] == ["all good"] * 5
+        assert llm.invoke([HumanMessage("status?")]).content.strip() == "all good"
+
+        chats = [body for path, body in StubOllama.requests if path == "/api/chat"]
+        assert len(chats) == 6 and all(body["keep_alive"] == "30m" for body in chats)
+        assert StubOllama.max_active == 2
+
+        stats = llm.stats()
+        assert stats["requests"] == 6 and stats["in_flight"] == 0 and stats["waiting"] == 0
+        # Three rounds of ~100 ms for five requests through two slots
+        assert stats["max_queue_wait_ms"] >= 150
+        assert stats["avg_generation_ms"] >= 100
+    finally:
+        server.shutdown()
+        server.server_close()
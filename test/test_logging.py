@@ -0,0 +1,56 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+
+import pytest
+
+from app import app as flask_app
+from utils import logging as log_config
+from utils import metadata
+
+
+class CountingMetadata(metadata.StaticMetadata):
+    calls = 0
+
+    def project_id(self) -> str:
+        CountingMetadata.calls += 1
+        return "test-project"
+
+
+def test_fast_buffered_logging_is_written_at_flush(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Only flush() writes
+    monkeypatch.setattr(log_config, "LOG_FLUSH_INTERVAL", 3600)
+    out = io.BytesIO()
+    metadata.set_provider(CountingMetadata())
+    try:
+        log = log_config.getJSONLogger(fast=True, buffered=True, file=out)
+        with flask_app.test_request_context(headers={"X-Cloud-Trace-Context": "abc/1;o=1"}):
+            for i in range(3):
+                log.info("line %d", i, status=200)
+        assert out.getvalue() == b""
+
+        log_config.flush()
+    finally:
+        metadata.set_provider(None)
+        log_config.getJSONLogger()
+
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [line["message"] for line in lines] == ["line 0", "line 1", "line 2"]
+    assert {line["severity"] for line in lines} == {"info"}
+    assert lines[0]["logging.googleapis.com/trace"] == "projects/test-project/traces/abc"
+    assert lines[0]["status"] == 200
+    # The trace field is built by the first line of the request only
+    assert CountingMetadata.calls == 1
@@ -0,0 +1,98 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from app import app as flask_app
+from utils import metadata
+from utils.logging import trace_modifier
+
+
+@pytest.fixture(autouse=True)
+def no_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    for name in metadata.PROJECT_ENV_VARS + metadata.REGION_ENV_VARS:
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_provider_resolves_once_per_ttl(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = []
+
+    def resolve_project() -> str:
+        calls.append("project")
+        return "my-project"
+
+    now = [100.0]
+    monkeypatch.setattr(metadata.time, "monotonic", lambda: now[0])
+    provider = metadata.MetadataProvider(
+        ttl=60, resolve_project=resolve_project, resolve_region=lambda: b"projects/123/regions/europe-west1"
+    )
+    assert [provider.project_id() for _ in range(1000)] == ["my-project"] * 1000
+    assert provider.region() == "europe-west1"
+    assert calls == ["project"]
+
+    now[0] += 61
+    provider.project_id()
+    assert calls == ["project", "project"]
+
+
+def test_provider_falls_back_to_environment(monkeypatch: pytest.MonkeyPatch) -> None:
+    def unavailable() -> str:
+        raise OSError("no metadata server")
+
+    provider = metadata.MetadataProvider(resolve_project=unavailable, resolve_region=unavailable)
+    assert provider.project_id() is None
+    assert provider.region() is None
+
+    monkeypatch.setenv("GOOGLE_CLOUD_PROJECT", "env-project")
+    provider = metadata.MetadataProvider(resolve_project=unavailable, resolve_region=unavailable)
+    assert provider.project_id() == "env-project"
+
+
+def test_failed_lookup_is_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    answers = [OSError("metadata server not ready"), "my-project"]
+
+    def resolve_project() -> str:
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    now = [100.0]
+    monkeypatch.setattr(metadata.time, "monotonic", lambda: now[0])
+    provider = metadata.MetadataProvider(ttl=3600, resolve_project=resolve_project, retry_ttl=30)
+    assert provider.project_id() is None
+    assert provider.project_id() is None  # remembered briefly
+    now[0] += 31
+    assert provider.project_id() == "my-project"
+    assert answers == []
+
+
+def test_trace_omitted_without_project() -> None:
+    metadata.set_provider(metadata.StaticMetadata(None))
+    try:
+        with flask_app.test_request_context(headers={"X-Cloud-Trace-Context": "abc123/1;o=1"}):
+            event = trace_modifier(None, "info", {})
+    finally:
+        metadata.set_provider(None)
+    assert "logging.googleapis.com/trace" not in event
+
+
+def test_trace_uses_stub_provider() -> None:
+    metadata.set_provider(metadata.StaticMetadata("stub-project"))
+    try:
+        with flask_app.test_request_context(headers={"X-Cloud-Trace-Context": "abc123/1;o=1"}):
+            event = trace_modifier(None, "info", {})
+    finally:
+        metadata.set_provider(None)
+    assert event["logging.googleapis.com/trace"] == "projects/stub-project/traces/abc123"
@@ -0,0 +1,72 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import urllib.request
+
+from flask.testing import FlaskClient
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from utils import metrics
+
+
+def test_registry_renders_prometheus_text() -> None:
+    registry = metrics.Registry()
+    requests = metrics.Counter("requests_total", "Requests", ["status"], registry=registry)
+    latency = metrics.Histogram("latency_seconds", "Latency", buckets=(0.1, 1), registry=registry)
+    requests.labels(status="200").inc()
+    requests.labels(status='5"0"0').inc(2)
+    latency.observe(0.05)
+    latency.observe(0.5)
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{status="200"} 1' in text
+    assert 'requests_total{status="5\\"0\\"0"} 2' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+    assert "latency_seconds_count 2" in text
+
+
+def test_llm_callbacks_record_latency_and_tokens() -> None:
+    llm = GenericFakeChatModel(
+        messages=iter([AIMessage("done", usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15})]),
+        callbacks=metrics.llm_callbacks(),
+    )
+    llm.invoke("summarize")
+
+    text = metrics.REGISTRY.render()
+    model_tokens = [line for line in text.splitlines() if line.startswith("llm_tokens_total{")]
+    assert any('kind="prompt"} 12' in line for line in model_tokens)
+    assert any('kind="completion"} 3' in line for line in model_tokens)
+    assert any(line.startswith("llm_request_duration_seconds_count{") for line in text.splitlines())
+
+
+def test_metrics_endpoint_and_server(client: FlaskClient) -> None:
+    metrics.JIRA_ISSUES.labels(status="created").inc()
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    body = response.get_data(as_text=True)
+    for name in ("http_client_requests_total", "github_rate_limit_remaining", "sqlite_write_batch_size",
+                 "discord_events_total", "llm_tokens_total", "jira_issues_total"):
+        assert f"# TYPE {name} " in body
+
+    server = metrics.serve(0, host="127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as scraped:
+            assert 'jira_issues_total{status="created"}' in scraped.read().decode()
+    finally:
+        server.shutdown()
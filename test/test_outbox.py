@@ -0,0 +1,82 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import pathlib
+import sqlite3
+from typing import Optional
+
+import aiosqlite
+
+from integrations.jira.outbox import drain_outbox, enqueue_actions, init_outbox
+
+
+class FakeJira:
+    """Creates issues in memory; loses the response of "flaky" tasks once
+    and always rejects "broken" ones"""
+
+    def __init__(self) -> None:
+        self.issues = {}  # label -> key
+        self.created = []
+        self.lost = set()
+
+    def find_issue(self, label: str) -> Optional[str]:
+        return self.issues.get(label)
+
+    def create_issues(self, tasks: list) -> list:
+        results = []
+        for task in tasks:
+            if task["summary"] == "broken":
+                results.append({"task": task, "status": "failed", "error": "400 rejected"})
+                continue
+            key = f"OPS-{len(self.created) + 1}"
+            self.created.append(task["summary"])
+            self.issues[task["labels"][0]] = key
+            if task["summary"] == "flaky" and "flaky" not in self.lost:
+                self.lost.add("flaky")
+                results.append({"task": task, "status": "failed", "error": "ReadTimeout"})
+            else:
+                results.append({"task": task, "status": "created", "key": key})
+        return results
+
+
+async def _enqueue(db_file: str, actions: list) -> int:
+    async with aiosqlite.connect(db_file) as db:
+        await init_outbox(db)
+        queued = await enqueue_actions(db, actions, channel_id=1, analysis_id=7)
+        await db.commit()
+    return queued
+
+
+def test_outbox_delivers_once_and_dead_letters(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "outbox.sqlite")
+    actions = [{"summary": s, "description": "..."} for s in ("fix config", "flaky", "broken")]
+    assert asyncio.run(_enqueue(db_file, actions)) == 3
+    # The same actions found by an overlapping analysis are not queued again
+    assert asyncio.run(_enqueue(db_file, actions + [{"summary": "Fix  Config", "description": "..."}])) == 0
+
+    jira = FakeJira()
+    totals = asyncio.run(drain_outbox(db_file, jira, concurrency=2, batch_size=2, max_attempts=3, backoff=0))
+
+    assert totals == {"created": 2, "duplicate": 0, "retry": 3, "dead": 1}
+    # The flaky issue was found by its label on retry instead of filed twice
+    assert sorted(jira.created) == ["fix config", "flaky"]
+    rows = sqlite3.connect(db_file).execute(
+        "SELECT json_extract(task, '$.summary'), status, attempts, issue_key FROM jira_outbox ORDER BY id"
+    ).fetchall()
+    assert rows == [
+        ("fix config", "created", 1, "OPS-1"),
+        ("flaky", "created", 2, "OPS-2"),
+        ("broken", "dead", 3, None),
+    ]
@@ -0,0 +1,100 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+from datetime import date, datetime
+import json
+import pathlib
+import sqlite3
+
+from langchain_core.runnables import RunnableLambda
+
+from integrations.discord import snowflake
+from integrations.discord.analysis.rolling import rolling_report
+
+calls = {"map": 0, "reduce": 0}
+
+
+def fake_map(inputs: dict) -> str:
+    calls["map"] += 1
+    return json.dumps({"summary": inputs["messages"].splitlines()[0], "insights": "", "actions": []})
+
+
+def fake_reduce(inputs: dict) -> str:
+    calls["reduce"] += 1
+    partials = [json.loads(line) for line in inputs["partials"].splitlines()]
+    return json.dumps({"summary": " | ".join(p["summary"] for p in partials), "insights": "", "actions": []})
+
+
+def _add(db_file: str, when: datetime, content: str) -> None:
+    db = sqlite3.connect(db_file)
+    db.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, name TEXT)")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, channel_id INTEGER, "
+        "user_id INTEGER, content TEXT NOT NULL, created_at TIMESTAMP NOT NULL, edited_at TIMESTAMP, "
+        "token_count INTEGER)"
+    )
+    db.execute("INSERT OR IGNORE INTO users VALUES (1, 'alice')")
+    db.execute(
+        "INSERT INTO messages (id, channel_id, user_id, content, created_at) VALUES (?, 1, 1, ?, ?)",
+        (snowflake.from_datetime(when), content, snowflake.format_timestamp(when)),
+    )
+    db.commit()
+    db.close()
+
+
+def test_rolling_report_reuses_day_checkpoints(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "rolling.sqlite")
+    for day in (1, 2, 3):
+        _add(db_file, datetime(2025, 1, day, 12), f"day {day}")
+    chains = (RunnableLambda(fake_map), RunnableLambda(fake_reduce))
+
+    def report() -> dict:
+        return asyncio.run(rolling_report(
+            1, *chains, days=3, end_day=date(2025, 1, 3), db_file=db_file
+        ))
+
+    first = report()
+    assert (first["days_summarized"], first["days_reused"]) == (3, 0)
+    assert calls["map"] == 3
+
+    second = report()
+    assert (second["days_summarized"], second["days_reused"]) == (0, 3)
+    assert calls["map"] == 3
+    assert second["summary"] == first["summary"]
+
+    # A new message only invalidates its own day
+    _add(db_file, datetime(2025, 1, 3, 13), "late news")
+    third = report()
+    assert (third["days_summarized"], third["days_reused"]) == (1, 2)
+    assert calls["map"] == 4
+
+    # So does one sent in the last second of the day
+    _add(db_file, datetime(2025, 1, 3, 23, 59, 59, 500000), "last second")
+    fourth = report()
+    assert (fourth["days_summarized"], fourth["days_reused"]) == (1, 2)
+    assert calls["map"] == 5
+
+    # An edit of an earlier message changes neither the count nor the last id
+    db = sqlite3.connect(db_file)
+    db.execute(
+        "UPDATE messages SET content = 'day 2, corrected', edited_at = '2025-01-03 08:00:00' WHERE id = ?",
+        (snowflake.from_datetime(datetime(2025, 1, 2, 12)),),
+    )
+    db.commit()
+    db.close()
+    fifth = report()
+    assert (fifth["days_summarized"], fifth["days_reused"]) == (1, 2)
+    assert calls["map"] == 6
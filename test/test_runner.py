@@ -0,0 +1,76 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+from datetime import datetime, timedelta
+import json
+import pathlib
+import sqlite3
+
+from langchain_core.runnables import RunnableLambda
+
+from integrations.discord import snowflake
+from integrations.discord.analysis.runner import analyze_channels
+
+
+def _seed(db_file: str, channels: int) -> None:
+    db = sqlite3.connect(db_file)
+    db.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+    db.execute(
+        "CREATE TABLE messages (id INTEGER PRIMARY KEY, channel_id INTEGER, "
+        "user_id INTEGER, content TEXT NOT NULL, created_at TIMESTAMP NOT NULL, token_count INTEGER)"
+    )
+    db.execute("INSERT INTO users VALUES (1, 'alice')")
+    for channel in range(1, channels + 1):
+        when = datetime(2025, 1, 20, 9) + timedelta(minutes=channel)
+        db.execute(
+            "INSERT INTO messages VALUES (?, ?, 1, ?, ?, NULL)",
+            (snowflake.from_datetime(when), channel, f"hello from {channel}",
+             snowflake.format_timestamp(when)),
+        )
+    db.commit()
+    db.close()
+
+
+def test_runner_bounds_llm_concurrency_and_stores_results(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "runner.sqlite")
+    _seed(db_file, channels=6)
+    in_flight = {"now": 0, "max": 0}
+
+    async def fake_map(inputs: dict) -> str:
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.01)
+        in_flight["now"] -= 1
+        if "from 3" in inputs["messages"]:
+            raise RuntimeError("model overloaded")
+        return json.dumps({"summary": inputs["messages"], "insights": "", "actions": []})
+
+    jobs = [
+        {"channel_id": channel, "start_date": "2025-01-20 00:00:00", "end_date": "2025-01-20 23:59:59"}
+        for channel in range(1, 7)
+    ]
+    results = asyncio.run(analyze_channels(
+        jobs, RunnableLambda(fake_map), RunnableLambda(fake_map), db_file, max_concurrency=2
+    ))
+
+    assert in_flight["max"] == 2
+    assert [r["status"] for r in results] == ["done", "done", "failed", "done", "done", "done"]
+    assert "hello from 1" in results[0]["summary"]
+
+    db = sqlite3.connect(db_file)
+    assert db.execute(
+        "SELECT status, COUNT(*) FROM channel_analyses GROUP BY status ORDER BY status"
+    ).fetchall() == [("done", 5), ("failed", 1)]
@@ -0,0 +1,69 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+from datetime import datetime
+import pathlib
+
+import aiosqlite
+
+from integrations.discord import snowflake
+from integrations.discord.search import init_search_index, keywords_query, search_messages
+
+
+async def _seed(db_file: str) -> None:
+    async with aiosqlite.connect(db_file) as db:
+        await db.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        await db.execute(
+            "CREATE TABLE messages (id INTEGER PRIMARY KEY, channel_id INTEGER, "
+            "user_id INTEGER, content TEXT NOT NULL, created_at TIMESTAMP NOT NULL)"
+        )
+        await db.execute("INSERT INTO users VALUES (1, 'alice')")
+        # Existing rows are indexed when the index is first created
+        await db.execute(
+            "INSERT INTO messages VALUES (?, 1, 1, 'deploy failed on staging', '2025-01-20 09:00:00')",
+            (snowflake.from_datetime(datetime(2025, 1, 20, 9)),),
+        )
+        await db.commit()
+        await init_search_index(db)
+        # Later rows are indexed by the triggers
+        rows = [
+            (snowflake.from_datetime(datetime(2025, 1, 21, 9)), 1, "lunch anyone?"),
+            (snowflake.from_datetime(datetime(2025, 1, 22, 9)), 1, "deploying the fix now"),
+            (snowflake.from_datetime(datetime(2025, 1, 22, 10)), 2, "deploy in another channel"),
+        ]
+        for message_id, channel_id, content in rows:
+            await db.execute(
+                "INSERT INTO messages VALUES (?, ?, 1, ?, '')", (message_id, channel_id, content)
+            )
+        await db.commit()
+
+
+def test_search_filters_by_channel_and_window(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "search.sqlite")
+    asyncio.run(_seed(db_file))
+
+    results = asyncio.run(search_messages(db_file, "deploy", channel_id=1))
+    assert sorted(r[1] for r in results) == ["deploy failed on staging", "deploying the fix now"]
+
+    results = asyncio.run(
+        search_messages(db_file, "deploy", channel_id=1, start_date=datetime(2025, 1, 21))
+    )
+    assert [r[1] for r in results] == ["deploying the fix now"]
+
+
+def test_keywords_query_quotes_terms() -> None:
+    assert keywords_query(["deploy", "outage"]) == '"deploy" OR "outage"'
+    assert keywords_query(['a"b', " "]) == '"a""b"'
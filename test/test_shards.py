@@ -0,0 +1,112 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import pathlib
+import queue
+import sqlite3
+
+import pytest
+
+from integrations.discord.shards import run_writer, ShardSupervisor, split_shards, WorkerFailed
+
+
+def _record(message_id: int, attachment_id: str = None) -> dict:
+    return {
+        "message_id": message_id,
+        "guild_id": 10,
+        "channel_id": 20,
+        "channel_name": "general",
+        "author_id": 30,
+        "author_name": "alice",
+        "content": f"message {message_id}",
+        "created_at": "2025-01-20 09:39:32",
+        "edited_at": None,
+        "attachments": [
+            {
+                "attachment_id": attachment_id,
+                "filename": "log.txt",
+                "url": "https://cdn.example/log.txt",
+                "content_type": "text/plain",
+                "size": 12,
+                "height": None,
+                "width": None,
+                "description": None,
+                "ephemeral": False,
+                "duration": None,
+            }
+        ] if attachment_id else [],
+    }
+
+
+def test_writer_batches_and_replays_idempotently(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "ingest.sqlite")
+    items = queue.Queue()
+    for message_id in (1001, 1002, 1003):
+        items.put(("message", _record(message_id, attachment_id=f"a{message_id}")))
+    # A replayed message and attachment must not be stored twice
+    items.put(("message", _record(1001, attachment_id="a1001")))
+    items.put(("stats", {
+        "shard_id": 0, "messages": 4, "per_second": 0.1, "avg_lag_ms": 5.0,
+        "max_lag_ms": 9.0, "gateway_latency_ms": 40.0,
+    }))
+    items.put(None)
+
+    asyncio.run(run_writer(db_file, items, flush_interval=0.01))
+
+    db = sqlite3.connect(db_file)
+    assert db.execute("SELECT COUNT(*) FROM messages").fetchone() == (3,)
+    assert db.execute("SELECT COUNT(*) FROM attachments").fetchone() == (3,)
+    assert db.execute("SELECT COUNT(*) FROM users").fetchone() == (1,)
+    assert db.execute("SELECT COUNT(*) FROM channels").fetchone() == (1,)
+
+
+def test_split_shards() -> None:
+    assert split_shards(5, 2) == [[0, 2, 4], [1, 3]]
+    assert split_shards(2, 8) == [[0], [1]]
+
+
+class FakeWorker:
+    def __init__(self, lives: bool) -> None:
+        self.lives = lives
+        self.exitcode = None if lives else 1
+        self.started = False
+
+    def start(self) -> None:
+        self.started = True
+
+    def is_alive(self) -> bool:
+        return self.lives
+
+
+def test_dead_workers_are_restarted_then_fatal(tmp_path: pathlib.Path) -> None:
+    spawned = []
+
+    def spawn(index: int) -> FakeWorker:
+        # Worker 0 is healthy, worker 1 crashes every time it starts
+        spawned.append(index)
+        return FakeWorker(lives=index == 0)
+
+    supervisor = ShardSupervisor(spawn, 2, max_restarts=2)
+    supervisor.start()
+    supervisor.check()
+    supervisor.check()
+    assert spawned == [0, 1, 1, 1]
+    assert all(worker.started for worker in supervisor.workers)
+
+    # The writer stops instead of waiting on the queue forever
+    with pytest.raises(WorkerFailed):
+        asyncio.run(run_writer(str(tmp_path / "ingest.sqlite"), queue.Queue(),
+                               watch=supervisor.check, watch_interval=0.01))
@@ -0,0 +1,49 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime, timezone
+import sqlite3
+
+from integrations.discord import snowflake
+
+
+def test_round_trip() -> None:
+    # Example snowflake from the Discord API reference
+    created = snowflake.to_datetime(175928847299117063)
+    assert created == datetime(2016, 4, 30, 11, 18, 25, 796000, tzinfo=timezone.utc)
+    assert snowflake.from_datetime(created) <= 175928847299117063
+    assert snowflake.from_datetime(created, high=True) >= 175928847299117063
+
+
+def test_end_bound_covers_the_whole_second() -> None:
+    end = datetime(2025, 1, 20, 12, 39, 32)
+    half_past = snowflake.from_datetime(datetime(2025, 1, 20, 12, 39, 32, 500000))
+    assert snowflake.from_datetime(end) < half_past <= snowflake.from_datetime(end, high=True)
+    assert snowflake.from_datetime(end, high=True) + 1 == snowflake.from_datetime(datetime(2025, 1, 20, 12, 39, 33))
+
+
+def test_naive_datetimes_are_utc() -> None:
+    naive = datetime(2025, 1, 20, 9, 39, 32)
+    aware = naive.replace(tzinfo=timezone.utc)
+    assert snowflake.from_datetime(naive) == snowflake.from_datetime(aware)
+    assert snowflake.format_timestamp(aware) == "2025-01-20 09:39:32"
+
+
+def test_legacy_snowflake_sql_matches_python() -> None:
+    db = sqlite3.connect(":memory:")
+    expr = snowflake.legacy_snowflake_sql(":id", ":ts")
+    params = {"id": 7, "ts": "2025-01-20 09:39:32"}
+    value = db.execute(f"SELECT {expr}", params).fetchone()[0]
+    assert value == snowflake.from_datetime(datetime(2025, 1, 20, 9, 39, 32)) | 7
+    assert snowflake.to_datetime(value).replace(tzinfo=None) == datetime(2025, 1, 20, 9, 39, 32)
@@ -0,0 +1,135 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from datetime import datetime, timedelta
+import pathlib
+import sqlite3
+
+import flask
+from flask.testing import FlaskClient
+import pytest
+
+from integrations.discord import snowflake
+from integrations.discord.store import MessageStore
+from utils.read_pool import ReadOnlyPool
+from utils.ttl_cache import TTLCache
+
+START = datetime(2025, 1, 20, 22, 0)
+DISCORD_IDS = {"alice": 301, "bob": 302}
+
+
+def _record(minutes: int, author: str) -> dict:
+    when = START + timedelta(minutes=minutes)
+    return {
+        "message_id": snowflake.from_datetime(when),
+        "guild_id": 10,
+        "channel_id": 20,
+        "channel_name": "general",
+        "author_id": DISCORD_IDS[author],
+        "author_name": author,
+        "content": "deploying the new cache",
+        "created_at": snowflake.format_timestamp(when),
+        "edited_at": None,
+        "attachments": [],
+    }
+
+
+async def _write(db_file: str, records: list) -> None:
+    store = MessageStore(db_file)
+    await store.connect()
+    await store.write_messages(records)
+    await store.close()
+
+
+@pytest.fixture
+def db_file(app: flask.app.Flask, tmp_path: pathlib.Path) -> str:
+    db_file = str(tmp_path / "stats.sqlite")
+    # alice on both days, bob on the 21st only
+    asyncio.run(_write(db_file, [_record(m, "alice") for m in (0, 30, 150)] + [_record(160, "bob")]))
+    db = sqlite3.connect(db_file)
+    db.execute("CREATE TABLE user_contributions (repo_name TEXT, username TEXT, total_commits INTEGER,"
+               " lines_added INTEGER, lines_deleted INTEGER, date TEXT)")
+    db.executemany("INSERT INTO user_contributions VALUES (?, ?, ?, ?, ?, ?)", [
+        ("acme/api", "alice", 3, 40, 2, "2025-01-20"),
+        ("acme/api", "bob", 1, 5, 0, "2025-01-21"),
+        ("acme/web", "alice", 2, 10, 10, "2025-03-01"),
+        # A later run of the same analysis: its totals replace the first's
+        ("acme/api", "alice", 4, 45, 2, "2025-01-22"),
+    ])
+    db.commit()
+    db.close()
+
+    app.config["STATS_POOL"] = ReadOnlyPool(db_file, size=2)
+    app.config["STATS_CACHE"] = TTLCache(ttl=60)
+    yield db_file
+    app.config.pop("STATS_POOL").close()
+    app.config.pop("STATS_CACHE")
+
+
+def test_channel_stats_with_etag(app: flask.app.Flask, client: FlaskClient, db_file: str) -> None:
+    channel_id = sqlite3.connect(db_file).execute("SELECT id FROM channels").fetchone()[0]
+    response = client.get(f"/stats/channels/{channel_id}?start=2025-01-20&end=2025-01-21")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body["messages"], body["active_users"]) == (4, 2)
+    assert [(d["day"], d["messages"], d["active_users"]) for d in body["days"]] == [
+        ("2025-01-20", 2, 1), ("2025-01-21", 2, 2),
+    ]
+    assert body["top_users"][0]["name"] == "alice"
+
+    etag = response.headers["ETag"]
+    again = client.get(f"/stats/channels/{channel_id}?end=2025-01-21&start=2025-01-20",
+                       headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert app.config["STATS_CACHE"].stats()["hits"] == 1
+
+
+def test_user_and_repo_stats(client: FlaskClient, db_file: str) -> None:
+    user = client.get("/stats/users/alice?start=2025-01-01&end=2025-01-31").get_json()
+    assert user["github"]["total_commits"] == 4
+    assert [r["repo_name"] for r in user["github"]["repositories"]] == ["acme/api"]
+    # A GitHub login says nothing about Discord unless the Discord id is given
+    assert "discord" not in user
+    user = client.get("/stats/users/alice?start=2025-01-01&end=2025-01-31&discord=301").get_json()
+    assert user["discord"]["messages"] == 3
+    assert user["discord"]["channels"][0]["active_days"] == 2
+    discord = client.get("/stats/discord/users/302?start=2025-01-01&end=2025-01-31").get_json()
+    assert (discord["discord_user_id"], discord["messages"]) == ("302", 1)
+
+    repo = client.get("/stats/repos/acme/api?start=2025-01-01&end=2025-01-31").get_json()
+    assert [(c["username"], c["total_commits"]) for c in repo["contributors"]] == [("alice", 4), ("bob", 1)]
+
+    assert client.get("/stats/repos/acme/api?start=2025-02-01&end=2025-01-01").status_code == 400
+    assert client.get("/stats/users/alice?start=yesterday").status_code == 400
+
+
+def test_pool_is_read_only(db_file: str) -> None:
+    pool = ReadOnlyPool(db_file, size=1)
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.connection() as db:
+            db.execute("DELETE FROM user_contributions")
+    with pool.connection() as db:
+        assert db.execute("SELECT COUNT(*) FROM user_contributions").fetchone()[0] == 4
+    pool.close()
+
+
+def test_pool_keeps_slots_when_open_fails(tmp_path: pathlib.Path) -> None:
+    pool = ReadOnlyPool(str(tmp_path / "missing.sqlite"), size=1, timeout=0.1)
+    for _ in range(2):
+        with pytest.raises(sqlite3.OperationalError):
+            with pool.connection():
+                pass
+    pool.close()
@@ -0,0 +1,88 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import json
+
+from langchain_core.runnables import RunnableLambda
+
+from integrations.discord.analysis.summarize import (
+    chunk_messages,
+    format_conversation,
+    parse_analysis,
+    split_conversations,
+    summarize_messages,
+)
+from utils.tokens import count_tokens
+
+MESSAGES = [
+    ("deploy is failing on staging", "2025-01-20 09:00:00", "alice"),
+    ("looking into it", "2025-01-20 09:05:00", "bob"),
+    ("fixed, it was the config", "2025-01-20 09:20:00", "bob"),
+    ("retro tomorrow?", "2025-01-20 15:00:00", "carol"),
+    ("sure", "2025-01-20 15:01:00", "alice"),
+]
+# Room for the first conversation but not both
+BUDGET = sum(count_tokens(line) + 1 for line in format_conversation(MESSAGES[:3]))
+
+
+def test_split_conversations_on_gaps() -> None:
+    conversations = split_conversations(MESSAGES)
+    assert [len(c) for c in conversations] == [3, 2]
+
+
+def test_relative_timestamps() -> None:
+    assert format_conversation(MESSAGES[:3]) == [
+        "[2025-01-20 09:00] alice: deploy is failing on staging",
+        "[+5m] bob: looking into it",
+        "[+15m] bob: fixed, it was the config",
+    ]
+
+
+def test_chunks_respect_budget_and_conversations() -> None:
+    # Large budget: everything fits in one chunk
+    assert len(chunk_messages(MESSAGES, budget=1000)) == 1
+    # Split at the gap between conversations, not inside one
+    chunks = chunk_messages(MESSAGES, budget=BUDGET)
+    assert len(chunks) == 2
+    assert chunks[0].splitlines()[-1].endswith("fixed, it was the config")
+
+
+def test_parse_analysis_tolerates_fences() -> None:
+    text = '```json\n{"summary": "s", "actions": [{"summary": "a"}, "junk"]}\n```'
+    assert parse_analysis(text) == {"summary": "s", "insights": "", "actions": [{"summary": "a"}]}
+    assert parse_analysis("not json")["summary"] == "not json"
+
+
+def test_map_reduce() -> None:
+    def fake_map(inputs: dict) -> str:
+        lines = inputs["messages"].splitlines()
+        return json.dumps({"summary": f"{len(lines)} messages", "insights": "", "actions": [
+            {"summary": "fix config", "description": "", "priority": "High", "due_date": ""}
+        ]})
+
+    def fake_reduce(inputs: dict) -> str:
+        partials = [json.loads(line) for line in inputs["partials"].splitlines()]
+        return json.dumps({
+            "summary": " + ".join(p["summary"] for p in partials),
+            "insights": "",
+            "actions": partials[0]["actions"],
+        })
+
+    result = asyncio.run(summarize_messages(
+        MESSAGES, RunnableLambda(fake_map), RunnableLambda(fake_reduce), budget=BUDGET
+    ))
+    assert result["summary"] == "3 messages + 2 messages"
+    assert [a["summary"] for a in result["actions"]] == ["fix config"]
@@ -0,0 +1,99 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from datetime import datetime, timedelta
+import pathlib
+import sqlite3
+
+import pytest
+
+from integrations.discord import snowflake
+from integrations.discord.analysis import summarize
+from integrations.discord.analysis.messages import get_messages_in_time_range
+from integrations.discord.analysis.summarize import chunk_messages
+from integrations.discord.store import message_tokens, MessageStore
+
+START = datetime(2025, 1, 20, 23, 50)
+
+
+def _record(minutes: int, content: str) -> dict:
+    when = START + timedelta(minutes=minutes)
+    return {
+        "message_id": snowflake.from_datetime(when),
+        "guild_id": 10,
+        "channel_id": 20,
+        "channel_name": "general",
+        "author_id": 30,
+        "author_name": "alice",
+        "content": content,
+        "created_at": snowflake.format_timestamp(when),
+        "edited_at": None,
+        "attachments": [],
+    }
+
+
+async def _write(db_file: str, records: list) -> None:
+    store = MessageStore(db_file)
+    await store.connect()
+    await store.write_messages(records)
+    await store.close()
+
+
+def test_stored_token_counts_size_chunks(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    db_file = str(tmp_path / "tokens.sqlite")
+    texts = {minutes: f"message number {minutes} " * (1 + minutes % 3) for minutes in range(0, 20, 2)}
+    # Stored out of order: the later half first, then a backfill of the rest
+    asyncio.run(_write(db_file, [_record(m, t) for m, t in texts.items() if m >= 8]))
+    asyncio.run(_write(db_file, [_record(m, t) for m, t in texts.items() if m < 8]))
+
+    db = sqlite3.connect(db_file)
+    sizes = dict(db.execute("SELECT id, token_count FROM messages ORDER BY id").fetchall())
+    assert list(sizes.values()) == [message_tokens(t) for t in texts.values()]
+    # The window spans midnight: two days in the rollup
+    assert db.execute("SELECT day, tokens FROM channel_user_days ORDER BY day").fetchall() == [
+        ("2025-01-20", sum(message_tokens(t) for m, t in texts.items() if m < 10)),
+        ("2025-01-21", sum(message_tokens(t) for m, t in texts.items() if m >= 10)),
+    ]
+
+    messages = asyncio.run(get_messages_in_time_range("2025-01-20 23:54:00", "2025-01-21 00:05:00", 1, db_file=db_file))
+    assert [m.tokens for m in messages] == [message_tokens(t) for m, t in texts.items() if 4 <= m <= 15]
+
+    # Chunks are sized from the stored counts, without tokenizing again
+    def no_tokenizing(*args: object) -> int:
+        raise AssertionError("count_tokens called")
+
+    monkeypatch.setattr(summarize, "count_tokens", no_tokenizing)
+    budget = 3 * max(sizes.values())
+    chunks = chunk_messages(messages, budget=budget)
+    assert len(chunks) > 1
+    assert sum(len(chunk.splitlines()) for chunk in chunks) == len(messages)
+    by_line = iter(m.tokens for m in messages)
+    for chunk in chunks:
+        assert sum(next(by_line) for _ in chunk.splitlines()) <= budget
+
+
+def test_rollup_follows_appends_edits_and_backfills(tmp_path: pathlib.Path) -> None:
+    db_file = str(tmp_path / "rollup.sqlite")
+    asyncio.run(_write(db_file, [_record(m, "short") for m in (4, 6, 12)]))
+    edited = dict(_record(6, "a much longer message after the edit"), edited_at="2025-01-21 00:00:00")
+    # An edit, a replay and a backfill, plus a new message
+    asyncio.run(_write(db_file, [edited, _record(12, "short"), _record(2, "backfilled"), _record(14, "new")]))
+
+    db = sqlite3.connect(db_file)
+    rollup = db.execute("SELECT day, messages, tokens FROM channel_user_days ORDER BY day").fetchall()
+    assert rollup == db.execute(
+        "SELECT substr(created_at, 1, 10), COUNT(*), SUM(token_count) FROM messages GROUP BY 1 ORDER BY 1"
+    ).fetchall()
+    assert [row[1] for row in rollup] == [3, 2]
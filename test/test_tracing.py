@@ -0,0 +1,148 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import pathlib
+import threading
+
+import pytest
+
+from app import app as flask_app
+from utils import logging as log_config
+from utils import metadata, tracing
+
+TRACE_ID = "105445aa7843bc8bf206b12000100000"
+
+
+@pytest.fixture
+def trace_file(tmp_path: pathlib.Path) -> str:
+    path = str(tmp_path / "spans.jsonl")
+    tracing.add_exporter(tracing.JsonlExporter(path))
+    yield path
+    tracing.shutdown()
+
+
+def exported(path: str) -> list:
+    tracing.shutdown()
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_nested_spans_across_threads_and_tasks(trace_file: str) -> None:
+    def insert() -> None:
+        with tracing.span("sqlite.insert"):
+            pass
+
+    @tracing.traced("fetch")
+    async def fetch(repo: str) -> int:
+        await asyncio.to_thread(insert)
+        tracing.current_span().set(repo=repo, commits=3)
+        return 3
+
+    async def analyze() -> None:
+        with tracing.span("analysis", user="octocat"):
+            await asyncio.gather(fetch("a/b"), fetch("c/d"))
+            with pytest.raises(ValueError):
+                with tracing.span("llm"):
+                    raise ValueError("rate limited")
+
+    asyncio.run(analyze())
+    spans = exported(trace_file)
+
+    by_name: dict = {}
+    for span in spans:
+        by_name.setdefault(span["name"], []).append(span)
+    [root] = by_name["analysis"]
+    assert root["parent_id"] is None and root["attributes"] == {"user": "octocat"}
+    assert {span["trace_id"] for span in spans} == {root["trace_id"]}
+    assert sorted(span["attributes"]["repo"] for span in by_name["fetch"]) == ["a/b", "c/d"]
+    assert all(span["parent_id"] == root["span_id"] for span in by_name["fetch"])
+    fetch_ids = {span["span_id"] for span in by_name["fetch"]}
+    assert {span["parent_id"] for span in by_name["sqlite.insert"]} == fetch_ids
+    assert by_name["llm"][0]["error"] == "ValueError: rate limited"
+    assert all(span["duration_ms"] >= 0 for span in spans)
+
+
+def test_spans_and_logs_share_the_request_trace() -> None:
+    out = io.StringIO()
+    metadata.set_provider(metadata.StaticMetadata("test-project"))
+    try:
+        log = log_config.getJSONLogger(file=out)
+        headers = {"X-Cloud-Trace-Context": f"{TRACE_ID}/17;o=1"}
+        with flask_app.test_request_context(headers=headers):
+            with tracing.span("handler") as span:
+                log.info("inside")
+        # Without a request, the span's trace is used
+        with tracing.span("cli") as cli_span:
+            log.info("outside")
+    finally:
+        metadata.set_provider(None)
+        log_config.getJSONLogger()
+
+    assert span.trace_id == TRACE_ID and span.parent_id == f"{17:016x}"
+    inside, outside = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert inside["logging.googleapis.com/trace"] == f"projects/test-project/traces/{TRACE_ID}"
+    assert inside["logging.googleapis.com/spanId"] == span.span_id
+    assert outside["logging.googleapis.com/trace"] == f"projects/test-project/traces/{cli_span.trace_id}"
+
+
+def test_jsonl_exporter_buffers_until_flushed(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "spans.jsonl"
+    exporter = tracing.JsonlExporter(str(path), interval=60)
+    span = tracing.start_span("buffered")
+    span.end()
+    exporter.export(span)
+    assert path.read_text() == ""
+    exporter.shutdown()
+    assert json.loads(path.read_text())["name"] == "buffered"
+
+
+class Collector(BaseHTTPRequestHandler):
+    payloads: list = []
+
+    def do_POST(self) -> None:
+        Collector.payloads.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+def test_otlp_exporter_sends_batches() -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Collector)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    exporter = tracing.OtlpExporter(f"http://127.0.0.1:{server.server_port}/v1/traces", "test", interval=3600)
+    tracing.add_exporter(exporter)
+    try:
+        with tracing.span("analysis", repo="a/b"):
+            with tracing.span("llm", prompt_tokens=12, cached=False):
+                pass
+        tracing.shutdown()
+    finally:
+        server.shutdown()
+
+    # The export request itself is not traced
+    [payload] = Collector.payloads
+    [resource] = payload["resourceSpans"]
+    assert resource["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "test"}}]
+    llm, root = resource["scopeSpans"][0]["spans"]
+    assert llm["parentSpanId"] == root["spanId"] and llm["traceId"] == root["traceId"]
+    assert {"key": "prompt_tokens", "value": {"intValue": "12"}} in llm["attributes"]
+    assert {"key": "cached", "value": {"boolValue": False}} in llm["attributes"]
+    assert root["status"] == {"code": 1} and "parentSpanId" not in root
@@ -0,0 +1,140 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from typing import Tuple
+
+from utils import metrics
+from utils.transport import endpoint_name, Transport
+
+
+class StubAPI(BaseHTTPRequestHandler):
+    """Keep-alive server: /flaky fails twice with 503, /slow tracks how many
+    requests it serves at once, POST /broken always fails with 500"""
+
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    calls: dict = {}
+    clients: set = set()
+    active = 0
+    max_active = 0
+
+    def _reply(self, status: int, body: bytes = b"{}") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        cls = StubAPI
+        with cls.lock:
+            cls.calls[self.path] = cls.calls.get(self.path, 0) + 1
+            cls.clients.add(self.client_address)
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            if self.path.startswith("/slow"):
+                time.sleep(0.05)
+            if self.path == "/flaky" and cls.calls[self.path] <= 2:
+                self._reply(503)
+            else:
+                self._reply(200, b'{"ok": true}')
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with StubAPI.lock:
+            StubAPI.calls["POST " + self.path] = StubAPI.calls.get("POST " + self.path, 0) + 1
+        self._reply(500)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+def _serve() -> Tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def test_endpoint_name_groups_ids() -> None:
+    assert endpoint_name("get", "https://api.github.com/repos/o/r/commits/" + "ab" * 20) == (
+        "GET /repos/{owner}/{repo}/commits/{id}"
+    )
+    assert endpoint_name("GET", "https://api.github.com/repos/o/r") == "GET /repos/{owner}/{repo}"
+    assert endpoint_name("GET", "https://api.github.com/repos/acme/api/pulls/7/files?page=2") == (
+        "GET /repos/{owner}/{repo}/pulls/{id}/files"
+    )
+    assert endpoint_name("GET", "https://api.github.com/users/alice/repos") == "GET /users/{user}/repos"
+    assert endpoint_name("POST", "https://x.atlassian.net/rest/api/3/issue/OPS-12/comment") == (
+        "POST /rest/api/3/issue/{id}/comment"
+    )
+
+
+def test_retries_limits_and_histograms() -> None:
+    server, base = _serve()
+    transport = Transport(max_retries=3, backoff=0, max_per_host=2)
+    try:
+        assert transport.get(f"{base}/flaky").json() == {"ok": True}
+        assert StubAPI.calls["/flaky"] == 3
+
+        # A failed POST may have been processed: not resent on a 500
+        assert transport.post(f"{base}/broken", json={}).status_code == 500
+        assert StubAPI.calls["POST /broken"] == 1
+
+        StubAPI.clients.clear()
+        with ThreadPoolExecutor(8) as pool:
+            statuses = list(pool.map(lambda i: transport.get(f"{base}/slow/{i}0").status_code, range(16)))
+        assert statuses == [200] * 16
+        assert StubAPI.max_active == 2
+        # Kept-alive connections are reused rather than opened per request
+        assert len(StubAPI.clients) <= 2
+
+        stats = transport.stats()[base]
+        assert stats["GET /flaky"]["count"] == 3
+        assert stats["GET /flaky"]["statuses"] == {"503": 2, "200": 1}
+        assert stats["GET /slow/{id}"]["count"] == 16
+        assert stats["GET /slow/{id}"]["buckets"]["+Inf"] == 16
+        assert stats["GET /slow/{id}"]["p50_ms"] >= 50
+    finally:
+        transport.close()
+        server.shutdown()
+
+
+def test_pygithub_goes_through_the_transport() -> None:
+    from github import Github
+    from github.Requester import Requester
+
+    from integrations.github_integrations.get import _transport_connection_classes
+    from utils.transport import get_transport
+
+    server, base = _serve()
+    Requester.injectConnectionClasses(*_transport_connection_classes())
+    try:
+        gh = Github(base_url=base)
+        gh.get_repo("o/r")
+        gh.get_repo("o/r")
+        assert StubAPI.calls["/repos/o/r"] == 2
+        assert get_transport().stats()[base]["GET /repos/{owner}/{repo}"]["statuses"] == {"200": 2}
+        requests_total = metrics.HTTP_REQUESTS.labels(host=base, endpoint="GET /repos/{owner}/{repo}", status="200")
+        assert requests_total.value == 2
+    finally:
+        Requester.resetConnectionClasses()
+        server.shutdown()
@@ -0,0 +1,207 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Background jobs for long-running analyses served by the Flask app.
+
+A job is submitted with a kind and its parameters and runs on a local thread
+pool; its status, progress and result are kept in `analysis_jobs`, so a
+request thread only ever inserts or reads one row. Jobs are deduplicated by
+a hash of their kind and normalized parameters: while a job is queued or
+running, submitting the same parameters returns that job's id (a partial
+unique index makes this hold across threads and processes sharing the
+database). A queue heartbeats the jobs it owns; a job whose heartbeat is
+older than the lease belongs to a worker that died, and is failed by the
+next queue that looks.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, Union
+import uuid
+
+from utils import tracing
+
+log = logging.getLogger(__name__)
+
+JOBS_DB = os.environ.get("JOBS_DB", "saas_db.sqlite")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_LEASE = float(os.environ.get("JOB_LEASE", "120"))  # seconds without a heartbeat
+
+# runner(params, progress) -> JSON-serializable result;
+# progress(fraction, message=None) records how far the job is
+Progress = Callable[..., None]
+Runner = Callable[[Dict, Progress], object]
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analysis_jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,  -- JSON, normalized
+        params_key TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',  -- queued | running | done | failed
+        progress REAL NOT NULL DEFAULT 0,
+        progress_message TEXT,
+        result TEXT,  -- JSON
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        owner TEXT,  -- host:pid:queue of the worker running it
+        heartbeat_at REAL
+    );
+"""
+
+INDEX = """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_analysis_jobs_in_flight
+    ON analysis_jobs (params_key) WHERE status IN ('queued', 'running');
+"""
+
+
+def params_key(kind: str, params: Dict) -> str:
+    encoded = json.dumps([kind, params], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class JobQueue:
+    def __init__(self, db_file: str = JOBS_DB, runners: Optional[Dict[str, Runner]] = None,
+                 workers: int = JOB_WORKERS, lease: float = JOB_LEASE) -> None:
+        self.db_file = db_file
+        self.runners = dict(runners or {})
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis-job")
+        self._local = threading.local()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease = lease
+        db = self._connect()
+        db.execute(SCHEMA)
+        self._migrate(db)
+        db.execute(INDEX)
+        self._reclaim()
+        self._stopped = threading.Event()
+        self._heartbeat = threading.Thread(target=self._beat, name="analysis-job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    @staticmethod
+    def _migrate(db: sqlite3.Connection) -> None:
+        # Tables from before jobs had owners: their jobs count as abandoned
+        columns = [row["name"] for row in db.execute("PRAGMA table_info(analysis_jobs)")]
+        if "owner" not in columns:
+            db.execute("ALTER TABLE analysis_jobs ADD COLUMN owner TEXT")
+            db.execute("ALTER TABLE analysis_jobs ADD COLUMN heartbeat_at REAL")
+
+    def _reclaim(self) -> None:
+        # Jobs whose worker stopped heartbeating will never finish
+        now = time.time()
+        cursor = self._connect().execute(
+            """
+            UPDATE analysis_jobs SET status = 'failed', error = 'worker stopped responding',
+                finished_at = ?
+            WHERE status IN ('queued', 'running') AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+            """,
+            (now, now - self.lease),
+        )
+        if cursor.rowcount:
+            log.warning("failed %d abandoned analysis job(s)", cursor.rowcount)
+
+    def _beat(self) -> None:
+        while not self._stopped.wait(self.lease / 4):
+            try:
+                self._connect().execute(
+                    "UPDATE analysis_jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                    (time.time(), self.owner),
+                )
+                self._reclaim()
+            except sqlite3.Error:
+                log.exception("analysis job heartbeat failed")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; every statement commits on its own
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.db_file, isolation_level=None, timeout=30)
+            db.row_factory = sqlite3.Row
+        return db
+
+    def submit(self, kind: str, params: Dict) -> Tuple[str, bool]:
+        """Queue a job and return its id and whether it is new; the id of
+        the queued or running job with the same parameters otherwise"""
+        if kind not in self.runners:
+            raise ValueError(f"unknown analysis kind {kind!r}")
+        key = params_key(kind, params)
+        job_id = uuid.uuid4().hex
+        db = self._connect()
+        cursor = db.execute(
+            """
+            INSERT INTO analysis_jobs (id, kind, params, params_key, created_at, owner, heartbeat_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (params_key) WHERE status IN ('queued', 'running') DO NOTHING
+            """,
+            (job_id, kind, json.dumps(params, sort_keys=True), key, time.time(), self.owner, time.time()),
+        )
+        if cursor.rowcount == 0:
+            row = db.execute(
+                "SELECT id FROM analysis_jobs WHERE params_key = ? AND status IN ('queued', 'running')",
+                (key,),
+            ).fetchone()
+            if row is not None:
+                return row["id"], False
+            # Finished in between: queue it again
+            return self.submit(kind, params)
+        # The job's span joins the trace of the request that submitted it
+        self._executor.submit(self._run, job_id, kind, params, tracing.current_context())
+        return job_id, True
+
+    def _update(self, job_id: str, **fields: Union[str, float, None]) -> None:
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._connect().execute(f"UPDATE analysis_jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _run(self, job_id: str, kind: str, params: Dict, parent: Optional[tracing.SpanContext] = None) -> None:
+        self._update(job_id, status="running", started_at=time.time(), heartbeat_at=time.time())
+
+        def progress(fraction: float, message: Optional[str] = None) -> None:
+            self._update(
+                job_id, progress=min(max(fraction, 0.0), 1.0), progress_message=message, heartbeat_at=time.time()
+            )
+
+        try:
+            with tracing.span(f"job.{kind}", parent=parent, job_id=job_id):
+                result = self.runners[kind](params, progress)
+        except Exception as e:
+            log.exception("analysis job %s failed", job_id)
+            self._update(job_id, status="failed", error=f"{type(e).__name__}: {e}", finished_at=time.time())
+            return
+        self._update(
+            job_id, status="done", progress=1.0, result=json.dumps(result, default=str), finished_at=time.time()
+        )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self._connect().execute("SELECT * FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for internal in ("params_key", "owner", "heartbeat_at"):
+            del job[internal]
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+        self._stopped.set()
@@ -0,0 +1,249 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Managed client for a local Ollama server.
+
+`ManagedChatOllama` is a drop-in `ChatOllama` that
+- preloads its model (`warmup`) and asks the server to keep it resident
+  (`keep_alive`), so no analysis pays the model load,
+- sends at most `max_in_flight` requests to the server at once and queues
+  the rest in arrival order, shared by every client of the same server,
+- records how long each request waited for a slot and how long the server
+  took to generate, see `stats()`.
+"""
+
+import asyncio
+import collections
+import contextlib
+from functools import lru_cache
+import logging
+import os
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Mapping, Optional, TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    from langchain_core.caches import BaseCache
+    from langchain_core.messages import BaseMessage
+    from langchain_ollama import ChatOllama
+
+log = logging.getLogger(__name__)
+
+
+def _base_url() -> str:
+    # Same variables as private_data.sh
+    host = os.environ.get("OLLAMA_HOST", "127.0.0.1")
+    if "://" in host:
+        return host
+    return f"http://{host}:{os.environ.get('OLLAMA_PORT', '11434')}"
+
+
+OLLAMA_BASE_URL = _base_url()
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3.2")
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# Match the server's OLLAMA_NUM_PARALLEL; extra requests only thrash it
+OLLAMA_MAX_IN_FLIGHT = int(
+    os.environ.get("OLLAMA_MAX_IN_FLIGHT", os.environ.get("OLLAMA_NUM_PARALLEL", "1"))
+)
+
+
+class InFlightLimiter:
+    """FIFO cap on concurrent requests for threads and coroutines alike,
+    with queue wait and generation time statistics"""
+
+    def __init__(self, max_in_flight: int) -> None:
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters: collections.deque = collections.deque()
+        self.requests = 0
+        self.queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.generation = 0.0
+
+    def _acquire_now(self) -> bool:
+        # Caller holds the lock
+        if self._active < self.max_in_flight and not self._waiters:
+            self._active += 1
+            return True
+        return False
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self._acquire_now():
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._acquire_now():
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if (loop, future) in self._waiters:
+                    self._waiters.remove((loop, future))
+            # Otherwise the slot is already on its way; _wake passes it on
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self._active -= 1
+                return
+            # Hand the slot straight to the next waiter
+            waiter = self._waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            loop.call_soon_threadsafe(self._wake, future)
+
+    def _wake(self, future: asyncio.Future) -> None:
+        if future.done():  # cancelled while the slot was handed over
+            self.release()
+        else:
+            future.set_result(None)
+
+    def _record(self, wait: float, generation: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.queue_wait += wait
+            self.max_queue_wait = max(self.max_queue_wait, wait)
+            self.generation += generation
+        log.debug("local LLM request waited %.0f ms, generated in %.0f ms", wait * 1000, generation * 1000)
+
+    @contextlib.contextmanager
+    def slot(self) -> Iterator[None]:
+        started = time.perf_counter()
+        self.acquire()
+        acquired = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release()
+            self._record(acquired - started, time.perf_counter() - acquired)
+
+    @contextlib.asynccontextmanager
+    async def aslot(self) -> AsyncIterator[None]:
+        started = time.perf_counter()
+        await self.aacquire()
+        acquired = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release()
+            self._record(acquired - started, time.perf_counter() - acquired)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            requests = self.requests
+            return {
+                "requests": requests,
+                "in_flight": self._active,
+                "waiting": len(self._waiters),
+                "avg_queue_wait_ms": self.queue_wait * 1000 / requests if requests else 0.0,
+                "max_queue_wait_ms": self.max_queue_wait * 1000,
+                "avg_generation_ms": self.generation * 1000 / requests if requests else 0.0,
+            }
+
+
+_limiters: Dict[str, InFlightLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(base_url: str, max_in_flight: int = OLLAMA_MAX_IN_FLIGHT) -> InFlightLimiter:
+    """The limiter shared by every client of the server at `base_url`"""
+    with _limiters_lock:
+        if base_url not in _limiters:
+            _limiters[base_url] = InFlightLimiter(max_in_flight)
+        return _limiters[base_url]
+
+
+@lru_cache(maxsize=None)
+def _managed_chat_ollama() -> type:
+    # langchain_ollama is only imported when a local model is actually used
+    from langchain_ollama import ChatOllama
+
+    class ManagedChatOllama(ChatOllama):
+        max_in_flight: int = OLLAMA_MAX_IN_FLIGHT
+
+        @property
+        def limiter(self) -> InFlightLimiter:
+            return get_limiter(self.base_url or OLLAMA_BASE_URL, self.max_in_flight)
+
+        def warmup(self) -> Dict:
+            """Load the model and keep it resident for `keep_alive`; an empty
+            generate request does exactly that"""
+            started = time.perf_counter()
+            response = self._client.generate(model=self.model, keep_alive=self.keep_alive)
+            load_ns = getattr(response, "load_duration", None) or 0
+            result = {
+                "load_ms": load_ns / 1e6,
+                "total_ms": (time.perf_counter() - started) * 1000,
+            }
+            log.info("local LLM %s warmed up: %s", self.model, result)
+            return result
+
+        def stats(self) -> Dict:
+            return self.limiter.stats()
+
+        # Every sync and async chat request goes through these two streams
+        def _create_chat_stream(
+            self, messages: "List[BaseMessage]", stop: Optional[List[str]] = None, **kwargs: object
+        ) -> Iterator[Union[Mapping[str, object], str]]:
+            with self.limiter.slot():
+                yield from super()._create_chat_stream(messages, stop, **kwargs)
+
+        async def _acreate_chat_stream(
+            self, messages: "List[BaseMessage]", stop: Optional[List[str]] = None, **kwargs: object
+        ) -> AsyncIterator[Union[Mapping[str, object], str]]:
+            async with self.limiter.aslot():
+                async for part in super()._acreate_chat_stream(messages, stop, **kwargs):
+                    yield part
+
+    return ManagedChatOllama
+
+
+def build_local_llm(
+    model: str = OLLAMA_MODEL,
+    base_url: str = OLLAMA_BASE_URL,
+    keep_alive: str = OLLAMA_KEEP_ALIVE,
+    max_in_flight: int = OLLAMA_MAX_IN_FLIGHT,
+    warmup: bool = True,
+    cache: "Union[BaseCache, bool, None]" = None,
+    **kwargs: object,
+) -> "ChatOllama":
+    """Create a managed Ollama chat model and preload its model. A failed
+    warmup is logged rather than raised: the first request loads it then."""
+    llm = _managed_chat_ollama()(
+        model=model,
+        base_url=base_url,
+        keep_alive=keep_alive,
+        max_in_flight=max_in_flight,
+        cache=cache,
+        **kwargs,
+    )
+    if warmup:
+        try:
+            llm.warmup()
+        except Exception as e:
+            log.warning("local LLM warmup failed: %s", e)
+    return llm
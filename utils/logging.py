@@ -12,12 +12,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict
+"""Structured JSON logging for Cloud Run.
 
-from flask import request
+The default configuration renders with the stdlib `json` module and prints
+each line synchronously. `LOG_FAST=1` (or `getJSONLogger(fast=True)`) selects
+a high-throughput configuration:
+- bound loggers are cached on first use and filter by level without the
+  stdlib logging machinery,
+- lines are rendered straight to bytes, with orjson when it is installed,
+- with `LOG_BUFFERED=1`, lines go to an in-memory buffer that a background
+  thread writes out every `LOG_FLUSH_INTERVAL` seconds; `flush()` (called at
+  SIGTERM) writes what is left.
+
+In either mode the trace field is computed once per request. Lines written
+inside a span (`utils.tracing`) carry its trace and span id.
+`python -m utils.logging` prints the per-call cost of each configuration.
+"""
+
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+from typing import Dict, IO, Optional
+
+from flask import g, has_request_context, request
 import structlog
 
-from utils import metadata
+from utils import metadata, tracing
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib json module is used instead
+    orjson = None
+
+LOG_FAST = os.environ.get("LOG_FAST", "").lower() in ("1", "true", "yes")
+LOG_BUFFERED = os.environ.get("LOG_BUFFERED", "").lower() in ("1", "true", "yes")
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", "0.2"))
+LOG_MAX_BUFFERED_LINES = 10000  # the caller writes them out itself beyond this
 
 
 def field_name_modifier(
@@ -39,6 +72,20 @@ def field_name_modifier(
     return event_dict
 
 
+def _trace_field() -> Optional[str]:
+    trace_header = request.headers.get("X-Cloud-Trace-Context")
+    # Only append the trace if it exists in the request
+    if not trace_header:
+        return None
+    trace = trace_header.split("/")
+    # Cached by the provider: no auth lookup per log line
+    project = metadata.get_provider().project_id()
+    # Without the project the field would point at no trace; leave it out
+    if not project:
+        return None
+    return f"projects/{project}/traces/{trace[0]}"
+
+
 def trace_modifier(
     logger: structlog.PrintLogger, log_method: str, event_dict: Dict
 ) -> Dict:
@@ -46,32 +93,118 @@ def trace_modifier(
     https://cloud.google.com/run/docs/logging#correlate-logs
     """
     # Only attempt to get the context if in a request
-    if request:
-
-        trace_header = request.headers.get("X-Cloud-Trace-Context")
-        # Only append the trace if it exists in the request
-        if trace_header:
-            trace = trace_header.split("/")
-            project = metadata.get_project_id()
-            event_dict[
-                "logging.googleapis.com/trace"
-            ] = f"projects/{project}/traces/{trace[0]}"
+    if has_request_context():
+        # Computed by the first log line of the request, reused by the rest
+        if "log_trace" not in g:
+            g.log_trace = _trace_field()
+        if g.log_trace:
+            event_dict["logging.googleapis.com/trace"] = g.log_trace
+    active = tracing.current_span()
+    if active is not None:
+        if "logging.googleapis.com/trace" not in event_dict:
+            project = metadata.get_provider().project_id()
+            if project:
+                event_dict["logging.googleapis.com/trace"] = f"projects/{project}/traces/{active.trace_id}"
+        event_dict["logging.googleapis.com/spanId"] = active.span_id
     return event_dict
 
 
-def getJSONLogger() -> structlog._config.BoundLoggerLazyProxy:
+def _dumps(event_dict: Dict, **kwargs: object) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(event_dict, default=kwargs.get("default"))
+    return json.dumps(event_dict, **kwargs).encode("utf-8")
+
+
+class BufferedWriter:
+    """File-like sink for structlog's `BytesLogger` that keeps the request
+    thread off stdout: lines are queued in memory and written in one go by a
+    background thread every `interval` seconds"""
+
+    def __init__(self, target: Optional[IO[bytes]] = None, interval: Optional[float] = None,
+                 max_lines: int = LOG_MAX_BUFFERED_LINES) -> None:
+        self.target = target or sys.stdout.buffer
+        self.interval = LOG_FLUSH_INTERVAL if interval is None else interval
+        self.max_lines = max_lines
+        self._lines: collections.deque = collections.deque()
+        self._drain_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, line: bytes) -> None:
+        self._lines.append(line)
+        # Once closed, or if the writer thread falls behind, write it now
+        if self._closed.is_set() or len(self._lines) >= self.max_lines:
+            self.drain()
+
+    def flush(self) -> None:
+        # BytesLogger flushes after every line; the writer thread does it
+        pass
+
+    def drain(self) -> None:
+        """Write out every queued line"""
+        with self._drain_lock:
+            lines = []
+            while self._lines:
+                lines.append(self._lines.popleft())
+            if lines:
+                self.target.write(b"".join(lines))
+                self.target.flush()
+
+    def _run(self) -> None:
+        while not self._closed.wait(self.interval):
+            self.drain()
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
+        self.drain()
+
+
+_writer: Optional[BufferedWriter] = None
+
+
+def getJSONLogger(
+    fast: bool = LOG_FAST, buffered: bool = LOG_BUFFERED, file: Optional[IO] = None
+) -> structlog._config.BoundLoggerLazyProxy:
     """Create a JSON logger using the field name and trace modifiers created above"""
-    # extend using https://www.structlog.org/en/stable/processors.html
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+    if not fast:
+        # extend using https://www.structlog.org/en/stable/processors.html
+        structlog.configure(
+            processors=[
+                structlog.stdlib.add_log_level,
+                structlog.stdlib.PositionalArgumentsFormatter(),
+                field_name_modifier,
+                trace_modifier,
+                structlog.processors.TimeStamper("iso"),
+                structlog.processors.JSONRenderer(),
+            ],
+            wrapper_class=structlog.stdlib.BoundLogger,
+            logger_factory=structlog.PrintLoggerFactory(file),
+            cache_logger_on_first_use=False,
+        )
+        return structlog.get_logger()
+
+    target = file or sys.stdout.buffer
+    if buffered:
+        target = _writer = BufferedWriter(target)
     structlog.configure(
         processors=[
-            structlog.stdlib.add_log_level,
-            structlog.stdlib.PositionalArgumentsFormatter(),
+            structlog.processors.add_log_level,
             field_name_modifier,
             trace_modifier,
             structlog.processors.TimeStamper("iso"),
-            structlog.processors.JSONRenderer(),
+            structlog.processors.JSONRenderer(serializer=_dumps),
         ],
-        wrapper_class=structlog.stdlib.BoundLogger,
+        # Positional arguments are formatted by the bound logger itself
+        wrapper_class=structlog.make_filtering_bound_logger(logging.NOTSET),
+        logger_factory=structlog.BytesLoggerFactory(target),
+        cache_logger_on_first_use=True,
     )
     return structlog.get_logger()
 
@@ -86,4 +219,45 @@ def flush() -> None:
     # When the logging module is imported, it registers this
     # function as an exit handler (see atexit), so normally
     # there’s no need to do that manually.
-    pass
+
+    # Lines still queued by the buffered writer are written out here
+    if _writer is not None:
+        _writer.close()
+
+
+def benchmark(lines: int = 20000) -> Dict[str, float]:
+    """Microseconds per log call of a traced request, per configuration,
+    with output to /dev/null"""
+    import time
+
+    from flask import Flask
+
+    app = Flask(__name__)
+    provider = metadata.get_provider()
+    metadata.set_provider(metadata.StaticMetadata("bench-project"))
+    results = {}
+    try:
+        with open(os.devnull, "w") as text, open(os.devnull, "wb") as binary:
+            configurations = {
+                "default": dict(fast=False, buffered=False, file=text),
+                "fast": dict(fast=True, buffered=False, file=binary),
+                "fast+buffered": dict(fast=True, buffered=True, file=binary),
+            }
+            for name, options in configurations.items():
+                log = getJSONLogger(**options)
+                headers = {"X-Cloud-Trace-Context": "105445aa7843bc8bf206b12000100000/1;o=1"}
+                with app.test_request_context(headers=headers):
+                    started = time.perf_counter()
+                    for i in range(lines):
+                        log.info("handled request", path="/", status=200, attempt=i)
+                    results[name] = (time.perf_counter() - started) * 1e6 / lines
+                flush()
+    finally:
+        metadata.set_provider(provider)
+        getJSONLogger()
+    return results
+
+
+if __name__ == "__main__":
+    for name, micros in benchmark().items():
+        print(f"{name:>14}: {micros:6.2f} µs per log call")
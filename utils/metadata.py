@@ -12,10 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import threading
+import time
+from typing import Callable, Optional, Tuple, Union
+
 import google.auth
-import requests
+
+from utils import transport
 
 METADATA_URI = "http://metadata.google.internal/computeMetadata/v1/"
+METADATA_TTL = float(os.environ.get("METADATA_TTL", "3600"))
+# How long an unresolved value is remembered before the lookup is retried
+METADATA_RETRY_TTL = float(os.environ.get("METADATA_RETRY_TTL", "30"))
+
+# Checked before the lookups, so local runs and tests need no credentials
+PROJECT_ENV_VARS = ("GOOGLE_CLOUD_PROJECT", "GCP_PROJECT", "GCLOUD_PROJECT")
+REGION_ENV_VARS = ("GOOGLE_CLOUD_REGION", "CLOUD_RUN_REGION", "FUNCTION_REGION")
 
 
 def get_project_id() -> str:
@@ -29,7 +42,7 @@ def get_service_region() -> str:
     """Get region from local metadata server
     Region in format: projects/PROJECT_NUMBER/regions/REGION"""
     slug = "instance/region"
-    data = requests.get(METADATA_URI + slug, headers={"Metadata-Flavor": "Google"})
+    data = transport.get(METADATA_URI + slug, headers={"Metadata-Flavor": "Google"}, timeout=(1, 5))
     return data.content
 
 
@@ -37,10 +50,113 @@ def authenticated_request(url: str, method: str) -> str:
     """Make a request with an ID token to a protected service
     https://cloud.google.com/functions/docs/securing/authenticating#functions-bearer-token-example-python"""
 
-    auth_req = google.auth.transport.requests.Request()
+    auth_req = google.auth.transport.requests.Request(transport.get_transport().session(METADATA_URI))
     id_token = google.oauth2.id_token.fetch_id_token(auth_req, url)
 
-    resp = requests.request(
+    resp = transport.request(
         method, url, headers={"Authorization": f"Bearer {id_token}"}
     )
     return resp.content
+
+
+def _from_env(names: Tuple[str, ...]) -> Optional[str]:
+    return next((os.environ[name] for name in names if os.environ.get(name)), None)
+
+
+def _region_name(region: Union[bytes, str]) -> str:
+    # projects/PROJECT_NUMBER/regions/REGION -> REGION
+    if isinstance(region, bytes):
+        region = region.decode("utf-8")
+    return region.rsplit("/", 1)[-1]
+
+
+class MetadataProvider:
+    """Project ID and region, resolved on first use and cached for `ttl`
+    seconds. Environment variables take precedence; when neither they nor the
+    lookup give a value, None is cached for only `retry_ttl` seconds, so a
+    missing metadata server costs one failed lookup per `retry_ttl` rather
+    than one per log line, and a transient failure does not stick."""
+
+    def __init__(
+        self,
+        ttl: float = METADATA_TTL,
+        resolve_project: Callable[[], str] = get_project_id,
+        resolve_region: Callable[[], Union[bytes, str]] = get_service_region,
+        retry_ttl: float = METADATA_RETRY_TTL,
+    ) -> None:
+        self.ttl = ttl
+        self.retry_ttl = min(retry_ttl, ttl)
+        self._resolvers = {"project": resolve_project, "region": resolve_region}
+        self._env = {"project": PROJECT_ENV_VARS, "region": REGION_ENV_VARS}
+        self._lock = threading.Lock()
+        self._cache = {}  # name -> (value, expires_at)
+
+    def _get(self, name: str) -> Optional[str]:
+        cached = self._cache.get(name)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        with self._lock:
+            # Another thread may have resolved it while we waited
+            cached = self._cache.get(name)
+            if cached and cached[1] > time.monotonic():
+                return cached[0]
+            value = _from_env(self._env[name])
+            if value is None:
+                try:
+                    value = self._resolvers[name]()
+                except Exception:
+                    value = None
+            if name == "region" and value:
+                value = _region_name(value)
+            ttl = self.ttl if value else self.retry_ttl
+            self._cache[name] = (value, time.monotonic() + ttl)
+            return value
+
+    def project_id(self) -> Optional[str]:
+        return self._get("project")
+
+    def region(self) -> Optional[str]:
+        return self._get("region")
+
+    def warm(self) -> None:
+        """Resolve both now, e.g. at startup, instead of on the first request"""
+        self.project_id()
+        self.region()
+
+
+class StaticMetadata:
+    """Provider with fixed values, for tests and local runs"""
+
+    def __init__(self, project_id: Optional[str] = "test-project", region: Optional[str] = "test-region") -> None:
+        self._project_id = project_id
+        self._region = region
+
+    def project_id(self) -> Optional[str]:
+        return self._project_id
+
+    def region(self) -> Optional[str]:
+        return self._region
+
+    def warm(self) -> None:
+        pass
+
+
+_provider: Optional[Union[MetadataProvider, StaticMetadata]] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> Union[MetadataProvider, StaticMetadata]:
+    """The process-wide provider, created on first use"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = MetadataProvider()
+    return _provider
+
+
+def set_provider(provider: Optional[Union[MetadataProvider, StaticMetadata]]) -> None:
+    """Replace the process-wide provider; None restores the default"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,375 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Prometheus-style metrics for the integrations' hot paths.
+
+A small dependency-free registry of counters, gauges and histograms with
+labels, rendered in the Prometheus text exposition format. The Flask app
+serves it at `/metrics`. Long-running processes (the Discord bot, sharded
+ingestion) can expose it on their own port with `serve(port)`, and one-shot
+CLI runs can push it to a Pushgateway with `push(url, job)`. Both are driven
+by the environment through `start_from_env()` and `push_from_env(job)`.
+
+Every metric of the process is defined below, so `/metrics` lists them all
+even before they are first used.
+"""
+
+import contextlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import threading
+import time
+from typing import (
+    ContextManager, Dict, Generic, Iterator, List, Optional, Sequence, Tuple, TYPE_CHECKING, TypeVar
+)
+from uuid import UUID
+
+from utils import tracing
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+    from langchain_core.outputs import LLMResult
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+Child = TypeVar("Child")
+
+
+class _Metric(Generic[Child]):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Child] = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values: str, **labels: str) -> Child:
+        if labels:
+            values = tuple(labels[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _default(self) -> Child:
+        # Metrics without labels are used directly
+        return self.labels()
+
+    def _new_child(self) -> Child:
+        raise NotImplementedError
+
+    def _sorted_children(self) -> List[Tuple[Tuple[str, ...], Child]]:
+        with self._lock:
+            return sorted(self._children.items())
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class _Value:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+
+class Counter(_Metric[_Value]):
+    type = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [(self.name, _format_labels(self.labelnames, key), child.value) for key, child in self._sorted_children()]
+
+
+class Gauge(_Metric[_Value]):
+    type = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [(self.name, _format_labels(self.labelnames, key), child.value) for key, child in self._sorted_children()]
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric[_HistogramValue]):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None) -> None:
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def time(self) -> ContextManager[None]:
+        return self._default().time()
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        for key, child in self._sorted_children():
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                samples.append((f"{self.name}_bucket", _format_labels(self.labelnames, key, le), cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter(
+    "http_client_requests_total", "Outbound HTTP requests (GitHub, Jira, ...) by host, endpoint and status",
+    ["host", "endpoint", "status"],
+)
+HTTP_LATENCY = Histogram(
+    "http_client_request_duration_seconds", "Outbound HTTP request latency", ["host", "endpoint"],
+)
+GITHUB_RATE_LIMIT = Gauge(
+    "github_rate_limit_remaining", "GitHub API requests left in the current rate-limit window", ["resource"],
+)
+SQLITE_BATCH_SIZE = Histogram(
+    "sqlite_write_batch_size", "Messages per SQLite write transaction", ["store"],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+)
+SQLITE_WRITE_LATENCY = Histogram(
+    "sqlite_write_duration_seconds", "Duration of a SQLite write transaction", ["store"],
+)
+DISCORD_EVENTS = Counter("discord_events_total", "Discord gateway events handled", ["event"])
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds", "LLM call latency", ["model"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0),
+)
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens used", ["model", "kind"])  # kind: prompt | completion
+JIRA_ISSUES = Counter("jira_issues_total", "Jira issues by outcome", ["status"])
+
+
+@lru_cache(maxsize=None)
+def _callback_handler_class() -> type:
+    # langchain_core is only imported when an LLM is actually built
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class MetricsCallbackHandler(BaseCallbackHandler):
+        """Records latency and token usage of every LLM call, also as an
+        "llm" span of the active trace"""
+
+        def __init__(self) -> None:
+            self._started: Dict[UUID, Tuple[float, str, tracing.Span]] = {}
+
+        def _start(self, run_id: UUID, metadata: Optional[Dict[str, object]],
+                   serialized: Optional[Dict[str, object]]) -> None:
+            model = (metadata or {}).get("ls_model_name") or ((serialized or {}).get("kwargs") or {}).get("model")
+            model = model or "unknown"
+            self._started[run_id] = (time.perf_counter(), model, tracing.start_span("llm", model=model))
+
+        def on_llm_start(self, serialized: Dict[str, object], prompts: List[str], *, run_id: UUID,
+                         metadata: Optional[Dict[str, object]] = None, **kwargs: object) -> None:
+            self._start(run_id, metadata, serialized)
+
+        def on_chat_model_start(self, serialized: Dict[str, object], messages: List[List["BaseMessage"]], *,
+                                run_id: UUID, metadata: Optional[Dict[str, object]] = None, **kwargs: object) -> None:
+            self._start(run_id, metadata, serialized)
+
+        def on_llm_end(self, response: "LLMResult", *, run_id: UUID, **kwargs: object) -> None:
+            started, model, span = self._started.pop(run_id, (None, "unknown", None))
+            if started is not None:
+                LLM_LATENCY.labels(model=model).observe(time.perf_counter() - started)
+            prompt, completion = _token_usage(response)
+            if span is not None:
+                span.set(prompt_tokens=prompt, completion_tokens=completion).end()
+            if prompt:
+                LLM_TOKENS.labels(model=model, kind="prompt").inc(prompt)
+            if completion:
+                LLM_TOKENS.labels(model=model, kind="completion").inc(completion)
+
+        def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: object) -> None:
+            started = self._started.pop(run_id, None)
+            if started is not None:
+                started[2].end(error)
+
+    return MetricsCallbackHandler
+
+
+def _token_usage(response: "LLMResult") -> Tuple[int, int]:
+    # Chat models report usage on each message, older LLMs in llm_output
+    prompt = completion = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt += usage.get("input_tokens", 0)
+                completion += usage.get("output_tokens", 0)
+    if not (prompt or completion):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return prompt, completion
+
+
+def llm_callbacks() -> list:
+    """Callbacks to pass to a LangChain model so its calls are measured"""
+    return [_callback_handler_class()()]
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Expose the registry at http://host:port/ from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info("serving metrics on port %d", server.server_port)
+    return server
+
+
+def push(gateway_url: str, job: str) -> None:
+    """Replace this job's metrics on a Prometheus Pushgateway"""
+    from utils import transport
+
+    response = transport.request(
+        "PUT", f"{gateway_url.rstrip('/')}/metrics/job/{job}",
+        data=REGISTRY.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE}, max_retries=1,
+    )
+    response.raise_for_status()
+
+
+def start_from_env() -> Optional[ThreadingHTTPServer]:
+    """Serve metrics if METRICS_PORT is set"""
+    port = os.environ.get("METRICS_PORT")
+    return serve(int(port)) if port else None
+
+
+def push_from_env(job: str) -> None:
+    """Push metrics if PUSHGATEWAY_URL is set; a failed push is only logged"""
+    url = os.environ.get("PUSHGATEWAY_URL")
+    if not url:
+        return
+    try:
+        push(url, job)
+    except Exception as e:
+        log.warning("pushing metrics failed: %s", e)
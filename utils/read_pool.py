@@ -0,0 +1,64 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pool of read-only SQLite connections for request threads.
+
+Connections are opened with `mode=ro` and `query_only`, so a read endpoint
+can never write, and are reused instead of opened per request.
+"""
+
+import contextlib
+import pathlib
+import queue
+import sqlite3
+from typing import Iterator
+
+
+class ReadOnlyPool:
+    def __init__(self, db_file: str, size: int = 8, timeout: float = 5.0) -> None:
+        self.uri = f"{pathlib.Path(db_file).resolve().as_uri()}?mode=ro"
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            # Opened lazily: None is a free slot without a connection yet
+            self._idle.put(None)
+
+    def _open(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.uri, uri=True, check_same_thread=False, timeout=self.timeout)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA query_only = ON")
+        return db
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        # Waits for a free connection when all of them are in use
+        db = self._idle.get(timeout=self.timeout)
+        try:
+            if db is None:
+                db = self._open()
+            yield db
+        except sqlite3.DatabaseError:
+            # A broken (or unopenable) connection gives its slot back empty
+            if db is not None:
+                db.close()
+            db = None
+            raise
+        finally:
+            self._idle.put(db)
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            db = self._idle.get_nowait()
+            if db is not None:
+                db.close()
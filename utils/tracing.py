@@ -0,0 +1,356 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Lightweight span tracing for the integrations.
+
+`span(name, **attributes)` times a block and `traced(name)` a function,
+sync or async. A span opened while another is active becomes its child,
+across `await`s, `asyncio.gather` and `asyncio.to_thread`; attributes can be
+added while it runs:
+
+    with tracing.span("github.contributors", repo=repo_name) as s:
+        ...
+        s.set(commits=len(commits))
+
+A span without a parent starts a trace. Inside a Flask request, that trace
+has the id of the request's `X-Cloud-Trace-Context`, the same id its log
+lines carry (see `utils.logging.trace_modifier`); log lines written inside a
+span also carry the span's trace and span id. Work handed to another thread
+takes the parent explicitly: `span(name, parent=current_context())`.
+
+Finished spans are exported to a JSONL file (`TRACE_FILE`), one span per
+line, and/or to an OTLP/HTTP collector (`OTEL_EXPORTER_OTLP_ENDPOINT`),
+both batched by a background thread. Without either, spans are only timed.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Protocol, Tuple, Union
+
+log = logging.getLogger(__name__)
+
+TRACE_FILE = os.environ.get("TRACE_FILE")
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT") or (
+    f"{os.environ['OTEL_EXPORTER_OTLP_ENDPOINT'].rstrip('/')}/v1/traces"
+    if os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT") else None
+)
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME") or os.environ.get("K_SERVICE", "contributrack")
+EXPORT_INTERVAL = 2.0  # seconds between exported batches
+MAX_QUEUED_SPANS = 10000  # beyond this, spans are dropped rather than held in memory
+
+# Span attribute values, as OTLP can represent them
+Attribute = Union[str, bool, int, float, None]
+
+
+class SpanContext(NamedTuple):
+    trace_id: str  # 32 hex digits
+    span_id: Optional[str]  # 16 hex digits; None for a trace without a parent span
+
+
+class Span:
+    """A timed operation of a trace"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, name: str, parent: Optional[SpanContext] = None, attributes: Optional[Dict] = None) -> None:
+        self.name = name
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def context(self) -> SpanContext:
+        return SpanContext(self.trace_id, self.span_id)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return (self.end_ns - self.start_ns) / 1e6 if self.end_ns is not None else None
+
+    def set(self, **attributes: Attribute) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        # Spans finished while sending spans are not exported
+        if _exporters and not _suppressed.get():
+            for exporter in _exporters:
+                exporter.export(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+# Set in the exporter's own thread, so sending spans is not traced itself
+_suppressed: contextvars.ContextVar[bool] = contextvars.ContextVar("tracing_suppressed", default=False)
+
+
+def parse_cloud_trace(header: str) -> Optional[SpanContext]:
+    """Context of an `X-Cloud-Trace-Context: TRACE_ID/SPAN_ID;o=1` header;
+    its span id is decimal"""
+    trace_id, _, rest = header.partition("/")
+    if len(trace_id) != 32:
+        return None
+    span_id = rest.split(";")[0]
+    return SpanContext(trace_id.lower(), f"{int(span_id) & (2 ** 64 - 1):016x}" if span_id.isdigit() else None)
+
+
+def _request_context() -> Optional[SpanContext]:
+    # Without Flask loaded there is no request to take a trace from
+    flask = sys.modules.get("flask")
+    if flask is None or not flask.has_request_context():
+        return None
+    header = flask.request.headers.get("X-Cloud-Trace-Context")
+    return parse_cloud_trace(header) if header else None
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_context() -> Optional[SpanContext]:
+    """Context of the active span, or else of the current request, to pass
+    as `parent` to work done on another thread"""
+    active = _current.get()
+    return active.context if active is not None else _request_context()
+
+
+def start_span(name: str, parent: Optional[SpanContext] = None, **attributes: Attribute) -> Span:
+    """Start a span without making it the active one; the caller ends it.
+    For callbacks that see the start and the end of an operation separately."""
+    return Span(name, parent or current_context(), attributes)
+
+
+@contextlib.contextmanager
+def span(name: str, parent: Optional[SpanContext] = None, **attributes: Attribute) -> Iterator[Span]:
+    """Time the block as a span, the active one while it runs. An exception
+    is recorded on the span and raised."""
+    active = Span(name, parent or current_context(), attributes)
+    token = _current.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        active.end()
+
+
+def traced(name: Optional[str] = None, **attributes: Attribute) -> Callable:
+    """Decorator running every call of a function, sync or async, in a span
+    named after it"""
+
+    def decorate(function: Callable) -> Callable:
+        span_name = name or function.__qualname__
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args: object, **kwargs: object) -> object:
+                with span(span_name, **attributes):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args: object, **kwargs: object) -> object:
+            with span(span_name, **attributes):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+class Exporter(Protocol):
+    def export(self, span: Span) -> None:
+        """Take a finished span; must not block the traced code"""
+
+    def shutdown(self) -> None:
+        """Flush what is pending and release resources"""
+
+
+class _BatchingExporter:
+    """Queues finished spans and hands them to `_send` in batches, every
+    `interval` seconds from a background thread and at shutdown"""
+
+    def __init__(self, interval: float = EXPORT_INTERVAL, max_queued: int = MAX_QUEUED_SPANS) -> None:
+        self.interval = interval
+        self.max_queued = max_queued
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            if len(self._spans) < self.max_queued:
+                self._spans.append(span)
+
+    def _send(self, spans: List[Span]) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Send every queued span; a failed batch is logged and dropped"""
+        with self._send_lock:
+            with self._lock:
+                spans, self._spans = self._spans, []
+            if not spans:
+                return
+            token = _suppressed.set(True)
+            try:
+                self._send(spans)
+            except Exception as e:
+                log.warning("exporting %d spans failed: %s", len(spans), e)
+            finally:
+                _suppressed.reset(token)
+
+    def _run(self) -> None:
+        while not self._closed.wait(self.interval):
+            self.flush()
+
+    def shutdown(self) -> None:
+        self._closed.set()
+        self._thread.join()
+        self.flush()
+
+
+class JsonlExporter(_BatchingExporter):
+    """Appends finished spans to a file, one JSON line each"""
+
+    def __init__(self, path: str, interval: float = EXPORT_INTERVAL, max_queued: int = MAX_QUEUED_SPANS) -> None:
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        super().__init__(interval, max_queued)
+
+    def _send(self, spans: List[Span]) -> None:
+        self._file.write("".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans))
+        self._file.flush()
+
+    def shutdown(self) -> None:
+        super().shutdown()
+        self._file.close()
+
+
+def _otlp_value(value: Attribute) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span: Span) -> Dict:
+    result = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # internal
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        result["parentSpanId"] = span.parent_id
+    return result
+
+
+class OtlpExporter(_BatchingExporter):
+    """Sends finished spans to an OTLP/HTTP collector as JSON, in batches
+    posted every `interval` seconds by a background thread"""
+
+    def __init__(self, endpoint: str, service_name: str = SERVICE_NAME, interval: float = EXPORT_INTERVAL,
+                 max_queued: int = MAX_QUEUED_SPANS) -> None:
+        self.endpoint = endpoint
+        self.service_name = service_name
+        super().__init__(interval, max_queued)
+
+    def _payload(self, spans: List[Span]) -> Dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [_otlp_span(s) for s in spans]}],
+        }]}
+
+    def _send(self, spans: List[Span]) -> None:
+        from utils import transport
+
+        response = transport.post(self.endpoint, json=self._payload(spans), max_retries=1)
+        response.raise_for_status()
+
+
+# Replaced, never mutated, so spans can be exported without a lock
+_exporters: Tuple[Exporter, ...] = ()
+_exporters_lock = threading.Lock()
+
+
+def add_exporter(exporter: Exporter) -> None:
+    global _exporters
+    with _exporters_lock:
+        _exporters = (*_exporters, exporter)
+
+
+def shutdown() -> None:
+    """Flush and close every exporter"""
+    global _exporters
+    with _exporters_lock:
+        exporters, _exporters = _exporters, ()
+    for exporter in exporters:
+        exporter.shutdown()
+
+
+def configure_from_env() -> None:
+    """Export to TRACE_FILE and/or the OTLP endpoint, if set"""
+    if TRACE_FILE:
+        add_exporter(JsonlExporter(TRACE_FILE))
+    if OTLP_ENDPOINT:
+        add_exporter(OtlpExporter(OTLP_ENDPOINT))
+
+
+configure_from_env()
+atexit.register(shutdown)
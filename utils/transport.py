@@ -0,0 +1,368 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared HTTP transport for every outbound API call (GitHub, Jira, the GCP
+metadata server, Discord).
+
+- One pooled `requests.Session` per host, so connections and their TLS
+  handshakes are kept alive and reused across callers.
+- Optional HTTP/2 per host through httpx, when `h2` is installed.
+- Default connect/read timeouts: no call can hang forever.
+- Retries with exponential backoff and full jitter on connection errors and
+  429/5xx responses, honouring `Retry-After`. Non-idempotent requests are
+  retried only when the server cannot have acted on them (429, 503).
+- A cap on the requests in flight to each host.
+- Latency histograms per host and endpoint, see `stats()`, also exported
+  to `utils.metrics` with GitHub's remaining rate limit.
+- A span per call, its retries included (`utils.tracing`).
+"""
+
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from utils import metrics, tracing
+
+if TYPE_CHECKING:
+    import httpx
+
+log = logging.getLogger(__name__)
+
+Timeout = Union[float, Tuple[float, float]]  # seconds, or (connect, read)
+
+TIMEOUT = (
+    float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5")),
+    float(os.environ.get("HTTP_READ_TIMEOUT", "30")),
+)
+MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+BACKOFF = 0.5  # seconds; the n-th retry waits up to BACKOFF * 2**n
+MAX_RETRY_AFTER = 60.0
+MAX_PER_HOST = int(os.environ.get("HTTP_MAX_PER_HOST", "10"))
+HTTP2 = os.environ.get("HTTP2", "").lower() in ("1", "true", "yes")
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Statuses that mean the request was not processed, safe to resend a POST
+UNPROCESSED_STATUSES = (429, 503)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+# Prometheus-style upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+_ID_SEGMENT = re.compile(r"^(\d+|[0-9a-f]{40}|[A-Z][A-Z0-9]+-\d+)$")
+# Segments followed by names rather than endpoints, e.g. GitHub's
+# /repos/<owner>/<repo>/..., and the placeholders that replace those names
+_NAMED_SEGMENTS = {"repos": ("{owner}", "{repo}"), "users": ("{user}",), "orgs": ("{org}",)}
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """`METHOD /path` with ids, commit SHAs and issue keys replaced by
+    `{id}` and owner, repository, user and organization names by
+    placeholders, so one histogram covers every call of an endpoint and the
+    number of label values stays bounded"""
+    segments = (urlsplit(url).path or "/").split("/")
+    names: List[str] = []
+    for index, segment in enumerate(segments):
+        if names:
+            segments[index] = names.pop(0)
+        elif _ID_SEGMENT.match(segment) and segments[index - 1] != "api":  # not an API version
+            segments[index] = "{id}"
+        else:
+            names = list(_NAMED_SEGMENTS.get(segment, ()))
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+class LatencyHistogram:
+    """Cumulative latency buckets with count, sum and per-status counts"""
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.statuses: Dict[str, int] = {}
+
+    def observe(self, seconds: float, status: str) -> None:
+        # Caller holds the transport lock
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile, in seconds"""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return 0.0
+
+    def snapshot(self) -> Dict[str, object]:
+        cumulative, running = {}, 0
+        for bound, count in zip(BUCKETS, self.counts):
+            running += count
+            cumulative["+Inf" if bound == float("inf") else str(bound)] = running
+        return {
+            "count": self.count,
+            "avg_ms": self.sum * 1000 / self.count if self.count else 0.0,
+            "p50_ms": self.quantile(0.5) * 1000,
+            "p95_ms": self.quantile(0.95) * 1000,
+            "sum_seconds": self.sum,
+            "buckets": cumulative,
+            "statuses": dict(self.statuses),
+        }
+
+
+class HostPool:
+    """Connections and the in-flight cap for one scheme://host:port"""
+
+    def __init__(self, max_in_flight: int, http2: bool) -> None:
+        self.max_in_flight = max_in_flight
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.session = requests.Session()
+        # Pool as many connections as may be in flight, nothing is discarded
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.client = _http2_client(max_in_flight) if http2 else None
+
+    def close(self) -> None:
+        self.session.close()
+        if self.client is not None:
+            self.client.close()
+
+
+def _http2_client(max_in_flight: int) -> Optional["httpx.Client"]:
+    try:
+        import h2  # noqa: F401  httpx needs it for HTTP/2
+        import httpx
+    except ImportError:
+        log.warning("HTTP/2 requested but httpx[http2] is not installed; using HTTP/1.1")
+        return None
+    return httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+    )
+
+
+def _send_http2(client: "httpx.Client", method: str, url: str, timeout: Timeout, **kwargs: object) -> requests.Response:
+    """Send with httpx and return a `requests.Response`, so callers see one
+    response type and one set of exceptions whichever protocol is used"""
+    import httpx
+
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    auth = kwargs.pop("auth", None)
+    if isinstance(auth, requests.auth.HTTPBasicAuth):
+        auth = (auth.username, auth.password)
+    # requests' options under httpx's names; the body is always read and
+    # TLS verification is a setting of the client
+    kwargs["follow_redirects"] = kwargs.pop("allow_redirects", True)
+    kwargs.pop("stream", None)
+    kwargs.pop("verify", None)
+    data = kwargs.pop("data", None)
+    if isinstance(data, (bytes, str)):
+        kwargs["content"] = data
+    elif data is not None:
+        kwargs["data"] = data
+    try:
+        response = client.request(
+            method, url, auth=auth, timeout=httpx.Timeout(read, connect=connect), **kwargs
+        )
+    except httpx.TimeoutException as e:
+        raise requests.Timeout(str(e)) from e
+    except httpx.TransportError as e:
+        raise requests.ConnectionError(str(e)) from e
+
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.headers = CaseInsensitiveDict(response.headers)
+    converted._content = response.content
+    converted.url = str(response.url)
+    converted.reason = response.reason_phrase
+    converted.encoding = response.encoding
+    return converted
+
+
+class Transport:
+    def __init__(
+        self,
+        timeout: Timeout = TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+        backoff: float = BACKOFF,
+        max_per_host: int = MAX_PER_HOST,
+        http2: bool = HTTP2,
+    ) -> None:
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_per_host = max_per_host
+        self.http2 = http2
+        self._lock = threading.Lock()
+        self._pools: Dict[str, HostPool] = {}
+        self._host_options: Dict[str, Dict] = {}
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+
+    def configure_host(self, host: str, max_in_flight: Optional[int] = None, http2: Optional[bool] = None) -> None:
+        """Override the in-flight cap or HTTP/2 for `host` (`scheme://host[:port]`).
+        Takes effect for a pool not yet created."""
+        options = {"max_in_flight": max_in_flight, "http2": http2}
+        with self._lock:
+            self._host_options[host] = {k: v for k, v in options.items() if v is not None}
+
+    def _pool(self, host: str) -> HostPool:
+        with self._lock:
+            pool = self._pools.get(host)
+            if pool is None:
+                options = self._host_options.get(host, {})
+                pool = self._pools[host] = HostPool(
+                    options.get("max_in_flight", self.max_per_host),
+                    options.get("http2", self.http2) and host.startswith("https://"),
+                )
+            return pool
+
+    def session(self, url: str) -> requests.Session:
+        """The pooled session for the host of `url`, for libraries that take one"""
+        return self._pool(_host(url)).session
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        timeout: Optional[Timeout] = None,
+        max_retries: Optional[int] = None,
+        backoff: Optional[float] = None,
+        idempotent: Optional[bool] = None,
+        endpoint: Optional[str] = None,
+        **kwargs: object,
+    ) -> requests.Response:
+        """Send a request, retrying transient failures. The last response is
+        returned whatever its status; the last connection error is raised."""
+        method = method.upper()
+        host = _host(url)
+        pool = self._pool(host)
+        endpoint = endpoint or endpoint_name(method, url)
+        timeout = timeout or self.timeout
+        max_retries = self.max_retries if max_retries is None else max_retries
+        backoff = self.backoff if backoff is None else backoff
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        with tracing.span(f"{method} {endpoint}", host=host) as active:
+            for attempt in range(max_retries + 1):
+                last_try = attempt == max_retries
+                started = time.perf_counter()
+                try:
+                    with pool.slots:
+                        if pool.client is not None:
+                            response = _send_http2(pool.client, method, url, timeout, **kwargs)
+                        else:
+                            response = pool.session.request(method, url, timeout=timeout, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self._observe(host, endpoint, time.perf_counter() - started, type(e).__name__)
+                    # A request that timed out reading may have been processed
+                    if last_try or not (idempotent or isinstance(e, requests.ConnectTimeout)):
+                        raise
+                    delay = _delay(backoff, attempt)
+                else:
+                    self._observe(host, endpoint, time.perf_counter() - started, str(response.status_code))
+                    active.set(status=response.status_code, attempts=attempt + 1)
+                    if "X-RateLimit-Remaining" in response.headers and host == "https://api.github.com":
+                        metrics.GITHUB_RATE_LIMIT.labels(
+                            resource=response.headers.get("X-RateLimit-Resource", "core")
+                        ).set(int(response.headers["X-RateLimit-Remaining"]))
+                    retryable = UNPROCESSED_STATUSES if not idempotent else RETRY_STATUSES
+                    if response.status_code not in retryable or last_try:
+                        return response
+                    delay = _delay(backoff, attempt, response.headers.get("Retry-After"))
+                    response.close()
+                log.debug("retrying %s %s in %.2fs (attempt %d)", method, endpoint, delay, attempt + 1)
+                time.sleep(delay)
+
+    def _observe(self, host: str, endpoint: str, seconds: float, status: str) -> None:
+        metrics.HTTP_REQUESTS.labels(host=host, endpoint=endpoint, status=status).inc()
+        metrics.HTTP_LATENCY.labels(host=host, endpoint=endpoint).observe(seconds)
+        with self._lock:
+            histogram = self._histograms.get((host, endpoint))
+            if histogram is None:
+                histogram = self._histograms[(host, endpoint)] = LatencyHistogram()
+            histogram.observe(seconds, status)
+
+    def get(self, url: str, **kwargs: object) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: object) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Dict]]:
+        """Latency histogram snapshots by host, then endpoint"""
+        with self._lock:
+            result: Dict[str, Dict[str, Dict]] = {}
+            for (host, endpoint), histogram in sorted(self._histograms.items()):
+                result.setdefault(host, {})[endpoint] = histogram.snapshot()
+            return result
+
+    def close(self) -> None:
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.close()
+
+
+def _delay(backoff: float, attempt: int, retry_after: Optional[str] = None) -> float:
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), MAX_RETRY_AFTER)
+    # Full jitter keeps clients that failed together from retrying together
+    return random.uniform(0, backoff * 2 ** attempt)
+
+
+def _host(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+_transport: Optional[Transport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> Transport:
+    """The process-wide transport, created on first use"""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport()
+    return _transport
+
+
+def request(method: str, url: str, **kwargs: object) -> requests.Response:
+    return get_transport().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs: object) -> requests.Response:
+    return get_transport().request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs: object) -> requests.Response:
+    return get_transport().request("POST", url, **kwargs)